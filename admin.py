@@ -0,0 +1,149 @@
+"""Local admin port: metrics scrape and an on-demand sampling profiler.
+
+GET /metrics                     Prometheus text format (metrics.py)
+GET /profile/start?interval=ms   start sampling every thread's stack (1 to 1000 ms, default 5)
+GET /profile                     hottest stacks so far, profiler keeps running
+GET /profile/stop                hottest stacks, then stop and reset
+
+The profiler is a background thread that reads sys._current_frames()
+every `interval` and counts collapsed stacks ("outer;...;inner", the
+format flame graph tools read). It costs nothing until started.
+
+Threads parked in a blocking call (recv, accept, select, a condition
+wait, ...) are not hot; their samples are left out unless the dump is
+asked for with ?idle=1.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import log
+
+logger = log.get_logger('admin')
+
+# Stacks listed in a profile dump
+TOP_STACKS = 40
+# Sampling intervals /profile/start accepts, in ms
+MIN_INTERVAL = 1
+MAX_INTERVAL = 1000
+# Innermost Python frames of threads waiting in C for I/O, a lock or a timer
+IDLE_FRAMES = frozenset(('threading.py:wait', 'outbound.py:recv', 'socket.py:accept', 'selectors.py:select',
+                         'queue.py:get', 'timers.py:run'))
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.running = False
+        self.thread = None
+
+    def start(self, interval=0.005):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.stacks.clear()
+            self.samples = 0
+            self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self, interval):
+        me = threading.get_ident()
+        while self.running:
+            frames = sys._current_frames()
+            collected = []
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename.rpartition("/")[2]}:{code.co_name}')
+                    frame = frame.f_back
+                idle = stack[0] in IDLE_FRAMES
+                collected.append((';'.join(reversed(stack)), idle))
+            with self.lock:
+                self.stacks.update(collected)
+                self.samples += 1
+            time.sleep(interval)
+
+    def dump(self, top=TOP_STACKS, idle=False):
+        with self.lock:
+            stacks = [(stack, count) for (stack, is_idle), count in self.stacks.most_common()
+                      if idle or not is_idle][:top]
+            samples = self.samples
+            elapsed = time.monotonic() - self.started if self.started else 0
+        lines = [f'# {samples} samples over {elapsed:.1f}s, running={self.running}']
+        lines.extend(f'{stack} {count}' for stack, count in stacks)
+        return '\n'.join(lines) + '\n'
+
+
+class AdminHandler(BaseHTTPRequestHandler):
+    server_version = 'rps-admin'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        admin = self.server.admin
+        if url.path == '/metrics':
+            self.reply(200, admin.metrics.render(), 'text/plain; version=0.0.4')
+        elif url.path == '/profile/start':
+            try:
+                interval = float(query.get('interval', ['5'])[0])
+            except ValueError:
+                interval = None
+            if interval is None or not MIN_INTERVAL <= interval <= MAX_INTERVAL:
+                self.reply(400, f"interval is {MIN_INTERVAL} to {MAX_INTERVAL} ms\n")
+                return
+            started = admin.profiler.start(interval / 1000)
+            self.reply(200 if started else 409, "started\n" if started else "already running\n")
+        elif url.path == '/profile':
+            self.reply(200, admin.profiler.dump(idle='idle' in query))
+        elif url.path == '/profile/stop':
+            admin.profiler.stop()
+            self.reply(200, admin.profiler.dump(idle='idle' in query))
+        else:
+            self.reply(404, "not found\n")
+
+    def reply(self, status, text, content_type='text/plain'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("admin %s", format % args)
+
+
+class AdminServer:
+    def __init__(self, metrics, host='127.0.0.1', port=0):
+        self.metrics = metrics
+        self.profiler = SamplingProfiler()
+        self.httpd = ThreadingHTTPServer((host, port), AdminHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.admin = self
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logger.info("Admin port on %s:%d (/metrics, /profile)", *self.httpd.server_address[:2])
@@ -0,0 +1,267 @@
+"""Columnar, memory-mapped archive of played rounds.
+
+Rounds leave the round log (history.py) in batches: each log compaction
+seals everything recorded since the previous one into a new immutable
+segment, archive/seg-<generation>.col. A segment has one row per player
+per round (a PvP round gives two rows, one from each side), grouped by
+player and in time order within a player, stored column by column:
+
+header    magic, version, player count, row count
+players   u32 ids present in the segment, sorted
+starts    u64 first row of each of those players, plus the row count
+time      u64 ms
+opponent  u32 player id, BOT for the bot
+mine, theirs, result   u8 codes (protocol.CHOICES / RESULTS order)
+
+The file is mapped read-only and columns are read in place (NumPy views
+when NumPy is installed, memoryviews otherwise). A query does one
+binary search in `players` per segment and then only touches that
+player's row range, so its cost does not depend on how many rounds are
+stored. Aggregates count codes over the range (numpy.bincount, or
+bytes.count per code), and head-to-head filters the opponent column
+(a vectorized compare, or bytes.find of the packed id).
+
+Rows not sealed yet are kept per player in growable arrays (Tail) with
+the same columns.
+"""
+import glob
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+# Try to import NumPy for the vectorized path; the memoryview path needs nothing
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+HEADER = struct.Struct('<4sIQQ')
+MAGIC = b'RPSC'
+VERSION = 1
+BOT = 0xffffffff
+CODES = 4  # choices and results are 0-2, NO_CHOICE counted in the last slot
+NO_CHOICE = 0xff
+# Row ranges shorter than this skip NumPy: its per-call overhead outweighs the scan
+VECTOR_MIN = 4096
+# (column, array typecode), 8-byte columns first so every column stays aligned
+COLUMNS = (('time', 'Q'), ('opponent', 'I'), ('mine', 'B'), ('theirs', 'B'), ('result', 'B'))
+
+
+def layout(players, rows):
+    """Byte offset of every section of a segment with these counts"""
+    offsets = {}
+    offset = HEADER.size
+    offsets['players'] = offset
+    offset += (4 * players + 7) // 8 * 8
+    offsets['starts'] = offset
+    offset += 8 * (players + 1)
+    for name, typecode in COLUMNS:
+        offsets[name] = offset
+        offset += array(typecode).itemsize * rows
+    offsets['end'] = offset
+    return offsets
+
+
+def write_segment(path, players, starts, columns):
+    """Write a segment atomically.
+
+    players and starts are buffers of u32 / u64 values; columns maps every
+    COLUMNS name to an iterable of buffers written one after the other.
+    """
+    count = len(memoryview(players).cast('B')) // 4
+    rows = memoryview(starts).cast('B')[-8:].cast('Q')[0]
+    offsets = layout(count, rows)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, count, rows))
+        f.write(players)
+        f.write(bytes(offsets['starts'] - f.tell()))
+        f.write(starts)
+        for name, _ in COLUMNS:
+            assert f.tell() == offsets[name]
+            for chunk in columns[name]:
+                f.write(chunk)
+        assert f.tell() == offsets['end']
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class PlayerRows:
+    """Unsealed rows of one player"""
+
+    __slots__ = ('time', 'opponent', 'mine', 'theirs', 'result')
+
+    def __init__(self):
+        self.time = array('Q')
+        self.opponent = array('I')
+        self.mine = bytearray()
+        self.theirs = bytearray()
+        self.result = bytearray()
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, ms, opponent, mine, theirs, result):
+        self.time.append(ms)
+        self.opponent.append(opponent)
+        self.mine.append(mine)
+        self.theirs.append(theirs)
+        self.result.append(result)
+
+    def trim(self, keep):
+        drop = len(self.time) - keep
+        for name, _ in COLUMNS:
+            del getattr(self, name)[:drop]
+
+    def copy(self):
+        # Queries get copies: appending to an array with exported views would fail
+        return Rows(*(getattr(self, name)[:] for name, _ in COLUMNS))
+
+
+class Tail:
+    """Rows recorded since the last seal, per player.
+
+    With limit set (no archive behind it) each player keeps only about
+    the last limit rows.
+    """
+
+    def __init__(self, limit=None):
+        self.players = {}  # {player id: PlayerRows}
+        self.limit = limit
+
+    def add(self, player, ms, opponent, mine, theirs, result):
+        rows = self.players.get(player)
+        if rows is None:
+            rows = self.players[player] = PlayerRows()
+        rows.append(ms, opponent, mine, theirs, result)
+        if self.limit is not None and len(rows) >= 2 * self.limit:
+            rows.trim(self.limit)
+
+    def rows_of(self, player):
+        rows = self.players.get(player)
+        return rows.copy() if rows is not None else None
+
+
+class Rows:
+    """One player's rows from one source, column by column"""
+
+    __slots__ = ('time', 'opponent', 'mine', 'theirs', 'result')
+
+    def __init__(self, time, opponent, mine, theirs, result):
+        self.time = time
+        self.opponent = opponent
+        self.mine = mine
+        self.theirs = theirs
+        self.result = result
+
+    def __len__(self):
+        return len(self.time)
+
+    def against(self, opponent):
+        """Only the rows played against opponent"""
+        if HAS_NUMPY and isinstance(self.opponent, np.ndarray) and len(self.opponent) >= VECTOR_MIN:
+            index = np.flatnonzero(self.opponent == opponent)
+            return Rows(*(getattr(self, name)[index] for name, _ in COLUMNS))
+        raw = self.opponent.tobytes()
+        needle = struct.pack('=I', opponent)
+        index = []
+        found = raw.find(needle)
+        while found != -1:
+            if found % 4 == 0:
+                index.append(found // 4)
+                found = raw.find(needle, found + 4)
+            else:
+                found = raw.find(needle, found + 1)
+        return Rows(*([getattr(self, name)[i] for i in index] for name, _ in COLUMNS))
+
+    def last(self, count):
+        """Up to count rows, newest first, as (ms, opponent, mine, theirs, result)"""
+        end = len(self.time)
+        return [(int(self.time[i]), int(self.opponent[i]), int(self.mine[i]), int(self.theirs[i]),
+                 int(self.result[i])) for i in range(end - 1, max(end - count, 0) - 1, -1)]
+
+    def counts(self, name):
+        """How often each code 0-2 appears in a u8 column, anything else in the last slot"""
+        column = getattr(self, name)
+        if HAS_NUMPY and isinstance(column, np.ndarray) and len(column) >= VECTOR_MIN:
+            counts = np.bincount(column, minlength=256)
+            head = [int(counts[code]) for code in range(CODES - 1)]
+        else:
+            if not isinstance(column, (bytes, bytearray)):
+                column = bytes(column)
+            head = [column.count(code) for code in range(CODES - 1)]
+        return head + [len(column) - sum(head)]
+
+
+class Segment:
+    def __init__(self, path, use_numpy=HAS_NUMPY):
+        self.path = path
+        self.generation = int(os.path.basename(path)[4:-4])
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.player_count, self.row_count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} round segment")
+        self.use_numpy = use_numpy and HAS_NUMPY
+        offsets = layout(self.player_count, self.row_count)
+        self.players = self.column(offsets['players'], 'I', self.player_count)
+        self.starts = self.column(offsets['starts'], 'Q', self.player_count + 1)
+        self.columns = [self.column(offsets[name], typecode, self.row_count) for name, typecode in COLUMNS]
+
+    def column(self, offset, typecode, count):
+        if self.use_numpy:
+            return np.frombuffer(self.map, dtype=np.dtype(typecode), count=count, offset=offset)
+        view = memoryview(self.map)[offset:offset + array(typecode).itemsize * count]
+        return view.cast(typecode) if typecode != 'B' else view
+
+    def rows_of(self, player):
+        if self.use_numpy:
+            # A plain int key would make searchsorted convert the whole column first
+            i = int(self.players.searchsorted(np.uint32(player)))
+        else:
+            i = bisect_left(self.players, player)
+        if i == self.player_count or self.players[i] != player:
+            return None
+        start, end = int(self.starts[i]), int(self.starts[i + 1])
+        return Rows(*(column[start:end] for column in self.columns))
+
+
+class Archive:
+    """The sealed segments of a history directory, oldest first"""
+
+    def __init__(self, path, use_numpy=HAS_NUMPY):
+        self.path = path
+        self.use_numpy = use_numpy
+        os.makedirs(path, exist_ok=True)
+        self.segments = [Segment(p, use_numpy) for p in sorted(glob.glob(os.path.join(path, 'seg-*.col')))]
+
+    def __len__(self):
+        return sum(segment.row_count for segment in self.segments)
+
+    def segment_path(self, generation):
+        return os.path.join(self.path, f'seg-{generation:08d}.col')
+
+    def has(self, generation):
+        return any(segment.generation == generation for segment in self.segments)
+
+    def seal(self, tail, generation):
+        """Write tail as segment `generation`; returns the opened Segment (not yet in self.segments)"""
+        players = sorted(tail.players)
+        starts = array('Q', [0])
+        for player in players:
+            starts.append(starts[-1] + len(tail.players[player]))
+        columns = {name: [getattr(tail.players[player], name) for player in players] for name, _ in COLUMNS}
+        path = self.segment_path(generation)
+        write_segment(path, array('I', players), starts, columns)
+        return Segment(path, self.use_numpy)
+
+    def rows_of(self, player):
+        """player's rows in every segment, newest segment first"""
+        for segment in reversed(self.segments):
+            rows = segment.rows_of(player)
+            if rows is not None:
+                yield rows
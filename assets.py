@@ -0,0 +1,91 @@
+"""Pre-scaled image assets for the Tk client.
+
+The choice buttons show the full-size pictures next to this module
+(bua.png, ...) at IMAGE_SIZE. Scaling them takes PIL and tens of
+milliseconds, so each is rendered once into ASSET_DIR as a PNG, which Tk
+8.6 reads natively, named after the source's hash and the target size:
+
+    assets/bua-<sha256 prefix>-150x150.png
+
+scaled() finds that file by hashing the source, so an edited source is
+re-rendered rather than served stale, and builds it (importing PIL only
+then) if it is missing. The rendered files are checked in, so the client
+runs without PIL. Rebuild them all with:
+
+    python assets.py [--size 150]
+"""
+import argparse
+import glob
+import hashlib
+import os
+
+import log
+
+logger = log.get_logger('assets')
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSET_DIR = os.path.join(ROOT, 'assets')
+# Choice button pictures: {choice: source file next to this module}
+IMAGES = {'rock': 'bua.png', 'paper': 'bao.jpg', 'scissors': 'keo.png'}
+IMAGE_SIZE = (150, 150)
+
+
+def source_path(filename):
+    return os.path.join(ROOT, filename)
+
+
+def cached_path(filename, size, digest):
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(ASSET_DIR, f'{stem}-{digest[:16]}-{size[0]}x{size[1]}.png')
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def scaled(filename, size=IMAGE_SIZE):
+    """Path of a PNG of source filename at size, rendering it if needed; None if that is not possible"""
+    try:
+        path = cached_path(filename, size, file_digest(source_path(filename)))
+    except OSError as e:
+        logger.warning("Image %s missing: %s", filename, e)
+        return None
+    if os.path.exists(path):
+        return path
+    try:
+        return build(filename, size)
+    except ImportError:
+        logger.warning("%s is not in the asset cache and PIL is not installed to render it", filename)
+    except OSError as e:
+        logger.warning("Could not render %s: %s", filename, e)
+    return None
+
+
+def build(filename, size=IMAGE_SIZE):
+    """Render source filename at size into the cache, replacing older renders of it at that size"""
+    from PIL import Image
+
+    source = source_path(filename)
+    path = cached_path(filename, size, file_digest(source))
+    stem = os.path.splitext(filename)[0]
+    os.makedirs(ASSET_DIR, exist_ok=True)
+    for old in glob.glob(os.path.join(ASSET_DIR, f'{stem}-*-{size[0]}x{size[1]}.png')):
+        os.remove(old)
+    with Image.open(source) as img:
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        img.resize(size, Image.Resampling.LANCZOS).save(path, optimize=True)
+    logger.info("Rendered %s at %dx%d", filename, *size)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the client's images into the asset cache")
+    parser.add_argument('--size', type=int, default=IMAGE_SIZE[0], help="width and height in pixels")
+    args = parser.parse_args()
+    for filename in IMAGES.values():
+        print(build(filename, (args.size, args.size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""History queries against a large archive of sealed rounds.
+
+Builds a history directory holding --rounds rounds (sealed into
+segments of --segment-rounds, as log compaction would leave them)
+played by --players players, each mostly against nearby ids so
+head-to-head queries find rounds, plus one heavy player in 1% of all
+rounds. It then times, through HistoryStore, with NumPy views and with
+plain memoryviews:
+  - history: a player's last 100 rounds
+  - head_to_head: last 100 rounds against one opponent
+  - stats: win rate and choice mix over all of a player's rounds
+Building the archive needs NumPy; the queries do not.
+
+Usage: python benchmarks/bench_archive.py [--rounds 100000000] [--players 1000000] [--dir /tmp/rps-archive]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from archive import Archive, write_segment, BOT
+from history import HistoryStore, TOTALS, KIND_HEADER, COMPACT_EVERY
+
+# Opponents are drawn from this many ids around the player
+NEIGHBOURHOOD = 50
+
+
+def build_segment(path, rng, first_ms, rounds, players):
+    player = rng.integers(0, players, rounds, dtype=np.uint32)
+    heavy = rng.random(rounds) < 0.01
+    player[heavy] = 0
+    opponent = ((player.astype(np.int64) + rng.integers(1, NEIGHBOURHOOD, rounds)) % players).astype(np.uint32)
+    opponent[rng.random(rounds) < 0.1] = BOT
+    mine = rng.integers(0, 3, rounds, dtype=np.uint8)
+    theirs = rng.integers(0, 3, rounds, dtype=np.uint8)
+    result = ((mine.astype(np.int16) - theirs + 3) % 3).astype(np.uint8)  # 0 draw, 1 win, 2 lose
+    result = np.array([2, 0, 1], dtype=np.uint8)[result]  # to RESULTS order: win, lose, draw
+    ms = first_ms + np.arange(rounds, dtype=np.uint64)
+
+    # Every PvP round also gets a row from the opponent's side
+    pvp = opponent != BOT
+    flipped = np.array([1, 0, 2], dtype=np.uint8)
+    columns = {
+        'player': np.concatenate([player, opponent[pvp]]),
+        'time': np.concatenate([ms, ms[pvp]]),
+        'opponent': np.concatenate([opponent, player[pvp]]),
+        'mine': np.concatenate([mine, theirs[pvp]]),
+        'theirs': np.concatenate([theirs, mine[pvp]]),
+        'result': np.concatenate([result, flipped[result[pvp]]]),
+    }
+    order = np.lexsort((columns['time'], columns['player']))
+    columns = {name: column[order] for name, column in columns.items()}
+    ids, counts = np.unique(columns.pop('player'), return_counts=True)
+    starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+    write_segment(path, ids.astype(np.uint32), starts, {name: [column] for name, column in columns.items()})
+    return len(order)
+
+
+def build(directory, rounds, players, segment_rounds):
+    shutil.rmtree(directory, ignore_errors=True)
+    archive = Archive(os.path.join(directory, 'archive'))
+    with open(os.path.join(directory, 'names'), 'w', encoding='utf-8') as f:
+        f.writelines(f'"p{i}"\n' for i in range(players))
+    rng = np.random.default_rng(1)
+    generation = rows = 0
+    t = time.perf_counter()
+    for first in range(0, rounds, segment_rounds):
+        count = min(segment_rounds, rounds - first)
+        rows += build_segment(archive.segment_path(generation), rng, 1700000000000 + first, count, players)
+        generation += 1
+    with open(os.path.join(directory, 'rounds.log'), 'wb') as f:
+        f.write(TOTALS.pack(KIND_HEADER, generation, 0, 0, 0))
+    size = sum(os.path.getsize(os.path.join(directory, 'archive', name))
+               for name in os.listdir(os.path.join(directory, 'archive')))
+    return {'bench': 'build', 'rounds': rounds, 'rows': rows, 'segments': generation, 'players': players,
+            'bytes': size, 'build_s': round(time.perf_counter() - t, 1)}
+
+
+def timed(fn, args_list):
+    latencies = []
+    for args in args_list:
+        t = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - t)
+    latencies.sort()
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 3)
+    return {'p50_ms': pick(0.5), 'p99_ms': pick(0.99), 'max_ms': pick(1.0)}
+
+
+def query(directory, players, samples, use_numpy):
+    t = time.perf_counter()
+    store = HistoryStore(directory, use_numpy=use_numpy)
+    opened = time.perf_counter() - t
+    rng = random.Random(2)
+    names = [f'p{rng.randrange(1, players)}' for _ in range(samples)]
+    rivals = [(name, f'p{(int(name[1:]) + rng.randrange(1, NEIGHBOURHOOD)) % players}') for name in names]
+    results = {
+        'history': timed(lambda name: store.history(name, 100), [(name,) for name in names]),
+        'head_to_head': timed(lambda name, rival: store.history(name, 100, rival), rivals),
+        'stats': timed(store.stats, [(name,) for name in names]),
+        'stats_head_to_head': timed(store.stats, rivals),
+        'stats_heavy_player': timed(store.stats, [('p0',)] * 20),
+    }
+    rows = store.stats('p0')['rounds']
+    store.close()
+    return {'bench': 'query', 'numpy': use_numpy, 'open_s': round(opened, 2), 'heavy_player_rows': rows, **results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=100000000)
+    parser.add_argument('--players', type=int, default=1000000)
+    parser.add_argument('--segment-rounds', type=int, default=COMPACT_EVERY)
+    parser.add_argument('--samples', type=int, default=300)
+    parser.add_argument('--dir', default='/tmp/rps-archive')
+    parser.add_argument('--keep', action='store_true', help="reuse an existing --dir and leave it in place")
+    args = parser.parse_args()
+
+    if not (args.keep and os.path.exists(os.path.join(args.dir, 'rounds.log'))):
+        print(json.dumps(build(args.dir, args.rounds, args.players, args.segment_rounds)), flush=True)
+    try:
+        for use_numpy in (True, False):
+            print(json.dumps(query(args.dir, args.players, args.samples, use_numpy)), flush=True)
+    finally:
+        if not args.keep:
+            shutil.rmtree(args.dir)
+
+
+if __name__ == '__main__':
+    main()
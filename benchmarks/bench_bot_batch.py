@@ -0,0 +1,124 @@
+"""Rounds per second against the bot: play_bot vs play_bot_batch.
+
+One client plays for --seconds with requests back to back, first one
+play_bot per round, then play_bot_batch at each --sizes, in both wire
+formats. The engine is also timed in-process to show what the server
+side costs without the network.
+
+Usage: python benchmarks/bench_bot_batch.py [--sizes 1 100 10000] [--mode asyncio]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import BotEngine, HAS_NUMPY
+from protocol import NDJSON, CODECS
+from bench_slow_consumer import free_port, ROOT
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.codec = NDJSON
+        self.decoder = NDJSON.decoder()
+
+    async def recv(self):
+        while True:
+            msg = self.decoder.next_message()
+            if msg is not None:
+                return msg
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            self.decoder.feed(data)
+
+    def send(self, msg):
+        self.writer.write(self.codec.encode(msg))
+
+
+async def connect(port, protocol):
+    client = Client(*await asyncio.open_connection('127.0.0.1', port))
+    client.send({'type': 'connect', 'player_name': 'bench', 'protocols': [protocol]})
+    while True:
+        msg = await client.recv()
+        if msg['type'] == 'connect_ack':
+            break
+    client.codec = CODECS[msg.get('protocol', 'ndjson')]
+    client.decoder = client.codec.decoder(client.decoder.remaining())
+    return client
+
+
+async def play(client, size, seconds):
+    """Rounds played in `seconds`; size None means one play_bot per round"""
+    letters = ''.join(random.choice('rps') for _ in range(size or 1))
+    request = {'type': 'play_bot', 'choice': 'rock'} if size is None else {'type': 'play_bot_batch', 'choices': letters}
+    reply = 'game_result' if size is None else 'bot_batch_result'
+    rounds = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        client.send(request)
+        while (await client.recv())['type'] != reply:
+            pass
+        rounds += size or 1
+    return rounds
+
+
+async def run(port, protocol, sizes, seconds):
+    client = await connect(port, protocol)
+    results = []
+    for size in [None] + sizes:
+        rounds = await play(client, size, seconds)
+        results.append({'protocol': protocol, 'request': 'play_bot' if size is None else f'batch {size}',
+                        'rounds_per_s': round(rounds / seconds)})
+    client.writer.close()
+    return results
+
+
+def engine_rounds_per_s(size, use_numpy, seconds=1.0):
+    engine = BotEngine(use_numpy=use_numpy)
+    letters = ''.join(random.choice('rps') for _ in range(size))
+    rounds = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        engine.play_batch(letters)
+        rounds += size
+    return round(rounds / seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--mode', default='asyncio')
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        for use_numpy in (False, True) if HAS_NUMPY else (False,):
+            print(json.dumps({'engine': 'numpy' if use_numpy else 'bytes', 'batch': size,
+                              'rounds_per_s': engine_rounds_per_s(size, use_numpy)}), flush=True)
+
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', args.mode, '--log-level', 'warning',
+                             '--no-rate-limits'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        for protocol in ('ndjson', 'rpsb1'):
+            for result in asyncio.run(run(port, protocol, args.sizes, args.seconds)):
+                print(json.dumps(result), flush=True)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main()
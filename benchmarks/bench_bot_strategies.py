@@ -0,0 +1,80 @@
+"""Bot strategy cost, memory and strength.
+
+- bytes per BotSession, measured with tracemalloc over --sessions live
+  sessions (the bot's whole memory for that many concurrent players)
+- ns per move (pick + update) for every strategy
+- the bot's win rate against a few scripted players
+
+Usage: python benchmarks/bench_bot_strategies.py [--sessions 100000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import BotEngine, BotSession, STRATEGIES, OUTCOMES, LOSE
+from protocol import CHOICES, CHOICE_CODES
+
+PLAYERS = {
+    'uniform': lambda i, rng: rng.choice(CHOICES),
+    'cycle': lambda i, rng: CHOICES[i % 3],
+    'rock_60pct': lambda i, rng: 'rock' if rng.random() < 0.6 else rng.choice(CHOICES),
+    'copy_pattern': lambda i, rng: ('rock', 'rock', 'paper', 'scissors', 'paper')[i % 5],
+}
+
+
+def session_memory(count, engine):
+    tracemalloc.start()
+    sessions = [BotSession() for _ in range(count)]
+    # Play a few rounds so every array has been written to
+    for session in sessions:
+        for choice in ('rock', 'paper', 'scissors'):
+            engine.play_round(session, 'ensemble', choice)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    list_overhead = sys.getsizeof(sessions)
+    return {'sessions': count, 'total_mb': round(used / 1e6, 1),
+            'bytes_per_session': round((used - list_overhead) / count)}
+
+
+def move_cost(engine, strategy, rounds=200000):
+    session = BotSession()
+    choices = [random.choice(CHOICES) for _ in range(1000)]
+    t = time.perf_counter()
+    for i in range(rounds):
+        engine.play_round(session, strategy, choices[i % 1000])
+    return round((time.perf_counter() - t) / rounds * 1e9)
+
+
+def win_rate(engine, strategy, player, rounds=5000):
+    rng = random.Random(1)
+    session = BotSession()
+    wins = 0
+    for i in range(rounds):
+        choice = PLAYERS[player](i, rng)
+        bot = engine.play_round(session, strategy, choice)
+        wins += OUTCOMES[CHOICE_CODES[choice]][CHOICE_CODES[bot]] == LOSE
+    return round(wins / rounds * 100, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100000)
+    args = parser.parse_args()
+
+    engine = BotEngine(seed=1)
+    print(json.dumps(session_memory(args.sessions, engine)), flush=True)
+    for strategy in STRATEGIES:
+        result = {'strategy': strategy, 'ns_per_move': move_cost(engine, strategy)}
+        for player in PLAYERS:
+            result[f'bot_win_pct_vs_{player}'] = win_rate(engine, strategy, player)
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""What --capture costs the server, and how a replay of its trace compares.
+
+Runs a load scenario through loadgen against a fresh server without and
+then with --capture, and replays the trace from the second run against
+a fresh server at each --speeds. Reported:
+
+  capture   per run: requests/s, play p50/p99 and server CPU seconds; for
+            the captured run also the trace's size, records and records
+            dropped because the writer fell behind
+  replay    per speed: how long the replay took against the captured
+            duration, requests/s, p50/p99 per request type, divergence
+            and lag (see replay.py)
+
+Servers run with --no-rate-limits, as loadgen and a sped-up replay need.
+
+Usage: python benchmarks/bench_capture.py [--mode asyncio] [--scenario steady_pvp] [--scale 0.2] [--speeds 1 10 max]
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from capture import read_trace, KIND_DROPPED
+from loadgen import load_scenario, run_scenario
+from replay import run_replay
+from run_scenarios import start_server, SCENARIOS
+from bench_server_modes import free_port
+from bench_rate_limit import cpu_seconds
+
+
+def load_run(scenario, mode, extra):
+    port = free_port()
+    proc = start_server(port, mode, 1, extra)
+    try:
+        cpu = cpu_seconds(proc.pid)
+        report = run_scenario(scenario, port=port)
+        cpu = cpu_seconds(proc.pid) - cpu
+    finally:
+        proc.send_signal(signal.SIGINT)  # As Ctrl-C: a capturing server writes out its queue first
+        proc.wait()
+    play = report['requests'].get('play', {})
+    return {'requests_per_s': report['requests_per_s'], 'play_p50_ms': play.get('p50_ms'),
+            'play_p99_ms': play.get('p99_ms'), 'server_cpu_s': round(cpu, 2)}
+
+
+def replay_run(path, mode, speed, settle):
+    port = free_port()
+    proc = start_server(port, mode, 1, [])
+    try:
+        report = run_replay(path, port=port, speed=speed, settle=settle)
+    finally:
+        proc.kill()
+        proc.wait()
+    return {'speed': report['speed'], 'captured_s': report['captured_s'], 'elapsed_s': report['elapsed_s'],
+            'requests_per_s': report['requests_per_s'],
+            'latency': {name: {'p50_ms': r['p50_ms'], 'p99_ms': r['p99_ms']} for name, r in report['requests'].items()},
+            'divergence': report['divergence'], 'lag': report.get('lag')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='asyncio')
+    parser.add_argument('--scenario', default='steady_pvp')
+    parser.add_argument('--scale', type=float, default=0.2, help="multiply every group's player count")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--speeds', nargs='+', default=['1', '10', 'max'])
+    parser.add_argument('--settle', type=float, default=2.0)
+    args = parser.parse_args()
+
+    scenario = load_scenario(os.path.join(SCENARIOS, f'{args.scenario}.json'), {'duration': args.duration},
+                             args.scale)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'trace.rpst')
+        plain = load_run(scenario, args.mode, [])
+        captured = load_run(scenario, args.mode, ['--capture', path])
+        _, records = read_trace(path)
+        captured.update({'trace_kb': round(os.path.getsize(path) / 1024), 'records': len(records),
+                         'dropped': sum(int(r[4]) for r in records if r[0] == KIND_DROPPED)})
+        print(json.dumps({'bench': 'capture', 'mode': args.mode, 'scenario': args.scenario,
+                          'off': plain, 'on': captured}), flush=True)
+        for speed in args.speeds:
+            result = replay_run(path, args.mode, None if speed == 'max' else float(speed), args.settle)
+            print(json.dumps({'bench': 'replay', 'mode': args.mode, 'scenario': args.scenario, **result}),
+                  flush=True)
+
+
+if __name__ == '__main__':
+    main()
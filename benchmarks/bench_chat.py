@@ -0,0 +1,171 @@
+"""Lobby chat with thousands of players in the channel, and what it does to play latency.
+
+--users players connect and sit in the lobby reading everything; --chatters
+of them post to the lobby channel at --chat-rate messages per second in
+total (each well within the per-connection chat limit). Meanwhile
+--pairs PvP pairs play a round every --interval seconds, first with the
+lobby quiet and then while it chats.
+
+The members live in a child process, so reading their sockets does not
+hold up the pairs' event loop. Run against a server with the default --chat-window (messages collected
+for a window, then sent as one pre-encoded blob per member) and with
+--chat-window 0 (a fanout for every message). Reported per server:
+
+  chat       messages posted per second, chat messages delivered per
+             second over all members (and the share of posted x members
+             that arrived), and post-to-delivery latency measured by one
+             member that parses every message
+  play       the pairs' round latency, quiet lobby and chatting lobby
+  server     CPU seconds and RSS while the lobby chatted
+
+Usage: python benchmarks/bench_chat.py [--mode asyncio] [--users 5000] [--chat-rate 100] [--seconds 10]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_slow_consumer import free_port, connect, start_match, summary
+from bench_server_modes import proc_status
+from bench_rate_limit import cpu_seconds, play_paced
+
+CHAT_MARKER = b'{"type": "chat", '
+CONNECT_BATCH = 100
+
+
+async def count_chat(player, counts):
+    """Read until closed, counting chat messages (a marker may straddle two reads)"""
+    tail = b''
+    try:
+        while True:
+            data = await player.reader.read(1 << 16)
+            if not data:
+                return
+            data = tail + data
+            counts[0] += data.count(CHAT_MARKER)
+            tail = data[-(len(CHAT_MARKER) - 1):]
+    except (ConnectionError, OSError):
+        pass
+
+
+async def probe(player, latencies):
+    """Parse every message; a chat's text is the time it was posted"""
+    try:
+        while True:
+            line = await player.reader.readline()
+            if not line:
+                return
+            msg = json.loads(line)
+            if msg['type'] == 'chat':
+                latencies.append((time.time() - float(msg['text'])) * 1000)
+    except (ConnectionError, OSError):
+        pass
+
+
+async def chatter(player, offset, interval, deadline, posted):
+    await asyncio.sleep(offset)  # Spread the chatters out over one interval
+    while time.perf_counter() < deadline:
+        player.send({'type': 'chat', 'channel': 'lobby', 'text': f'{time.time():.6f}'})
+        posted[0] += 1
+        await asyncio.sleep(interval)
+
+
+async def lobby(port, users, chatters, chat_rate, pipe):
+    """The lobby members: connect, read everything, chat on the parent's word"""
+    loop = asyncio.get_running_loop()
+    members = []
+    for start in range(0, users, CONNECT_BATCH):
+        members += await asyncio.gather(*[connect(port, f'u{i}')
+                                          for i in range(start, min(users, start + CONNECT_BATCH))])
+    counts = [0]
+    latencies = []
+    readers = [asyncio.ensure_future(probe(members[0], latencies))]
+    readers += [asyncio.ensure_future(count_chat(player, counts)) for player in members[1:]]
+    pipe.send('ready')
+    seconds = await loop.run_in_executor(None, pipe.recv)
+
+    posted = [0]
+    started = time.perf_counter()
+    every = chatters / chat_rate
+    await asyncio.gather(*[chatter(player, every * i / chatters, every, started + seconds, posted)
+                           for i, player in enumerate(members[-chatters:])])
+    await asyncio.sleep(1)  # Last windows drain
+    elapsed = time.perf_counter() - started
+    delivered = counts[0] + len(latencies)
+    expected = posted[0] * len(members)
+    pipe.send({'posted_per_s': round(posted[0] / seconds), 'delivered_per_s': round(delivered / elapsed),
+               'delivered_share': round(delivered / expected, 3) if expected else None,
+               'latency': summary(latencies) if latencies else None})
+    for reader in readers:
+        reader.cancel()
+
+
+def lobby_process(port, users, chatters, chat_rate, pipe):
+    asyncio.run(lobby(port, users, chatters, chat_rate, pipe))
+
+
+async def measure(port, pid, users, chatters, chat_rate, pairs, seconds, interval):
+    loop = asyncio.get_running_loop()
+    # The pairs join first, while the roster snapshot still fits in a line
+    healthy = [(await connect(port, f'a{i}'), await connect(port, f'b{i}')) for i in range(pairs)]
+    pipe, child_pipe = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=lobby_process, args=(port, users, chatters, chat_rate, child_pipe))
+    child.start()
+    await loop.run_in_executor(None, pipe.recv)
+
+    # Matches start once the lobby is full: filling it takes longer than a round may sit idle
+    for a, b in healthy:
+        await start_match(a, b)
+    await asyncio.sleep(1)  # Roster traffic from all those joins settles
+    quiet = []
+    await asyncio.gather(*[play_paced(a, b, seconds, interval, quiet) for a, b in healthy])
+
+    cpu = cpu_seconds(pid)
+    pipe.send(seconds)
+    chatting = []
+    await asyncio.gather(*[play_paced(a, b, seconds, interval, chatting) for a, b in healthy])
+    chat = await loop.run_in_executor(None, pipe.recv)
+    cpu = cpu_seconds(pid) - cpu
+    rss_kb, _ = proc_status(pid)
+    child.join()
+    return {'chat': chat, 'play': {'quiet': summary(quiet), 'chatting': summary(chatting)},
+            'server': {'cpu_s': round(cpu, 2), 'rss_mb': round(rss_kb / 1024, 1)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='asyncio')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--chatters', type=int, default=500)
+    parser.add_argument('--chat-rate', type=float, default=100, help="lobby messages per second, all chatters")
+    parser.add_argument('--pairs', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.2, help="seconds between a pair's rounds")
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    for window in (None, 0):
+        port = free_port()
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                                 '--port', str(port), '--mode', args.mode, '--accept-rate', '0',
+                                 '--log-level', 'error'] + ([] if window is None else ['--chat-window', str(window)]),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            time.sleep(1)
+            result = asyncio.run(measure(port, proc.pid, args.users, args.chatters, args.chat_rate, args.pairs,
+                                         args.seconds, args.interval))
+            print(json.dumps({'bench': 'chat', 'mode': args.mode, 'users': args.users,
+                              'chat_window': 'default' if window is None else window, **result}), flush=True)
+        finally:
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Tk client lobby: UI frame time while a big roster streams in.
+
+A lobby of --players names gets the traffic the server's Presence feed
+sends it: one player_list snapshot, then every 100 ms a roster_update
+with --churn status changes, joins and leaves. A feeder thread decodes
+the bytes and queues the messages exactly as the client's receiver
+thread does, --burst windows at a time (a client that fell behind, or a
+server flushing a backlog), while the main loop runs the client's pump.
+
+With a display, a real RPSClient sits in the lobby and each pump tick
+plus the redraw it causes is timed (p50, p99 and max against the 16 ms
+of a 60 Hz frame), next to what one full rebuild of a --players row
+Listbox costs, which is what every roster message did before the player
+list was virtualized.
+
+Without a display (no $DISPLAY) only the Tk-free part of a tick is
+timed: decoding a burst and collapsing it (client.collapse_roster).
+
+Usage: python benchmarks/bench_client_lobby.py [--players 10000] [--churn 200] [--burst 5] [--seconds 10]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client
+from protocol import NDJSON
+from bench_slow_consumer import summary
+
+STATUSES = ('idle', 'playing', 'waiting')
+
+
+def traffic(players, churn, windows, rng):
+    """Encoded snapshot followed by one encoded roster_update per window"""
+    roster = {f'player{i}': rng.choice(STATUSES) for i in range(players)}
+    snapshot = {'type': 'player_list', 'version': 0,
+                'players': [{'name': name, 'status': status} for name, status in roster.items()]}
+    updates = []
+    joined = players
+    for version in range(1, windows + 1):
+        events = []
+        for _ in range(churn):
+            roll = rng.random()
+            if roll < 0.05:
+                name = f'player{joined}'
+                joined += 1
+                roster[name] = 'idle'
+                events.append(['player_joined', name, 'idle'])
+            elif roll < 0.10:
+                name = f'player{rng.randrange(joined)}'
+                if roster.pop(name, None) is not None:
+                    events.append(['player_left', name])
+            else:
+                name = f'player{rng.randrange(joined)}'
+                if name in roster:
+                    roster[name] = rng.choice(STATUSES)
+                    events.append(['status_changed', name, roster[name]])
+        updates.append(NDJSON.encode({'type': 'roster_update', 'base': version - 1, 'version': version,
+                                      'events': events}))
+    return NDJSON.encode(snapshot), updates
+
+
+def decode(decoder, data):
+    decoder.feed(data)
+    messages = []
+    while True:
+        msg = decoder.next_message()
+        if msg is None:
+            return messages
+        messages.append(msg)
+
+
+def headless(snapshot, updates, burst):
+    decoder = NDJSON.decoder()
+    ticks = []
+    chunks = [snapshot + b''.join(updates[:burst])] + [b''.join(updates[i:i + burst])
+                                                        for i in range(burst, len(updates), burst)]
+    for data in chunks:
+        t = time.perf_counter()
+        client.collapse_roster(decode(decoder, data))
+        ticks.append((time.perf_counter() - t) * 1000)
+    return {'bench': 'lobby', 'tk': False, 'part': 'decode_collapse', 'ticks': summary(ticks)}
+
+
+def full_rebuild_ms(tk, players):
+    """What the lobby did per roster message before: refill a Listbox with every player"""
+    root = tk.Tk()
+    listbox = tk.Listbox(root)
+    listbox.pack()
+    rows = [f'player{i} [PLAYING]' for i in range(players)]
+    samples = []
+    for _ in range(5):
+        t = time.perf_counter()
+        listbox.delete(0, tk.END)
+        for row in rows:
+            listbox.insert(tk.END, row)
+        root.update_idletasks()
+        samples.append((time.perf_counter() - t) * 1000)
+    root.destroy()
+    return round(min(samples), 1)
+
+
+def with_tk(snapshot, updates, burst, seconds):
+    import tkinter as tk
+
+    rebuild = full_rebuild_ms(tk, len(json.loads(snapshot)['players']))
+    root = tk.Tk()
+    app = client.RPSClient(root)
+    app.handle_message({'type': 'connect_ack', 'name': 'player0'})
+    root.update()
+
+    ticks = []
+    pump = app.pump
+
+    def timed_pump():
+        t = time.perf_counter()
+        pump()
+        root.update_idletasks()
+        ticks.append((time.perf_counter() - t) * 1000)
+
+    app.pump = timed_pump  # The pump reschedules itself through the attribute
+
+    def feed():
+        decoder = NDJSON.decoder()
+        app.inbox.extend(decode(decoder, snapshot))
+        for i in range(0, len(updates), burst):
+            time.sleep(0.1 * burst)
+            app.inbox.extend(decode(decoder, b''.join(updates[i:i + burst])))
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline and (feeder.is_alive() or app.inbox):
+        root.update()
+        time.sleep(0.001)
+    shown = len(app.players)
+    root.destroy()
+    over = sum(1 for tick in ticks if tick > 16)
+    return {'bench': 'lobby', 'tk': True, 'part': 'pump_and_redraw', 'ticks': summary(ticks),
+            'ticks_over_16ms': over, 'players_at_end': shown, 'full_rebuild_ms': rebuild}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--churn', type=int, default=200, help="roster events per 100 ms window")
+    parser.add_argument('--burst', type=int, default=5, help="windows arriving at once")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    snapshot, updates = traffic(args.players, args.churn, int(args.seconds * 10), random.Random(args.seed))
+    print(json.dumps(headless(snapshot, updates, args.burst)), flush=True)
+    if os.environ.get('DISPLAY'):
+        print(json.dumps(with_tk(snapshot, updates, args.burst, args.seconds + 5)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Client cold start: time from launching Python to the login screen.
+
+Each run is a fresh interpreter, timed from spawn until it reports the
+login screen drawn. Two ways to start:
+
+  eager    what the client did before the asset cache: import PIL, open
+           the three full-size pictures (probing the working directory
+           for them) and LANCZOS-resize them to 150x150 before building
+           the login screen
+  lazy     the current client: no PIL, no images until the game screen
+           first needs them (then read from the asset cache)
+
+Also reported, per approach, the in-process cost of getting the three
+button images ready: PIL import + resize against hashing the sources and
+reading the cached PNGs (plus the Tk decode, with a display).
+
+Without a display (no $DISPLAY) Tk cannot start, so the runs stop right
+before tk.Tk() and the Tk parts are left out; 'tk' in the output says
+which it was.
+
+Usage: python benchmarks/bench_client_startup.py [--runs 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EAGER_IMAGES = '''
+from PIL import Image, ImageTk
+images = {}
+for key, filename in {'rock': 'bua.png', 'paper': 'bao.jpg', 'scissors': 'keo.png'}.items():
+    path = filename
+    for p in (os.getcwd(), os.path.join(os.getcwd(), 'bt-game-keo-bua-bao')):
+        if os.path.exists(os.path.join(p, filename)):
+            path = os.path.join(p, filename)
+            break
+    img = Image.open(path).resize((150, 150), Image.Resampling.LANCZOS)
+    images[key] = ImageTk.PhotoImage(img) if TK else img
+'''
+
+LAZY_IMAGES = '''
+import assets
+import tkinter as tk
+images = {key: tk.PhotoImage(file=assets.scaled(filename)) if TK else open(assets.scaled(filename), 'rb').read()
+          for key, filename in assets.IMAGES.items()}
+'''
+
+STARTUP = '''
+import os, sys, time
+TK = {tk}
+sys.path.insert(0, {root!r})
+os.chdir({root!r})
+import client
+if TK:
+    import tkinter as tk
+    root = tk.Tk()
+{images}
+if TK:
+    app = client.RPSClient(root)
+    root.update()
+print('ready', flush=True)
+'''
+
+IMAGES_ONLY = '''
+import os, sys, time
+TK = {tk}
+sys.path.insert(0, {root!r})
+os.chdir({root!r})
+import tkinter as tk
+import log  # Already loaded in the client by the time it wants images
+if TK:
+    root = tk.Tk()
+t = time.perf_counter()
+{images}
+print((time.perf_counter() - t) * 1000, flush=True)
+'''
+
+
+def startup(images, tk_available):
+    """Milliseconds from spawning the interpreter to the login screen"""
+    code = STARTUP.format(tk=tk_available, root=ROOT, images=images)
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE)
+    line = proc.stdout.readline()
+    elapsed = (time.perf_counter() - started) * 1000
+    proc.kill()
+    proc.wait()
+    if line.strip() != b'ready':
+        raise RuntimeError("client did not start")
+    return elapsed
+
+
+def images_only(images, tk_available):
+    code = IMAGES_ONLY.format(tk=tk_available, root=ROOT, images=images)
+    return float(subprocess.check_output([sys.executable, '-c', code]))
+
+
+def median(samples):
+    return round(statistics.median(samples), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15)
+    args = parser.parse_args()
+
+    tk_available = bool(os.environ.get('DISPLAY'))
+    for name, images in (('eager', EAGER_IMAGES), ('lazy', '')):
+        samples = [startup(images, tk_available) for _ in range(args.runs)]
+        print(json.dumps({'bench': 'startup', 'client': name, 'tk': tk_available, 'runs': args.runs,
+                          'median_ms': median(samples), 'min_ms': round(min(samples), 1)}), flush=True)
+    for name, images in (('pil_resize', EAGER_IMAGES), ('asset_cache', LAZY_IMAGES)):
+        samples = [images_only(images, tk_available) for _ in range(args.runs)]
+        print(json.dumps({'bench': 'images', 'source': name, 'tk': tk_available, 'runs': args.runs,
+                          'median_ms': median(samples), 'min_ms': round(min(samples), 1)}), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Measure play round-trip throughput for 1, 2 and 4 worker processes.
+
+Each run starts `server.py --workers N`, connects P pairs of players,
+has every pair challenge/accept, then all pairs play R rounds
+concurrently. Pairs land on shards at random (SO_REUSEPORT), so most
+matches with N > 1 are cross-shard. The load generator runs in its own
+processes (--clients) so it does not cap the server.
+
+Usage: python benchmarks/bench_cluster.py [--workers 1 2 4] [--pairs 200] [--rounds 50]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workers, mode):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', mode, '--workers', str(workers),
+                             '--no-rate-limits'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0 + 0.3 * workers)
+    return proc
+
+
+class Player:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.name = None
+
+    def send(self, msg):
+        self.writer.write((json.dumps(msg) + '\n').encode('utf-8'))
+
+    async def expect(self, msg_type):
+        while True:
+            msg = json.loads(await self.reader.readline())
+            if msg['type'] == msg_type:
+                return msg
+
+
+async def connect(port, name):
+    player = Player(*await asyncio.open_connection('127.0.0.1', port))
+    player.send({'type': 'connect', 'player_name': name})
+    player.name = (await player.expect('connect_ack'))['name']
+    return player
+
+
+async def play_rounds(a, b, rounds):
+    for _ in range(rounds):
+        a.send({'type': 'play', 'choice': 'rock'})
+        b.send({'type': 'play', 'choice': 'scissors'})
+        await asyncio.gather(a.expect('game_result'), b.expect('game_result'))
+
+
+async def client_main(port, first, pairs, rounds, start_at):
+    players = [await connect(port, f'bench{first + i}') for i in range(pairs * 2)]
+    matches = list(zip(players[::2], players[1::2]))
+    await asyncio.sleep(max(0, start_at - time.time() - 2))
+    for a, b in matches:
+        a.send({'type': 'challenge', 'target_name': b.name})
+        await b.expect('challenge_request')
+        b.send({'type': 'accept_challenge', 'challenger': a.name, 'accept': True})
+        await asyncio.gather(a.expect('game_start'), b.expect('game_start'))
+    await asyncio.sleep(max(0, start_at - time.time()))
+    t = time.perf_counter()
+    await asyncio.gather(*[play_rounds(a, b, rounds) for a, b in matches])
+    return time.perf_counter() - t
+
+
+def client_process(port, first, pairs, rounds, start_at, results):
+    results.put(asyncio.run(client_main(port, first, pairs, rounds, start_at)))
+
+
+def run_case(workers, pairs, rounds, clients, mode):
+    port = free_port()
+    proc = start_server(port, workers, mode)
+    try:
+        results = multiprocessing.Queue()
+        start_at = time.time() + 3 + pairs * 0.01
+        per_client = pairs // clients
+        procs = [multiprocessing.Process(target=client_process,
+                                         args=(port, i * per_client * 2, per_client, rounds, start_at, results))
+                 for i in range(clients)]
+        for p in procs:
+            p.start()
+        elapsed = max(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+        total = per_client * clients * rounds
+        return {'workers': workers, 'pairs': per_client * clients, 'rounds': total,
+                'elapsed_s': round(elapsed, 3), 'rounds_per_s': round(total / elapsed)}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--pairs', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=2, help="load generator processes")
+    parser.add_argument('--mode', default='asyncio')
+    args = parser.parse_args()
+
+    print(f"cpus: {os.cpu_count()}")
+    for workers in args.workers:
+        print(json.dumps(run_case(workers, args.pairs, args.rounds, args.clients, args.mode)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
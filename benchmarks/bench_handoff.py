@@ -0,0 +1,186 @@
+"""Hot restart (--handoff) with thousands of players connected, and what the players notice.
+
+--sessions players connect and sit in the lobby while --pairs PvP pairs
+play a round every --interval seconds. After --seconds of play a second
+server is started with the same --handoff path and takes over; the pairs
+keep playing through it and for --seconds after. Then every lobby
+player sends a play_bot, which only the new server can answer.
+
+The lobby lives in a child process, so reading its sockets does not hold
+up the pairs' event loop. Reported:
+
+  handoff    from the successor's log: the takeover in ms, split into the
+             old server freezing and draining (freeze), sockets and state
+             crossing over (transfer) and the new server adopting them
+             (adopt); the bytes of state; and the wall time from starting
+             the successor until the old server exited (mostly the new
+             process starting up, while the old one still serves)
+  clients    lobby connections the server closed (expected: none), and
+             play_bot replies from the lobby after the restart
+  play       the pairs' round latency before and across the restart
+
+Usage: python benchmarks/bench_handoff.py [--mode asyncio] [--sessions 10000] [--pairs 20] [--seconds 5]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_slow_consumer import free_port, connect, start_match, summary
+from bench_rate_limit import play_paced
+from loadgen import raise_fd_limit
+
+RESULT_MARKER = b'"type": "game_result"'
+CONNECT_BATCH = 100
+TOOK_OVER = re.compile(r'Took over (\d+) connections and (\d+) sessions in ([\d.]+) ms '
+                       r'\(freeze ([\d.]+) ms, transfer ([\d.]+) ms, adopt ([\d.]+) ms\)')
+HANDED_OVER = re.compile(r'\((\d+) bytes of state\)')
+
+
+async def count_replies(player, counts):
+    """Read until closed, counting game_result messages (a marker may straddle two reads) and closes"""
+    tail = b''
+    try:
+        while True:
+            data = await player.reader.read(1 << 16)
+            if not data:
+                break
+            data = tail + data
+            counts['replies'] += data.count(RESULT_MARKER)
+            tail = data[-(len(RESULT_MARKER) - 1):]
+    except (ConnectionError, OSError):
+        pass
+    counts['closed'] += 1
+
+
+async def lobby(port, sessions, settle, pipe):
+    """The lobby players: connect, read everything, play a bot once on the parent's word"""
+    loop = asyncio.get_running_loop()
+    members = []
+    readers = []
+    counts = {'replies': 0, 'closed': 0}
+    for start in range(0, sessions, CONNECT_BATCH):
+        batch = await asyncio.gather(*[connect(port, f'u{i}')
+                                       for i in range(start, min(sessions, start + CONNECT_BATCH))])
+        members += batch
+        readers += [asyncio.ensure_future(count_replies(player, counts)) for player in batch]
+    pipe.send('ready')
+    await loop.run_in_executor(None, pipe.recv)
+    closed = counts['closed']
+    started = time.perf_counter()
+    for player in members:
+        player.send({'type': 'play_bot', 'choice': 'rock'})
+    while counts['replies'] < len(members) and time.perf_counter() - started < settle:
+        await asyncio.sleep(0.05)
+    pipe.send({'closed_by_restart': closed, 'play_bot_replies': counts['replies'],
+               'play_bot_s': round(time.perf_counter() - started, 2)})
+    for reader in readers:
+        reader.cancel()
+
+
+async def skim(player):
+    """Read and discard lines until cancelled (a line read halfway stays buffered)"""
+    try:
+        while await player.reader.readline():
+            pass
+    except (ConnectionError, OSError):
+        pass
+
+
+def lobby_process(port, sessions, settle, pipe):
+    raise_fd_limit()
+    asyncio.run(lobby(port, sessions, settle, pipe))
+
+
+def start(port, mode, path, log):
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', mode, '--handoff', path, '--accept-rate', '0',
+                             '--no-rate-limits', '--log-level', 'info'],
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+async def measure(port, mode, path, procs, new_log, sessions, pairs, seconds, interval, settle):
+    loop = asyncio.get_running_loop()
+    # The pairs join first, while the roster snapshot still fits in a line, and skim the roster
+    # updates while the lobby fills so they are not dropped as slow consumers
+    healthy = [(await connect(port, f'a{i}'), await connect(port, f'b{i}')) for i in range(pairs)]
+    skimming = [asyncio.ensure_future(skim(player)) for pair in healthy for player in pair]
+    pipe, child_pipe = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=lobby_process, args=(port, sessions, settle, child_pipe))
+    child.start()
+    await loop.run_in_executor(None, pipe.recv)
+    for task in skimming:
+        task.cancel()
+    await asyncio.gather(*skimming, return_exceptions=True)
+    for a, b in healthy:
+        await start_match(a, b)
+    await asyncio.sleep(1)  # Roster traffic from all those joins settles
+
+    before = []
+    await asyncio.gather(*[play_paced(a, b, seconds, interval, before) for a, b in healthy])
+    across = []
+    playing = asyncio.gather(*[play_paced(a, b, seconds, interval, across) for a, b in healthy])
+    launched = time.perf_counter()
+    procs.append(start(port, mode, path, new_log))
+    await loop.run_in_executor(None, procs[0].wait)
+    restart_s = time.perf_counter() - launched
+    await playing
+
+    pipe.send('play')
+    clients = await loop.run_in_executor(None, pipe.recv)
+    child.join()
+    return {'restart_s': round(restart_s, 2)}, clients, {'before': summary(before), 'across': summary(across)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='asyncio')
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--pairs', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.2, help="seconds between a pair's rounds")
+    parser.add_argument('--seconds', type=float, default=5, help="of play before the restart, and across it")
+    parser.add_argument('--settle', type=float, default=30, help="seconds to wait for the lobby's play_bot replies")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'handoff.sock')
+        logs = [os.path.join(tmp, 'old.log'), os.path.join(tmp, 'new.log')]
+        files = [open(name, 'w') for name in logs]
+        procs = [start(port, args.mode, path, files[0])]
+        try:
+            time.sleep(1)
+            handoff, clients, play = asyncio.run(measure(
+                port, args.mode, path, procs, files[1], args.sessions, args.pairs,
+                args.seconds, args.interval, args.settle))
+            with open(logs[1]) as f:
+                took = TOOK_OVER.search(f.read())
+            with open(logs[0]) as f:
+                handed = HANDED_OVER.search(f.read())
+            if took is not None:
+                handoff.update(connections=int(took[1]), sessions=int(took[2]), total_ms=float(took[3]),
+                               freeze_ms=float(took[4]), transfer_ms=float(took[5]), adopt_ms=float(took[6]))
+            if handed is not None:
+                handoff['state_kb'] = round(int(handed[1]) / 1024)
+            print(json.dumps({'bench': 'handoff', 'mode': args.mode, 'sessions': args.sessions,
+                              'handoff': handoff, 'clients': clients, 'play': play}), flush=True)
+        finally:
+            for proc in procs:
+                proc.kill()
+                proc.wait()
+            for f in files:
+                f.close()
+
+
+if __name__ == '__main__':
+    main()
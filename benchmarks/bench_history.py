@@ -0,0 +1,140 @@
+"""Round history persistence and leaderboard cost.
+
+1. Recording rounds: time on the caller's thread with HistoryStore (group
+   commit by a writer thread) against writing and fsyncing each record
+   inline, plus how long the writer needs to get everything on disk.
+2. Leaderboard updates, rank lookups and top-10 reads with the RankedList index
+   against a plain sorted list (bisect + insort, O(N) per update).
+3. Compacting the resulting log (sealing its rounds into the archive) and
+   loading it back.
+
+Usage: python benchmarks/bench_history.py [--rounds 200000] [--players 10000 100000]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect_left, insort
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryStore, ROUND, KIND_ROUND
+from leaderboard import Leaderboard
+
+CHOICES = ('rock', 'paper', 'scissors')
+RESULTS = ('win', 'lose', 'draw')
+
+
+def random_rounds(count, players, rng):
+    return [(f'p{rng.randrange(players)}', f'p{rng.randrange(players)}', rng.choice(CHOICES), rng.choice(CHOICES),
+             rng.choice(RESULTS)) for _ in range(count)]
+
+
+def bench_recording(directory, rounds, inline_rounds):
+    store = HistoryStore(os.path.join(directory, 'group'))
+    t = time.perf_counter()
+    for args in rounds:
+        store.record_round(*args)
+    caller = time.perf_counter() - t
+    store.close()
+    durable = time.perf_counter() - t
+
+    # Baseline: every round written and fsynced before the caller goes on
+    path = os.path.join(directory, 'inline.log')
+    t = time.perf_counter()
+    with open(path, 'ab') as f:
+        for i in range(inline_rounds):
+            f.write(ROUND.pack(KIND_ROUND, 0, 1, 0, i, i + 1, int(time.time() * 1000)))
+            f.flush()
+            os.fsync(f.fileno())
+    inline = (time.perf_counter() - t) / inline_rounds
+    return {'bench': 'record', 'rounds': len(rounds),
+            'group_commit_caller_us': round(caller / len(rounds) * 1e6, 2),
+            'group_commit_durable_s': round(durable, 3),
+            'group_commit_rounds_per_s': round(len(rounds) / durable),
+            'inline_fsync_caller_us': round(inline * 1e6, 1),
+            'inline_fsync_rounds_per_s': round(1 / inline)}
+
+
+def bench_leaderboard(players, updates, rng):
+    board = Leaderboard()
+    ranking, stats = [], {}
+    names = [f'p{i}' for i in range(players)]
+    for name in names:
+        board.add(name)
+        stats[name] = [0, 0, 0]
+        insort(ranking, Leaderboard.key(name, stats[name]))
+    picks = [(rng.choice(names), rng.randrange(3)) for _ in range(updates)]
+
+    t = time.perf_counter()
+    for name, result in picks:
+        board.record(name, result)
+    ranked_update = (time.perf_counter() - t) / updates
+
+    t = time.perf_counter()
+    for name, result in picks:
+        key = Leaderboard.key(name, stats[name])
+        del ranking[bisect_left(ranking, key)]
+        stats[name][result] += 1
+        insort(ranking, Leaderboard.key(name, stats[name]))
+    list_update = (time.perf_counter() - t) / updates
+
+    t = time.perf_counter()
+    for name, _ in picks[:10000]:
+        board.rank(name)
+    ranked_rank = (time.perf_counter() - t) / min(updates, 10000)
+
+    t = time.perf_counter()
+    for _ in range(1000):
+        board.top(players // 2, 10)
+    ranked_page = (time.perf_counter() - t) / 1000
+    return {'bench': 'leaderboard', 'players': players,
+            'ranked_list_update_us': round(ranked_update * 1e6, 2), 'sorted_list_update_us': round(list_update * 1e6, 2),
+            'ranked_list_rank_us': round(ranked_rank * 1e6, 2), 'ranked_list_page_of_10_us': round(ranked_page * 1e6, 2)}
+
+
+def bench_compaction(directory):
+    path = os.path.join(directory, 'group')
+    before = os.path.getsize(os.path.join(path, 'rounds.log'))
+    t = time.perf_counter()
+    store = HistoryStore(path)
+    load = time.perf_counter() - t
+    t = time.perf_counter()
+    store.compact()
+    compact = time.perf_counter() - t
+    store.close()
+    after = os.path.getsize(os.path.join(path, 'rounds.log'))
+    t = time.perf_counter()
+    HistoryStore(path).close()
+    return {'bench': 'compaction', 'log_bytes_before': before, 'log_bytes_after': after,
+            'load_s': round(load, 3), 'compact_s': round(compact, 3),
+            'load_after_compact_s': round(time.perf_counter() - t, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=200000)
+    parser.add_argument('--history-players', type=int, default=2000)
+    parser.add_argument('--inline-rounds', type=int, default=2000)
+    parser.add_argument('--players', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--updates', type=int, default=20000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    directory = tempfile.mkdtemp(prefix='rps-history-')
+    try:
+        rounds = random_rounds(args.rounds, args.history_players, rng)
+        print(json.dumps(bench_recording(directory, rounds, args.inline_rounds)), flush=True)
+        print(json.dumps(bench_compaction(directory)), flush=True)
+    finally:
+        shutil.rmtree(directory)
+    for players in args.players:
+        print(json.dumps(bench_leaderboard(players, args.updates, rng)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""PvP play round trip with logging off, sampled and at full debug level.
+
+For every setting this starts a fresh server writing its log to a file,
+has --pairs matches play rounds back to back for --seconds and reports
+rounds/s and latency. It also times a single log call in-process against
+the print(..., flush=True) the handlers used to make.
+
+Usage: python benchmarks/bench_logging.py [--mode threaded] [--pairs 10]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log
+from bench_slow_consumer import connect, free_port, start_match, play_for, summary, ROOT
+
+SETTINGS = {
+    'off': ['--log-level', 'off'],
+    'info': ['--log-level', 'info'],
+    'sampled': ['--log-level', 'debug', '--log-sample', '*=0.01'],
+    'full': ['--log-level', 'debug'],
+}
+
+
+async def run(port, pairs, seconds):
+    matches = []
+    for i in range(pairs):
+        a, b = await connect(port, f'a{i}'), await connect(port, f'b{i}')
+        await start_match(a, b)
+        matches.append((a, b))
+    latencies = []
+    await asyncio.gather(*[play_for(a, b, seconds, latencies) for a, b in matches])
+    return latencies
+
+
+def run_setting(name, mode, pairs, seconds):
+    port = free_port()
+    with tempfile.NamedTemporaryFile(suffix='.log') as log_file:
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                                 '--port', str(port), '--mode', mode, '--no-rate-limits'] + SETTINGS[name],
+                                stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            time.sleep(1)
+            latencies = asyncio.run(run(port, pairs, seconds))
+        finally:
+            proc.kill()
+            proc.wait()
+        return {'logging': name, 'mode': mode, 'rounds_per_s': round(len(latencies) / seconds),
+                **summary(latencies), 'log_bytes': os.path.getsize(log_file.name)}
+
+
+def per_call_ns(fn, count=200000):
+    t = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return round((time.perf_counter() - t) / count * 1e9)
+
+
+def micro():
+    """ns per hot-path log statement"""
+    logger = log.get_logger('play')
+    result = {}
+    with open(os.devnull, 'w') as devnull:
+        result['loop_overhead_ns'] = per_call_ns(lambda i: None)
+        result['print_flush_ns'] = per_call_ns(
+            lambda i: print(f"[PLAY] {'alice'} chose: {'rock'}, Opponent socket: {True}", file=devnull, flush=True))
+        for name, level, sample in (('off', 'info', None), ('sampled', 'debug', ['*=0.01']),
+                                    ('full', 'debug', None)):
+            handler = log.setup_logging(level, sample, stream=devnull, queue_size=1 << 20)
+            result[f'log_{name}_ns'] = per_call_ns(
+                lambda i: logger.debug("%s chose: %s, opponent socket: %s", 'alice', 'rock', True))
+            log.stop_logging()
+            if handler is not None and handler.dropped:
+                result[f'log_{name}_dropped'] = handler.dropped
+    logging.getLogger('rps').setLevel(logging.NOTSET)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='threaded')
+    parser.add_argument('--pairs', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--settings', nargs='+', default=list(SETTINGS), choices=list(SETTINGS))
+    args = parser.parse_args()
+
+    print(json.dumps(micro()), flush=True)
+    for name in args.settings:
+        print(json.dumps(run_setting(name, args.mode, args.pairs, args.seconds)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""PvP round throughput with many simultaneous matches: one global lock vs per-match locks.
+
+Runs the server's request handlers in process against in-memory
+connections (messages are encoded but not written anywhere), with
+--threads threads each playing rounds in their share of --matches
+matches, while a lobby thread takes a roster snapshot every
+--snapshot-interval like a broadcast would. Compares
+  - global: every play holds the server lock end to end, as before
+    matches got their own lock
+  - per-match: the current server, plays only take their match's lock
+
+Under the GIL only one thread runs Python at a time, so what the
+per-match design removes is lock convoys and stalls behind the roster
+snapshot rather than adding parallelism; on a free-threaded build the
+gap is larger.
+
+Usage: python benchmarks/bench_match_locks.py [--matches 5000] [--threads 16] [--seconds 5]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outbound import Connection
+from server import RPSServer
+
+CHOICES = ('rock', 'paper', 'scissors')
+
+
+class NullConnection(Connection):
+    queue_depth = 0
+
+    def send(self, data, droppable=False):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class GlobalLockServer(RPSServer):
+    """The old locking: the whole play path runs under the one server lock"""
+
+    def handle_play(self, client_sock, request):
+        with self.lock:
+            super().handle_play(client_sock, request)
+
+
+def setup(server_cls, matches):
+    server = server_cls(mode='threaded')
+    pairs = []
+    for i in range(matches):
+        a, b = NullConnection(), NullConnection()
+        server.dispatch(a, {'type': 'connect', 'player_name': f'a{i}'})
+        server.dispatch(b, {'type': 'connect', 'player_name': f'b{i}'})
+        server.dispatch(a, {'type': 'challenge', 'target_name': f'b{i}'})
+        server.dispatch(b, {'type': 'accept_challenge', 'challenger': f'a{i}', 'accept': True})
+        pairs.append((a, b))
+    return server, pairs
+
+
+def run(server_cls, matches, threads, seconds, snapshot_interval):
+    server, pairs = setup(server_cls, matches)
+    deadline = time.perf_counter() + seconds
+    latencies = [[] for _ in range(threads)]
+    snapshots = []
+
+    def play(index):
+        mine = pairs[index::threads]
+        record = latencies[index].append
+        i = 0
+        while time.perf_counter() < deadline:
+            a, b = mine[i % len(mine)]
+            t = time.perf_counter()
+            server.dispatch(a, {'type': 'play', 'choice': CHOICES[i % 3]})
+            server.dispatch(b, {'type': 'play', 'choice': CHOICES[(i // 3) % 3]})
+            record(time.perf_counter() - t)
+            i += 1
+
+    def lobby():
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            server.lobby_clients()
+            snapshots.append(time.perf_counter() - t)
+            time.sleep(snapshot_interval)
+
+    workers = [threading.Thread(target=lobby)]
+    workers.extend(threading.Thread(target=play, args=(i,)) for i in range(threads))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    values = sorted(v for per_thread in latencies for v in per_thread)
+    pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * 1e6, 1)
+    return {'design': 'global' if server_cls is GlobalLockServer else 'per-match',
+            'matches': matches, 'threads': threads,
+            'rounds_per_s': round(len(values) / seconds),
+            'round_p50_us': pick(0.50), 'round_p99_us': pick(0.99),
+            'snapshots': len(snapshots), 'snapshot_max_ms': round(max(snapshots) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--matches', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--snapshot-interval', type=float, default=0.05)
+    args = parser.parse_args()
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    for server_cls in (GlobalLockServer, RPSServer):
+        result = run(server_cls, args.matches, args.threads, args.seconds, args.snapshot_interval)
+        result['gil'] = gil
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Matchmaking queue simulation: 50k players queueing, playing and queueing again.
+
+Every simulated player has a hidden skill (normal around 1500). All of them
+join the queue during the first --ramp seconds of simulated time; a match
+is --rounds rounds, each won by skill through the Elo formula (a third are
+draws) and each taking 2-6 s; after a match both players idle 0-10 s and
+queue again. Ratings start at 1500 and learn from the results, as on the
+server. The clock is simulated, so the run takes as long as the matchmaker
+code does.
+
+Reported per matchmaker, the bucketed Matchmaker and a linear scan over
+every queued ticket with the same pairing rule:
+  - join_us / sweep_ms: wall time per join() and per sweep() call
+  - queue depth, time to match and rating gap of the pairs (simulated)
+  - how well the ratings track the hidden skill at the end (correlation)
+
+Pairs form as soon as two queued players are within reach, so the queue
+itself stays short however many players there are. The second part
+(held_queue) therefore forces --held tickets into the queue with
+ratings too far apart to pair, and times a join plus leave against it.
+
+Usage: python benchmarks/bench_matchmaker.py [--players 50000] [--minutes 10]
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matchmaker import Matchmaker, Ratings, Ticket, SWEEP_INTERVAL
+
+
+class LinearQueue(Matchmaker):
+    """Baseline: tickets in one list, every join scans all of them for the nearest acceptable one"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.queue = []
+
+    def find(self, ticket, now, exclude=None):
+        window = self.window_of(ticket, now)
+        best, best_gap = None, None
+        for candidate in self.queue:
+            if candidate is exclude:
+                continue
+            gap = abs(candidate.rating - ticket.rating)
+            if (gap <= window or gap <= self.window_of(candidate, now)) and (best is None or gap < best_gap):
+                best, best_gap = candidate, gap
+        return best
+
+    def add(self, ticket):
+        self.queue.append(ticket)
+        self.tickets[ticket.sock] = ticket
+
+    def remove(self, ticket):
+        del self.tickets[ticket.sock]
+        self.queue.remove(ticket)
+
+
+def percentiles(values, scale=1.0, digits=3):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * scale, digits)
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': pick(1.0)}
+
+
+def correlation(xs, ys):
+    n = len(xs)
+    mx, my = sum(xs) / n, sum(ys) / n
+    cov = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    vx = sum((x - mx) ** 2 for x in xs)
+    vy = sum((y - my) ** 2 for y in ys)
+    return cov / (vx * vy) ** 0.5 if vx and vy else 0.0
+
+
+def simulate(queue, players, seconds, ramp, rounds, seed):
+    rng = random.Random(seed)
+    skill = [rng.gauss(1500, 250) for _ in range(players)]
+    ratings = Ratings()
+    events = [(rng.uniform(0, ramp), player) for player in range(players)]
+    heapq.heapify(events)
+    join_times, sweep_times, waits, gaps, depths = [], [], [], [], []
+    matches = 0
+
+    def play(now, a, b):
+        nonlocal matches
+        matches += 1
+        waits.extend((now - a.joined, now - b.joined))
+        gaps.append(abs(a.rating - b.rating))
+        p_a = 1 / (1 + 10 ** ((skill[b.sock] - skill[a.sock]) / 400))
+        duration = 0.0
+        for _ in range(rounds):
+            roll = rng.random()
+            result = 'draw' if roll < 1 / 3 else 'win' if roll < 1 / 3 + 2 / 3 * p_a else 'lose'
+            ratings.update(a.name, b.name, result)
+            duration += rng.uniform(2, 6)
+        for ticket in (a, b):
+            heapq.heappush(events, (now + duration + rng.uniform(0, 10), ticket.sock))
+
+    next_sweep = SWEEP_INTERVAL
+    while events and events[0][0] < seconds:
+        now, player = events[0]
+        if next_sweep <= now:
+            t = time.perf_counter()
+            pairs = queue.sweep(next_sweep)
+            sweep_times.append(time.perf_counter() - t)
+            depths.append(len(queue))
+            for a, b in pairs:
+                play(next_sweep, a, b)
+            next_sweep += SWEEP_INTERVAL
+            continue
+        heapq.heappop(events)
+        name = f'p{player}'
+        t = time.perf_counter()
+        ticket, opponent = queue.join(player, name, ratings.get(name), now)
+        join_times.append(time.perf_counter() - t)
+        if opponent is not None:
+            play(now, opponent, ticket)
+
+    names = [f'p{player}' for player in range(players)]
+    return {'joins': len(join_times), 'matches': matches,
+            'join_us': percentiles(join_times, 1e6, 2), 'sweep_ms': percentiles(sweep_times, 1e3),
+            'queue_depth': {'mean': round(sum(depths) / max(1, len(depths)), 1), 'max': max(depths, default=0)},
+            'wait_s': percentiles(waits), 'rating_gap': percentiles(gaps, digits=1),
+            'rating_skill_correlation': round(correlation([ratings.get(name) for name in names], skill), 3)}
+
+
+def held_queue(queue, held, samples=1000):
+    """Join/leave cost with held tickets that cannot pair with each other already queued"""
+    spacing = 3 * queue.max_window
+    for i in range(held):
+        # Straight in: joining one by one would cost the linear queue O(held ** 2)
+        queue.add(Ticket(i, f'h{i}', i * spacing, i * spacing // queue.bucket_width, 0.0))
+    assert len(queue) == held
+    rng = random.Random(2)
+    times = []
+    for i in range(samples):
+        rating = (rng.randrange(held) + 0.5) * spacing  # between two held tickets, out of reach of both
+        t = time.perf_counter()
+        queue.join(-1, 'probe', rating, 0.0)
+        queue.leave(-1)
+        times.append(time.perf_counter() - t)
+    return {'held': held, 'join_leave_us': percentiles(times, 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=50000)
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--ramp', type=float, default=10, help="seconds over which everyone first joins")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--held', type=int, default=50000)
+    parser.add_argument('--queues', nargs='+', choices=('bucketed', 'linear'), default=['bucketed', 'linear'])
+    args = parser.parse_args()
+
+    for name in args.queues:
+        queue = Matchmaker() if name == 'bucketed' else LinearQueue()
+        t = time.perf_counter()
+        result = simulate(queue, args.players, args.minutes * 60, args.ramp, args.rounds, seed=1)
+        print(json.dumps({'bench': 'matchmaker', 'queue': name, 'players': args.players,
+                          'simulated_s': args.minutes * 60, 'wall_s': round(time.perf_counter() - t, 1),
+                          **result}), flush=True)
+    for name in args.queues:
+        queue = Matchmaker(widen=0) if name == 'bucketed' else LinearQueue(widen=0)
+        print(json.dumps({'bench': 'held_queue', 'queue': name, **held_queue(queue, args.held)}), flush=True)
+
+
+if __name__ == '__main__':
+    main()
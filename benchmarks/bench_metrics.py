@@ -0,0 +1,69 @@
+"""Overhead of the metrics layer on the PvP play round trip.
+
+Runs the same PvP load against a server without an admin port, with one
+(metrics on), and with one while the sampling profiler is running.
+Settings are interleaved over --repeat runs so drift on the host hits
+them all alike.
+
+Usage: python benchmarks/bench_metrics.py [--mode threaded] [--pairs 10] [--repeat 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bench_slow_consumer import free_port, summary, ROOT
+from bench_logging import run
+
+SETTINGS = ('off', 'metrics', 'metrics+profiler')
+
+
+def run_setting(name, mode, pairs, seconds):
+    port, admin_port = free_port(), free_port()
+    extra = [] if name == 'off' else ['--admin-port', str(admin_port)]
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', mode, '--log-level', 'warning',
+                             '--no-rate-limits'] + extra,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        if name == 'metrics+profiler':
+            urllib.request.urlopen(f'http://127.0.0.1:{admin_port}/profile/start').read()
+        latencies = asyncio.run(run(port, pairs, seconds))
+        scrape = None
+        if name != 'off':
+            scrape = len(urllib.request.urlopen(f'http://127.0.0.1:{admin_port}/metrics').read())
+    finally:
+        proc.kill()
+        proc.wait()
+    return len(latencies) / seconds, summary(latencies), scrape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='threaded')
+    parser.add_argument('--pairs', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = {name: [] for name in SETTINGS}
+    for _ in range(args.repeat):
+        for name in SETTINGS:
+            results[name].append(run_setting(name, args.mode, args.pairs, args.seconds))
+    baseline = statistics.median(rate for rate, _, _ in results['off'])
+    for name in SETTINGS:
+        rate = statistics.median(rate for rate, _, _ in results[name])
+        p50 = statistics.median(s['p50_ms'] for _, s, _ in results[name])
+        print(json.dumps({'setting': name, 'mode': args.mode, 'rounds_per_s': round(rate),
+                          'vs_off_pct': round((rate / baseline - 1) * 100, 1), 'p50_ms': p50,
+                          'scrape_bytes': results[name][-1][2]}), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Roster broadcast traffic during a login burst.
+
+Starts a server, then N players connect as fast as possible. Every byte
+the clients receive is counted until the traffic has been quiet for a
+second. Three cases are compared:
+
+  before  legacy clients, --presence-window 0: a full player_list to
+          everyone on every change, as the server used to do
+  legacy  legacy clients, default window: full snapshots, coalesced
+  deltas  clients announcing roster_deltas, default window
+
+Usage: python benchmarks/bench_presence.py [--users 1000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Counter(asyncio.Protocol):
+    """Counts received bytes without parsing them"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def data_received(self, data):
+        self.stats['bytes'] += len(data)
+        self.stats['last'] = time.perf_counter()
+
+
+async def burst(port, users, deltas):
+    loop = asyncio.get_running_loop()
+    stats = {'bytes': 0, 'last': 0.0}
+    connect = {'type': 'connect'}
+    if deltas:
+        connect['features'] = ['roster_deltas']
+    transports = []
+    start = time.perf_counter()
+    for first in range(0, users, 200):
+        pending = [loop.create_connection(lambda: Counter(stats), '127.0.0.1', port)
+                   for _ in range(first, min(users, first + 200))]
+        for i, (transport, _) in enumerate(await asyncio.gather(*pending)):
+            connect['player_name'] = f'user{first + i}'
+            transport.write((json.dumps(connect) + '\n').encode('utf-8'))
+            transports.append(transport)
+    while time.perf_counter() - max(stats['last'], start) < 1.0:
+        await asyncio.sleep(0.1)
+    elapsed = stats['last'] - start
+    for transport in transports:
+        transport.close()
+    return stats['bytes'], elapsed
+
+
+def run_case(label, users, window, deltas):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', 'asyncio', '--presence-window', str(window),
+                             '--no-rate-limits'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        total, elapsed = asyncio.run(burst(port, users, deltas))
+    finally:
+        proc.kill()
+        proc.wait()
+    return {'case': label, 'users': users, 'window_s': window, 'bytes': total,
+            'burst_s': round(elapsed, 2), 'bytes_per_s': round(total / elapsed),
+            'bytes_per_user': round(total / users)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--window', type=float, default=0.1)
+    parser.add_argument('--cases', nargs='+', default=['before', 'legacy', 'deltas'])
+    args = parser.parse_args()
+
+    cases = {
+        'before': (0.0, False),
+        'legacy': (args.window, False),
+        'deltas': (args.window, True),
+    }
+    for label in args.cases:
+        window, deltas = cases[label]
+        print(json.dumps(run_case(label, args.users, window, deltas)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Encode/decode cost per message type, ndjson vs the rpsb1 binary frames.
+
+Decoding is timed on a stream of many messages fed in 4 KB chunks, the way
+the servers read sockets. 'ndjson (old)' is the str buffer re-split on every
+line that the server used before the protocol module.
+
+Usage: python benchmarks/bench_protocol.py [--count 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import NDJSON, BINARY
+
+MESSAGES = {
+    'play': {'type': 'play', 'choice': 'rock'},
+    'game_result': {'type': 'game_result', 'my_choice': 'rock', 'opponent_choice': 'paper', 'result': 'lose'},
+    'opponent_choosed': {'type': 'opponent_choosed'},
+    'challenge': {'type': 'challenge', 'target_player': 'player1234'},
+}
+
+
+def old_decode(chunks):
+    buffer = ''
+    count = 0
+    for data in chunks:
+        buffer += data.decode('utf-8')
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            if line.strip():
+                json.loads(line)
+                count += 1
+    return count
+
+
+def new_decode(codec, chunks):
+    decoder = codec.decoder()
+    count = 0
+    for data in chunks:
+        decoder.feed(data)
+        while decoder.next_message() is not None:
+            count += 1
+    return count
+
+
+def chunked(stream, size=4096):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def ns_per(fn, count):
+    t = time.perf_counter()
+    fn()
+    return round((time.perf_counter() - t) / count * 1e9)
+
+
+def run(name, msg, count):
+    result = {'message': name}
+    for codec in (NDJSON, BINARY):
+        frame = codec.encode(msg)
+        chunks = chunked(frame * count)
+        result[f'{codec.name}_bytes'] = len(frame)
+        result[f'{codec.name}_encode_ns'] = ns_per(lambda: [codec.encode(msg) for _ in range(count)], count)
+        result[f'{codec.name}_decode_ns'] = ns_per(lambda: new_decode(codec, chunks), count)
+        if codec is NDJSON:
+            result['ndjson_old_decode_ns'] = ns_per(lambda: old_decode(chunks), count)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    for name, msg in MESSAGES.items():
+        print(json.dumps(run(name, msg, args.count)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
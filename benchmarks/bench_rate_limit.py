@@ -0,0 +1,185 @@
+"""Play latency of healthy matches while abusive clients flood the server.
+
+Healthy PvP pairs play a round every --interval seconds from 127.0.0.1
+(well within the play limit), first alone and then while a separate
+process, connecting from 127.0.0.2, runs:
+
+  spam     --spammers connections pipelining play_bot, challenge and
+           get_leaderboard requests as fast as the socket takes them, and
+           reconnecting as soon as they are cut off
+  bigline  one connection sending a single line that never ends
+
+The run is repeated against a server with its default limits and one
+started with --no-rate-limits. Reported per server: the pairs' round
+latency (baseline and during the flood), the server's CPU seconds and
+RSS over the flood, how many connections the abusers opened, and the
+server's rps_rejected_total counters by kind (from its admin port).
+
+Usage: python benchmarks/bench_rate_limit.py [--mode asyncio] [--pairs 20] [--spammers 20]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_slow_consumer import free_port, encode, connect, start_match, summary
+from bench_server_modes import proc_status
+
+ABUSER_ADDRESS = '127.0.0.2'
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def drain(reader):
+    """Read and discard until the server closes the connection"""
+    try:
+        while await reader.read(1 << 16):
+            pass
+    except (ConnectionError, OSError):
+        pass
+
+
+async def spam(port, deadline, stats):
+    payload = b''.join([encode({'type': 'play_bot', 'choice': 'rock'})] * 8 +
+                       [encode({'type': 'challenge', 'target_name': 'a0'}),
+                        encode({'type': 'get_leaderboard'})]) * 100
+    while time.perf_counter() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port, local_addr=(ABUSER_ADDRESS, 0))
+        except OSError:
+            await asyncio.sleep(0.01)
+            continue
+        stats['connections'] += 1
+        closed = asyncio.ensure_future(drain(reader))
+        try:
+            writer.write(encode({'type': 'connect', 'player_name': 'spammer'}))
+            while time.perf_counter() < deadline and not closed.done():
+                writer.write(payload)
+                await writer.drain()
+                stats['bytes'] += len(payload)
+        except (ConnectionError, OSError):
+            pass
+        writer.close()
+        await closed
+
+
+async def bigline(port, deadline, stats):
+    chunk = b'x' * 65536
+    while time.perf_counter() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port, local_addr=(ABUSER_ADDRESS, 0))
+        except OSError:
+            await asyncio.sleep(0.01)
+            continue
+        stats['connections'] += 1
+        closed = asyncio.ensure_future(drain(reader))
+        try:
+            writer.write(b'{"type": "connect", "player_name": "')
+            while time.perf_counter() < deadline and not closed.done():
+                writer.write(chunk)
+                await writer.drain()
+                stats['bytes'] += len(chunk)
+                await asyncio.sleep(0.001)
+        except (ConnectionError, OSError):
+            pass
+        writer.close()
+        await closed
+
+
+async def abuse(port, spammers, seconds):
+    deadline = time.perf_counter() + seconds
+    stats = {'connections': 0, 'bytes': 0}
+    await asyncio.gather(bigline(port, deadline, stats), *[spam(port, deadline, stats) for _ in range(spammers)])
+    return stats
+
+
+def abuser_process(port, spammers, seconds, pipe):
+    pipe.send(asyncio.run(abuse(port, spammers, seconds)))
+
+
+def rejected(admin_port):
+    text = urllib.request.urlopen(f'http://127.0.0.1:{admin_port}/metrics').read().decode()
+    counts = {}
+    for line in text.splitlines():
+        if line.startswith('rps_rejected_total{'):
+            kind = line.split('"')[1]
+            counts[kind] = int(float(line.split()[-1]))
+    return counts
+
+
+async def play_paced(a, b, seconds, interval, latencies):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        t = time.perf_counter()
+        a.send({'type': 'play', 'choice': 'rock'})
+        b.send({'type': 'play', 'choice': 'paper'})
+        await asyncio.gather(a.expect('game_result'), b.expect('game_result'))
+        latencies.append((time.perf_counter() - t) * 1000)
+        await asyncio.sleep(max(0, interval - (time.perf_counter() - t)))
+
+
+async def measure(port, pid, pairs, spammers, seconds, interval):
+    loop = asyncio.get_running_loop()
+    healthy = []
+    for i in range(pairs):
+        a, b = await connect(port, f'a{i}'), await connect(port, f'b{i}')
+        await start_match(a, b)
+        healthy.append((a, b))
+
+    baseline = []
+    await asyncio.gather(*[play_paced(a, b, seconds, interval, baseline) for a, b in healthy])
+
+    pipe, child_pipe = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=abuser_process, args=(port, spammers, seconds, child_pipe))
+    cpu = cpu_seconds(pid)
+    child.start()
+    during = []
+    await asyncio.gather(*[play_paced(a, b, seconds, interval, during) for a, b in healthy])
+    cpu = cpu_seconds(pid) - cpu
+    rss_kb, _ = proc_status(pid)
+    abusers = await loop.run_in_executor(None, pipe.recv)
+    child.join()
+    return {'baseline': summary(baseline), 'during_flood': summary(during), 'server_cpu_s': round(cpu, 2),
+            'server_rss_mb': round(rss_kb / 1024, 1), 'abuser_connections': abusers['connections'],
+            'abuser_mb_sent': round(abusers['bytes'] / 2 ** 20, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='asyncio')
+    parser.add_argument('--pairs', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.2, help="seconds between a pair's rounds")
+    parser.add_argument('--spammers', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    for limits in (True, False):
+        port, admin_port = free_port(), free_port()
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                                 '--port', str(port), '--mode', args.mode, '--admin-port', str(admin_port),
+                                 '--log-level', 'error'] + ([] if limits else ['--no-rate-limits']),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            time.sleep(1)
+            result = asyncio.run(measure(port, proc.pid, args.pairs, args.spammers, args.seconds, args.interval))
+            print(json.dumps({'bench': 'flood', 'mode': args.mode, 'rate_limits': limits, **result,
+                              'rejected': rejected(admin_port)}), flush=True)
+        finally:
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Connect and challenge lookup cost as the number of players grows.
+
+Compares the old linear scans over the {socket: info} dict with the
+PlayerRegistry name/status indexes, timing the two operations done under
+the server lock: allocating a name on connect and resolving a challenge
+target by name.
+
+Usage: python benchmarks/bench_registry.py [--sizes 1000 10000 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from registry import PlayerRegistry
+
+
+def linear_connect(clients, sock, name):
+    if any(info['name'] == name for info in clients.values()):
+        name = f"{name}_{int(time.time())}"
+    clients[sock] = {'name': name, 'status': 'idle', 'opponent': None, 'choice': None}
+    return name
+
+
+def linear_find(clients, name, status):
+    for sock, info in clients.items():
+        if info['name'] == name and info['status'] == status:
+            return sock
+    return None
+
+
+def registry_connect(registry, sock, name):
+    name = registry.allocate_name(name)
+    registry.add(sock, name)
+    return name
+
+
+def per_op_us(fn, ops):
+    t = time.perf_counter()
+    for args in ops:
+        fn(*args)
+    return (time.perf_counter() - t) / len(ops) * 1e6
+
+
+def run(size, samples):
+    clients = {}
+    registry = PlayerRegistry()
+    for i in range(size):
+        clients[object()] = {'name': f'player{i}', 'status': 'idle', 'opponent': None, 'choice': None}
+        registry_connect(registry, object(), f'player{i}')
+
+    # Targets spread over the whole roster; new logins reuse existing names
+    targets = [f'player{i}' for i in range(0, size, max(1, size // samples))]
+    return {
+        'players': size,
+        'connect_linear_us': round(per_op_us(lambda n: linear_connect(clients, object(), n), [(t,) for t in targets]), 2),
+        'connect_registry_us': round(per_op_us(lambda n: registry_connect(registry, object(), n), [(t,) for t in targets]), 2),
+        'challenge_linear_us': round(per_op_us(lambda n: linear_find(clients, n, 'idle'), [(t,) for t in targets]), 2),
+        'challenge_registry_us': round(per_op_us(lambda n: registry.find(n, 'idle'), [(t,) for t in targets]), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+    for size in args.sizes:
+        print(json.dumps(run(size, args.samples)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
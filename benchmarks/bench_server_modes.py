@@ -0,0 +1,130 @@
+"""Compare the threaded and asyncio server modes under many idle connections.
+
+For every mode and connection count this starts a fresh server process,
+opens N lobby connections, then measures:
+  - time to open all connections
+  - server RSS and OS thread count
+  - play_bot round-trip latency from a sample of connections
+  - burst throughput when every connection sends one play_bot at once
+
+Usage: python benchmarks/bench_server_modes.py [--counts 1000 5000 10000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLAY_BOT = (json.dumps({'type': 'play_bot', 'choice': 'rock'}) + '\n').encode('utf-8')
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def proc_status(pid):
+    """Return (rss_kb, threads) from /proc"""
+    rss, threads = 0, 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+def start_server(mode, port):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'),
+                             '--host', '127.0.0.1', '--port', str(port), '--mode', mode, '--no-rate-limits'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"server ({mode}) did not start")
+
+
+async def round_trip(reader, writer):
+    writer.write(PLAY_BOT)
+    await reader.readline()
+
+
+async def run_case(mode, count):
+    port = free_port()
+    proc = start_server(mode, port)
+    conns = []
+    try:
+        t0 = time.perf_counter()
+        for start in range(0, count, 500):
+            batch = await asyncio.gather(*[asyncio.open_connection('127.0.0.1', port)
+                                           for _ in range(start, min(count, start + 500))])
+            conns.extend(batch)
+        connect_time = time.perf_counter() - t0
+        await asyncio.sleep(0.5)
+        rss, threads = proc_status(proc.pid)
+
+        latencies = []
+        step = max(1, count // 200)
+        for reader, writer in conns[::step]:
+            t = time.perf_counter()
+            await round_trip(reader, writer)
+            latencies.append((time.perf_counter() - t) * 1000)
+        latencies.sort()
+
+        t = time.perf_counter()
+        await asyncio.gather(*[round_trip(r, w) for r, w in conns])
+        burst = time.perf_counter() - t
+
+        return {
+            'mode': mode,
+            'connections': count,
+            'connect_s': round(connect_time, 3),
+            'rss_mb': round(rss / 1024, 1),
+            'threads': threads,
+            'rtt_p50_ms': round(statistics.median(latencies), 3),
+            'rtt_p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 3),
+            'burst_rps': round(count / burst),
+        }
+    finally:
+        for _, writer in conns:
+            writer.close()
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'asyncio'])
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    for count in args.counts:
+        if count + 100 > limit:
+            print(f"skipping {count}: fd limit is {limit}")
+            continue
+        for mode in args.modes:
+            print(json.dumps(asyncio.run(run_case(mode, count))), flush=True)
+
+
+if __name__ == '__main__':
+    main()
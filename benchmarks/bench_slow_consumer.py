@@ -0,0 +1,156 @@
+"""Play latency of healthy matches while one client stops reading.
+
+A "stalled" player joins a PvP match with a tiny receive buffer and never
+reads its socket. Its opponent floods `play`, so the server keeps queueing
+opponent_choosed messages for it. Meanwhile several healthy pairs play
+rounds back to back and record their round-trip latency, first without
+the flood and then with it.
+
+With the outbound queues the stalled client is cut off once it passes the
+hard limit, and nobody else's sends block behind it.
+
+Usage: python benchmarks/bench_slow_consumer.py [--mode threaded] [--pairs 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def encode(msg):
+    return (json.dumps(msg) + '\n').encode('utf-8')
+
+
+class Player:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.name = None
+
+    def send(self, msg):
+        self.writer.write(encode(msg))
+
+    async def expect(self, msg_type):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError(f"closed while waiting for {msg_type}")
+            msg = json.loads(line)
+            if msg['type'] == msg_type:
+                return msg
+
+
+async def connect(port, name, rcvbuf=None):
+    sock = socket.socket()
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.connect(('127.0.0.1', port))
+    player = Player(*await asyncio.open_connection(sock=sock))
+    player.send({'type': 'connect', 'player_name': name, 'features': ['roster_deltas']})
+    player.name = (await player.expect('connect_ack'))['name']
+    return player
+
+
+async def start_match(a, b):
+    a.send({'type': 'challenge', 'target_name': b.name})
+    await b.expect('challenge_request')
+    b.send({'type': 'accept_challenge', 'challenger': a.name, 'accept': True})
+    await asyncio.gather(a.expect('game_start'), b.expect('game_start'))
+
+
+async def play_for(a, b, seconds, latencies):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        t = time.perf_counter()
+        a.send({'type': 'play', 'choice': 'rock'})
+        b.send({'type': 'play', 'choice': 'paper'})
+        await asyncio.gather(a.expect('game_result'), b.expect('game_result'))
+        latencies.append((time.perf_counter() - t) * 1000)
+
+
+async def flood(player, seconds):
+    burst = encode({'type': 'play', 'choice': 'rock'}) * 50
+    deadline = time.perf_counter() + seconds
+    sent = 0
+    while time.perf_counter() < deadline:
+        player.writer.write(burst)
+        sent += 50
+        await player.writer.drain()
+        await asyncio.sleep(0.01)
+    return sent
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    return {'rounds': len(latencies),
+            'p50_ms': round(latencies[len(latencies) // 2], 3),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 3),
+            'max_ms': round(latencies[-1], 3)}
+
+
+async def run(port, pairs, seconds):
+    healthy = []
+    for i in range(pairs):
+        a, b = await connect(port, f'a{i}'), await connect(port, f'b{i}')
+        await start_match(a, b)
+        healthy.append((a, b))
+    stalled = await connect(port, 'stalled', rcvbuf=4096)
+    flooder = await connect(port, 'flooder')
+    await start_match(flooder, stalled)
+
+    baseline = []
+    await asyncio.gather(*[play_for(a, b, seconds, baseline) for a, b in healthy])
+
+    during = []
+    results = await asyncio.gather(flood(flooder, seconds),
+                                   *[play_for(a, b, seconds, during) for a, b in healthy])
+
+    # Did the server cut the stalled client off? Its socket ends with EOF/reset.
+    stalled_closed = False
+    try:
+        while await asyncio.wait_for(stalled.reader.read(1 << 20), 2):
+            pass
+        stalled_closed = True
+    except (ConnectionError, asyncio.TimeoutError):
+        stalled_closed = not isinstance(sys.exc_info()[1], asyncio.TimeoutError)
+    return {'baseline': summary(baseline), 'during_flood': summary(during),
+            'flood_messages': results[0], 'stalled_client_disconnected': stalled_closed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='threaded')
+    parser.add_argument('--pairs', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--limit', type=int, default=256 * 1024, help="server --outbound-limit")
+    args = parser.parse_args()
+
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', args.mode,
+                             '--outbound-high-water', str(args.limit // 4), '--outbound-limit', str(args.limit),
+                             '--no-rate-limits'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        result = asyncio.run(run(port, args.pairs, args.seconds))
+        print(json.dumps({'mode': args.mode, **result}))
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main()
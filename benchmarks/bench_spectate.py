@@ -0,0 +1,201 @@
+"""Spectator fanout: cost per event and the players' latency while watched.
+
+Two parts:
+
+  fanout   in process: one game_result-sized event to --spectators
+           connections (half ndjson, half rpsb1), serialized for each
+           spectator as a per-viewer send_message() would, against one
+           spectators.Audience pass sharing one bytes object per format
+  match    a server with one PvP pair playing rounds back to back,
+           first unwatched, then with --spectators watching (from a
+           separate process), --stalled of whom stop reading. Reports
+           the pair's round latency, and whether the stalled
+           spectators, once they read again, got a snapshot to catch up
+           from.
+
+Usage: python benchmarks/bench_spectate.py [--mode asyncio] [--spectators 2000] [--stalled 200]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from outbound import Connection
+from protocol import BINARY
+from spectators import Audience
+from bench_slow_consumer import free_port, connect, start_match, summary
+
+
+class NullConnection(Connection):
+    """Outbound side that accepts everything and keeps nothing"""
+
+    queue_depth = 0
+
+    def send(self, data, droppable=False):
+        return len(data) if self.admit(len(data), droppable) else 0
+
+
+class Inline:
+    """Stands in for the server: runs call_later callbacks when asked"""
+
+    def __init__(self):
+        self.calls = []
+
+    def call_later(self, delay, callback):
+        self.calls.append(callback)
+
+    def run(self):
+        while self.calls:
+            self.calls.pop(0)()
+
+
+def fanout(spectators, events):
+    conns = [NullConnection() for _ in range(spectators)]
+    for conn in conns[::2]:
+        conn.codec = BINARY
+    event = {'type': 'spectate_update', 'seq': 1, 'event': 'result', 'choices': ['rock', 'paper'],
+             'winner': 'bob', 'timeout': False, 'score': [3, 4], 'draws': 1}
+
+    t = time.perf_counter()
+    for _ in range(events):
+        for conn in conns:
+            conn.send_message(event, droppable=True)
+    naive = time.perf_counter() - t
+
+    server = Inline()
+    audience = Audience(server, {'players': ['alice', 'bob'], 'score': [3, 3], 'draws': 1, 'round': 7, 'chosen': []})
+    for conn in conns:
+        audience.subscribe(conn)
+    server.run()  # Everyone's first snapshot
+    t = time.perf_counter()
+    for _ in range(events):
+        audience.publish({k: v for k, v in event.items() if k not in ('type', 'seq')}, score=[3, 4])
+        server.run()
+    shared = time.perf_counter() - t
+
+    per_event = lambda seconds: round(seconds / events * 1000, 3)
+    return {'bench': 'fanout', 'spectators': spectators, 'events': events,
+            'per_viewer_encode_ms_per_event': per_event(naive), 'shared_bytes_ms_per_event': per_event(shared),
+            'us_per_spectator': round(shared / events / spectators * 1e6, 3)}
+
+
+class Watcher(asyncio.Protocol):
+    """A spectator that only counts what it gets"""
+
+    def __init__(self, name):
+        self.name = name
+        self.transport = None
+        self.snapshots = 0
+        self.updates = 0
+        self.tail = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        data = self.tail + data
+        self.snapshots += data.count(b'"spectate_state"')
+        self.updates += data.count(b'"spectate_update"')
+        self.tail = data[-20:]  # A type name split across reads is counted once it is whole
+
+
+async def play_rounds(a, b, rounds):
+    latencies = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        a.send({'type': 'play', 'choice': 'rock'})
+        b.send({'type': 'play', 'choice': 'paper'})
+        await asyncio.gather(a.expect('game_result'), b.expect('game_result'))
+        latencies.append((time.perf_counter() - t) * 1000)
+    return summary(latencies)
+
+
+async def spectate(port, spectators, stalled, pipe):
+    """Watcher process: subscribe everyone, then stall/resume/report on command"""
+    loop = asyncio.get_running_loop()
+    watchers = []
+    for first in range(0, spectators, 200):
+        batch = [Watcher(f'w{i}') for i in range(first, min(spectators, first + 200))]
+        await asyncio.gather(*[loop.create_connection(lambda w=w: w, '127.0.0.1', port) for w in batch])
+        for w in batch:
+            w.transport.write((json.dumps({'type': 'connect', 'player_name': w.name}) + '\n' +
+                               json.dumps({'type': 'spectate', 'player': 'alice'}) + '\n').encode('utf-8'))
+        watchers.extend(batch)
+    while sum(1 for w in watchers if w.snapshots) < spectators:
+        await asyncio.sleep(0.1)
+    # Left at its default size: a receive buffer below the loopback MSS is
+    # never reopened by a window update once full, only by backed-off probes
+    for w in watchers[:stalled]:
+        w.transport.pause_reading()
+    pipe.send('watching')
+
+    await loop.run_in_executor(None, pipe.recv)
+    for w in watchers[:stalled]:
+        w.snapshots = 0
+        w.transport.resume_reading()
+    await asyncio.sleep(2)
+    healthy = watchers[stalled:]
+    pipe.send({'events_per_healthy_spectator': min(w.updates for w in healthy) if healthy else None,
+               'stalled_resynced': sum(1 for w in watchers[:stalled] if w.snapshots)})
+    for w in watchers:
+        w.transport.close()
+
+
+def spectator_process(port, spectators, stalled, pipe):
+    asyncio.run(spectate(port, spectators, stalled, pipe))
+
+
+async def watch(port, spectators, stalled, rounds):
+    loop = asyncio.get_running_loop()
+    a, b = await connect(port, 'alice'), await connect(port, 'bob')
+    await start_match(a, b)
+    unwatched = await play_rounds(a, b, rounds)
+
+    pipe, child_pipe = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=spectator_process, args=(port, spectators, stalled, child_pipe))
+    child.start()
+    await loop.run_in_executor(None, pipe.recv)
+    watched = await play_rounds(a, b, rounds)
+    await asyncio.sleep(1)
+    pipe.send('resume')
+    result = await loop.run_in_executor(None, pipe.recv)
+    child.join()
+    return {'unwatched': unwatched, 'watched': watched, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='asyncio')
+    parser.add_argument('--spectators', type=int, default=2000)
+    parser.add_argument('--stalled', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=200)
+    args = parser.parse_args()
+
+    print(json.dumps(fanout(args.spectators, args.events)), flush=True)
+
+    port = free_port()
+    # A low high-water mark so the stalled spectators start missing events within the run
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', args.mode, '--outbound-high-water', '16384',
+                             '--no-rate-limits'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        result = asyncio.run(watch(port, args.spectators, args.stalled, args.rounds))
+        print(json.dumps({'bench': 'match', 'mode': args.mode, 'spectators': args.spectators,
+                          'stalled': args.stalled, **result}), flush=True)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Cost of keeping one round deadline per match pending.
+
+Schedules N timers with deadlines spread over 15-30 s, cancels half of
+them (rounds that finished in time) and then expires the rest, comparing
+  - TimerWheel (timers.py)
+  - a heapq with lazy cancellation
+  - one threading.Timer per deadline, the old call_later in threaded
+    mode (only at small N: every pending timer is a thread)
+
+Usage: python benchmarks/bench_timers.py [--counts 10000 100000 500000]
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timers import TimerWheel
+
+
+def noop():
+    pass
+
+
+class HeapTimers:
+    def __init__(self):
+        self.heap = []
+        self.seq = 0
+
+    def schedule(self, delay, callback):
+        entry = [time.monotonic() + delay, self.seq, callback]
+        self.seq += 1
+        heapq.heappush(self.heap, entry)
+        return entry
+
+    def cancel(self, entry):
+        entry[2] = None
+
+    def advance(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if entry[2] is not None:
+                due.append(entry)
+        return due
+
+
+def run_structure(name, make, count, delays):
+    # Memory on a separate pass: tracemalloc slows every allocation down
+    tracemalloc.start()
+    timers = make()
+    handles = [timers.schedule(delay, noop) for delay in delays]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del timers, handles
+
+    timers = make()
+    t = time.perf_counter()
+    handles = [timers.schedule(delay, noop) for delay in delays]
+    schedule_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for handle in handles[::2]:
+        timers.cancel(handle)
+    cancel_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    fired = len(timers.advance(time.monotonic() + 60))
+    expire_s = time.perf_counter() - t
+    return {'timers': name, 'count': count,
+            'schedule_ns': round(schedule_s / count * 1e9),
+            'cancel_ns': round(cancel_s / (count // 2) * 1e9),
+            'expire_ns': round(expire_s / max(1, fired) * 1e9),
+            'fired': fired,
+            'bytes_per_timer': round(memory / count)}
+
+
+def run_threads(count, delays):
+    t = time.perf_counter()
+    handles = []
+    for delay in delays:
+        timer = threading.Timer(delay, noop)
+        timer.daemon = True
+        timer.start()
+        handles.append(timer)
+    schedule_s = time.perf_counter() - t
+    threads = threading.active_count()
+    t = time.perf_counter()
+    for timer in handles:
+        timer.cancel()
+    cancel_s = time.perf_counter() - t
+    return {'timers': 'threading.Timer', 'count': count,
+            'schedule_ns': round(schedule_s / count * 1e9),
+            'cancel_ns': round(cancel_s / count * 1e9),
+            'threads': threads}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000, 500000])
+    parser.add_argument('--thread-count', type=int, default=2000)
+    args = parser.parse_args()
+
+    for count in args.counts:
+        delays = [random.uniform(15, 30) for _ in range(count)]
+        print(json.dumps(run_structure('wheel', TimerWheel, count, delays)), flush=True)
+        print(json.dumps(run_structure('heapq', HeapTimers, count, delays)), flush=True)
+    delays = [random.uniform(15, 30) for _ in range(args.thread_count)]
+    print(json.dumps(run_threads(args.thread_count, delays)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Tournaments: pairing engine throughput and whole events played through the server.
+
+Two parts:
+
+  engine   tournament.py alone: --players entrants of each format (round
+           robin capped at its MAX_ROUND_ROBIN), every series decided at
+           random as soon as it is handed out. Reports series and wall
+           time per format, and checks each ended with the expected
+           number of series played.
+  server   an RPSServer in this process, with no sockets: every player is
+           a bot behind an in-memory Connection that answers game_start
+           and each undecided game_result with a random play through
+           dispatch(), as the request path would. One --players single
+           elimination event, best of --best-of. Reports series and
+           rounds per second of wall time, and checks there is a
+           champion, --players - 1 series were played and every player
+           got tournament_finished.
+
+Usage: python benchmarks/bench_tournament.py [--players 4096] [--best-of 3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tournament
+from outbound import Connection
+from server import RPSServer
+
+CHOICES = ('rock', 'paper', 'scissors')
+
+
+def expected_series(fmt, players, rounds):
+    if fmt == 'single_elimination':
+        return players - 1
+    if fmt == 'swiss':
+        return rounds * (players // 2)
+    return players * (players - 1) // 2
+
+
+def engine(fmt, players, best_of, rng):
+    t = tournament.create(1, fmt, best_of)
+    for i in range(players):
+        t.add(f'p{i}')
+    started = time.perf_counter()
+    ready = deque(t.start())
+    while ready:
+        series = ready.popleft()
+        while not series.record(rng.choice(series.players)):
+            pass
+        ready.extend(t.report(series))
+    elapsed = time.perf_counter() - started
+    rounds = getattr(t, 'total_rounds', None)
+    return {'bench': 'engine', 'format': fmt, 'players': players, 'series': t.played,
+            'ok': t.status == 'finished' and t.played == expected_series(fmt, players, rounds),
+            'wall_ms': round(elapsed * 1000, 1), 'us_per_series': round(elapsed / t.played * 1e6, 2),
+            'winner': t.standings(1)[0]['name']}
+
+
+class SimConnection(Connection):
+    """A bot's connection: messages go to a shared inbox instead of a socket"""
+
+    queue_depth = 0
+
+    def __init__(self, inbox):
+        super().__init__()
+        self.inbox = inbox
+
+    def send_message(self, msg, droppable=False):
+        self.inbox.append((self, msg))
+        return 1
+
+    def send(self, data, droppable=False):
+        # Broadcasts arrive encoded; of those the bots only care about the end
+        if b'tournament_finished' in data:
+            self.inbox.append((self, json.loads(data)))
+        return len(data)
+
+    def abort(self):
+        pass
+
+
+def play_event(players, best_of, rng):
+    server = RPSServer(round_timeout=0, presence_window=3600)
+    inbox = deque()
+    conns = [SimConnection(inbox) for _ in range(players)]
+    for i, conn in enumerate(conns):
+        server.dispatch(conn, {'type': 'connect', 'player_name': f'p{i}'})
+    inbox.clear()
+
+    owner = conns[0].session
+    server.dispatch(owner, {'type': 'create_tournament', 'format': 'single_elimination', 'best_of': best_of})
+    tournament_id = inbox.pop()[1]['tournament']['id']
+    for conn in conns:
+        server.dispatch(conn.session, {'type': 'join_tournament', 'id': tournament_id})
+    inbox.clear()
+
+    rounds = 0
+    finished = set()
+    started = time.perf_counter()
+    server.dispatch(owner, {'type': 'start_tournament', 'id': tournament_id})
+    while inbox:
+        conn, msg = inbox.popleft()
+        kind = msg['type']
+        if kind == 'game_start':
+            server.dispatch(conn.session, {'type': 'play', 'choice': rng.choice(CHOICES)})
+        elif kind == 'game_result':
+            rounds += 1
+            if max(msg['series']) <= best_of // 2:
+                server.dispatch(conn.session, {'type': 'play', 'choice': rng.choice(CHOICES)})
+        elif kind == 'tournament_finished':
+            finished.add(conn)
+    elapsed = time.perf_counter() - started
+
+    t = server.tournaments[tournament_id]
+    rounds //= 2  # Both players get each game_result
+    return {'bench': 'server', 'format': t.format, 'players': players, 'best_of': best_of,
+            'series': t.played, 'rounds': rounds, 'wall_s': round(elapsed, 2),
+            'series_per_s': round(t.played / elapsed), 'rounds_per_s': round(rounds / elapsed),
+            'ok': (t.status == 'finished' and t.champion is not None and t.played == players - 1
+                   and len(finished) == players),
+            'champion': t.champion}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=4096)
+    parser.add_argument('--best-of', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for fmt in tournament.FORMATS:
+        players = min(args.players, tournament.MAX_ROUND_ROBIN) if fmt == 'round_robin' else args.players
+        print(json.dumps(engine(fmt, players, args.best_of, rng)), flush=True)
+    print(json.dumps(play_event(args.players, args.best_of, rng)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
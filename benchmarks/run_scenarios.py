@@ -0,0 +1,72 @@
+"""Run the checked-in load scenarios against a fresh local server.
+
+Starts server.py with the given options, runs every scenario from
+benchmarks/scenarios (or the ones named) through loadgen, and prints one
+JSON report per scenario. A new server is started for each scenario so
+they do not affect each other.
+
+Usage: python benchmarks/run_scenarios.py [--mode asyncio] [--workers 1] [--scale 0.5] [login_storm ...]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = os.path.join(ROOT, 'benchmarks', 'scenarios')
+sys.path.insert(0, ROOT)
+
+from loadgen import load_scenario, run_scenario
+from bench_server_modes import free_port, proc_status
+
+
+def start_server(port, mode, workers, extra):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1',
+                             '--port', str(port), '--mode', mode, '--workers', str(workers),
+                             '--log-level', 'warning', '--no-rate-limits'] + extra,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            # Cluster workers need a moment after the first one is accepting
+            time.sleep(1.0 if workers > 1 else 0.2)
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', help="scenario names (default: all)")
+    parser.add_argument('--mode', default='asyncio')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply every group's player count")
+    parser.add_argument('--duration', type=float, help="override every scenario's duration")
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help="extra arguments for server.py")
+    args = parser.parse_args()
+
+    names = args.names or sorted(name[:-5] for name in os.listdir(SCENARIOS) if name.endswith('.json'))
+    for name in names:
+        overrides = {'duration': args.duration} if args.duration else {}
+        scenario = load_scenario(os.path.join(SCENARIOS, f'{name}.json'), overrides, args.scale)
+        port = free_port()
+        proc = start_server(port, args.mode, args.workers, args.server_args)
+        try:
+            report = run_scenario(scenario, port=port)
+            rss, threads = proc_status(proc.pid)
+        finally:
+            proc.kill()
+            proc.wait()
+        print(json.dumps({'scenario': name, 'mode': args.mode, 'workers': args.workers,
+                          'server_rss_mb': round(rss / 1024, 1), **report}), flush=True)
+
+
+if __name__ == '__main__':
+    main()
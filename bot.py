@@ -0,0 +1,242 @@
+"""Bot opponent: adaptive per-player strategies and the batch engine.
+
+play_bot picks the bot's move with one of STRATEGIES, chosen by the
+request's 'strategy' field:
+
+random     uniform, the original bot
+frequency  counters the player's most frequent move
+markov     counters the move the player most often made after their last
+           ORDER moves (an order-ORDER Markov chain / n-gram model)
+ensemble   runs the three above and follows whichever has recently been
+           winning
+
+What the bot knows about a player lives in one BotSession: fixed-size
+count arrays and a small integer context, so memory per player is
+constant and predicting and updating are O(1) per move.
+
+play_bot_batch is always played by the uniform bot. A batch of moves
+travels as a compact string, one letter per round: 'r'/'p'/'s' for
+choices and 'w'/'l'/'d' for results (from the player's side). The
+engine works on one-byte codes (protocol.CHOICES / protocol.RESULTS
+order) and resolves a whole batch with a precomputed 3x3 outcome table,
+either with NumPy when it is installed or with bytes.translate()
+lookups, so no per-round Python code runs in either case.
+"""
+import operator
+import random
+from array import array
+
+from protocol import (CHOICES, RESULTS, CHOICE_CODES, LETTER_TO_CODE, CODE_TO_LETTER, RESULT_TO_LETTER,
+                      byte_table)
+
+# Try to import NumPy for the vectorized path; the bytes path needs nothing
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Largest batch a single request may carry
+MAX_BATCH = 100000
+
+WINS = {'rock': 'scissors', 'scissors': 'paper', 'paper': 'rock'}
+# OUTCOMES[player][bot] -> result code from the player's point of view
+OUTCOMES = [[RESULTS.index('draw' if mine == bot else 'win' if WINS[mine] == bot else 'lose')
+             for bot in CHOICES] for mine in CHOICES]
+WIN = RESULTS.index('win')
+LOSE = RESULTS.index('lose')
+
+TIMES_THREE = byte_table({code: code * 3 for code in range(3)})
+# Indexed by player * 3 + bot
+PAIR_TO_RESULT = byte_table({i * 3 + j: OUTCOMES[i][j] for i in range(3) for j in range(3)})
+# Random bytes 0..254 map evenly onto 0..2; 255 is dropped to avoid bias
+MOD_THREE = bytes(i % 3 for i in range(256))
+
+# Moves of context for the markov strategy
+ORDER = 2
+CONTEXTS = 3 ** ORDER
+# Counts are halved when one reaches this, which also lets old habits fade
+COUNT_LIMIT = 60000
+# Ensemble scores: each round a member's score decays by 1/8 and gains +-8
+SCORE_DECAY = 3
+SCORE_STEP = 8
+
+
+def beats(move):
+    """The move that beats move (in CHOICES order each move beats the one before)"""
+    return (move + 1) % 3
+
+
+class BotSession:
+    """Everything the bot remembers about one player"""
+
+    __slots__ = ('counts', 'transitions', 'context', 'moves', 'scores', 'predictions')
+
+    def __init__(self):
+        self.counts = array('H', bytes(2 * 3))  # how often each move was played
+        self.transitions = array('H', bytes(2 * CONTEXTS * 3))  # [context * 3 + next move]
+        self.context = 0  # last ORDER moves as a base-3 number
+        self.moves = 0  # moves seen, capped at ORDER
+        self.scores = array('h', bytes(2 * len(ENSEMBLE)))
+        self.predictions = None  # ensemble members' picks for the current round
+
+    def update(self, move):
+        """Record the player's move (a CHOICES code)"""
+        if self.predictions is not None:
+            for i, pick in enumerate(self.predictions):
+                outcome = OUTCOMES[pick][move]
+                score = self.scores[i] - (self.scores[i] >> SCORE_DECAY)
+                if outcome == WIN:
+                    score += SCORE_STEP
+                elif outcome == LOSE:
+                    score -= SCORE_STEP
+                self.scores[i] = score
+            self.predictions = None
+
+        self.bump(self.counts, 0, move)
+        if self.moves == ORDER:
+            self.bump(self.transitions, self.context * 3, move)
+        else:
+            self.moves += 1
+        self.context = (self.context * 3 + move) % CONTEXTS
+
+    @staticmethod
+    def bump(counts, row, move):
+        if counts[row + move] >= COUNT_LIMIT:
+            for i in range(row, row + 3):
+                counts[i] >>= 1
+        counts[row + move] += 1
+
+
+def most_likely(counts, row=0):
+    """Index (0-2) of the largest of counts[row:row + 3], None if all are zero"""
+    a, b, c = counts[row], counts[row + 1], counts[row + 2]
+    if not (a or b or c):
+        return None
+    if a >= b and a >= c:
+        return 0
+    return 1 if b >= c else 2
+
+
+class RandomStrategy:
+    name = 'random'
+
+    def pick(self, session, rng):
+        return rng.randrange(3)
+
+
+class FrequencyStrategy:
+    name = 'frequency'
+
+    def pick(self, session, rng):
+        predicted = most_likely(session.counts)
+        return rng.randrange(3) if predicted is None else beats(predicted)
+
+
+class MarkovStrategy:
+    name = 'markov'
+
+    def pick(self, session, rng):
+        predicted = None
+        if session.moves == ORDER:
+            predicted = most_likely(session.transitions, session.context * 3)
+        if predicted is None:
+            # Not enough history for this context yet
+            predicted = most_likely(session.counts)
+        return rng.randrange(3) if predicted is None else beats(predicted)
+
+
+ENSEMBLE = (RandomStrategy(), FrequencyStrategy(), MarkovStrategy())
+
+
+class EnsembleStrategy:
+    name = 'ensemble'
+
+    def pick(self, session, rng):
+        picks = bytes(member.pick(session, rng) for member in ENSEMBLE)
+        # Scored in BotSession.update() once the player's move is known
+        session.predictions = picks
+        scores = session.scores
+        best = max(range(len(ENSEMBLE)), key=scores.__getitem__)
+        return picks[best]
+
+
+STRATEGIES = {strategy.name: strategy for strategy in ENSEMBLE + (EnsembleStrategy(),)}
+
+
+def choice_codes(choices):
+    """Normalize a batch ('rps...' or ['rock', ...]) to code bytes.
+
+    Raises ValueError on an unknown move.
+    """
+    if isinstance(choices, str):
+        codes = choices.encode('ascii', 'replace').translate(LETTER_TO_CODE)
+    elif isinstance(choices, list):
+        codes = bytes(CHOICE_CODES.get(choice, 0xff) for choice in choices)
+    else:
+        raise ValueError("choices must be a string or a list")
+    if 0xff in codes:
+        raise ValueError("unknown choice in batch")
+    return codes
+
+
+def to_letters(codes, table=CODE_TO_LETTER):
+    return codes.translate(table).decode('ascii')
+
+
+class BotEngine:
+    """Picks the bot's moves: one round with a strategy, or a whole random batch"""
+
+    def __init__(self, seed=None, use_numpy=HAS_NUMPY):
+        self.random = random.Random(seed)
+        self.use_numpy = use_numpy and HAS_NUMPY
+        if self.use_numpy:
+            self.rng = np.random.default_rng(seed)
+            self.outcomes = np.array(OUTCOMES, dtype=np.uint8)
+
+    def play_round(self, session, strategy, choice):
+        """Return the bot's move against choice and learn from it.
+
+        Raises ValueError for an unknown strategy. A choice that is not a
+        valid move is played against but not learned from.
+        """
+        if not isinstance(strategy, str) or strategy not in STRATEGIES:
+            raise ValueError(f"unknown strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}")
+        move = STRATEGIES[strategy].pick(session, self.random)
+        code = CHOICE_CODES.get(choice)
+        if code is not None:
+            session.update(code)
+        else:
+            session.predictions = None
+        return CHOICES[move]
+
+    def random_codes(self, count):
+        if self.use_numpy:
+            return self.rng.integers(0, 3, size=count, dtype=np.uint8).tobytes()
+        codes = b''
+        while len(codes) < count:
+            # A little extra so the dropped 255s rarely need a second pass
+            size = count - len(codes) + count // 64 + 8
+            codes += self.random.getrandbits(8 * size).to_bytes(size, 'little').translate(MOD_THREE, b'\xff')
+        return codes[:count]
+
+    def play(self, codes):
+        """Resolve a batch: code bytes in, (bot codes, result codes) out"""
+        bot = self.random_codes(len(codes))
+        if self.use_numpy:
+            results = self.outcomes[np.frombuffer(codes, dtype=np.uint8), np.frombuffer(bot, dtype=np.uint8)]
+            return bot, results.tobytes()
+        pairs = bytes(map(operator.add, codes.translate(TIMES_THREE), bot))
+        return bot, pairs.translate(PAIR_TO_RESULT)
+
+    def play_batch(self, choices):
+        """Build the bot_batch_result reply for a play_bot_batch request"""
+        bot, results = self.play(choice_codes(choices))
+        return {
+            'type': 'bot_batch_result',
+            'bot_choices': to_letters(bot),
+            'results': to_letters(results, RESULT_TO_LETTER),
+            'wins': results.count(RESULTS.index('win')),
+            'losses': results.count(RESULTS.index('lose')),
+            'draws': results.count(RESULTS.index('draw')),
+        }
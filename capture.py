@@ -0,0 +1,150 @@
+"""Traffic capture: every inbound frame, timestamped, in a compact binary trace.
+
+With --capture FILE the server records what its clients send, byte for
+byte as it arrived, so replay.py can play it back against another
+server. The file is a header followed by records:
+
+HEADER  magic b'RPST', version, capture start (unix time)
+RECORD  kind, frame type, connection number, microseconds since the
+        start, payload length; then the payload: the peer address for
+        OPEN, the frame as it was on the wire for FRAME, nothing for CLOSE
+
+Connections are numbered in the order they were accepted. A player who
+resumes a session on a new connection shows up as a new connection,
+whose resume carries the old session's token.
+
+Nothing touches the disk on the caller's thread: a record is packed and
+appended to a list under a lock. A writer thread wakes every
+flush_interval and writes what piled up in one go through a buffered
+file. If it falls max_pending bytes behind, new records are dropped
+(and counted) rather than letting memory grow; the trace then says so.
+A server stopped with Ctrl-C writes out everything; one killed outright
+loses what arrived in its last flush_interval.
+"""
+import struct
+import threading
+import time
+
+import log
+
+MAGIC = b'RPST'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sBd')
+RECORD = struct.Struct('<BBIQI')
+KIND_OPEN = 0
+KIND_FRAME = 1
+KIND_CLOSE = 2
+KIND_DROPPED = 3  # Records were dropped here; the payload is how many, as text
+# Seconds between writes, and how far the writer may fall behind before records are dropped
+FLUSH_INTERVAL = 0.05
+MAX_PENDING = 64 << 20
+WRITE_BUFFER = 1 << 20
+
+logger = log.get_logger('capture')
+
+
+class Capture:
+    """Trace file being written; open(), frame() and close() are thread-safe"""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.file = open(path, 'wb', buffering=WRITE_BUFFER)
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self.file.flush()  # A readable, empty trace even if the server is killed before the first write
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_bytes = 0
+        self.next_id = 0
+        self.records = 0
+        self.dropped = 0
+        self.unreported = 0  # Dropped since the last KIND_DROPPED record
+        self.stop = threading.Event()
+        self.writer = threading.Thread(target=self.run, daemon=True)
+        self.writer.start()
+
+    def record(self, kind, conn_id, payload=b'', frame_type=0):
+        with self.lock:
+            if self.pending_bytes + RECORD.size + len(payload) > self.max_pending:
+                self.dropped += 1
+                self.unreported += 1
+                return
+            if self.unreported:
+                self.append(KIND_DROPPED, 0, str(self.unreported).encode(), 0)
+                self.unreported = 0
+            self.append(kind, conn_id, payload, frame_type)
+
+    def append(self, kind, conn_id, payload, frame_type):
+        # Stamped under the lock, so the file is in time order
+        us = int((time.monotonic() - self.started) * 1e6)
+        self.pending.append(RECORD.pack(kind, frame_type, conn_id, us, len(payload)))
+        self.pending.append(payload)
+        self.pending_bytes += RECORD.size + len(payload)
+        self.records += 1
+
+    def open(self, conn, peer):
+        with self.lock:
+            conn.trace_id = self.next_id
+            self.next_id += 1
+        self.record(KIND_OPEN, conn.trace_id, str(peer[0] if peer else '').encode())
+
+    def frame(self, conn, frame, wire):
+        """A frame (frame type, payload) received on conn, which was wire on the wire"""
+        if conn.trace_id is not None:
+            self.record(KIND_FRAME, conn.trace_id, wire, frame[0])
+
+    def close(self, conn):
+        trace_id, conn.trace_id = conn.trace_id, None
+        if trace_id is not None:
+            self.record(KIND_CLOSE, trace_id)
+
+    def run(self):
+        while not self.stop.wait(self.flush_interval):
+            self.write()
+        self.write()
+        self.file.close()
+
+    def write(self):
+        with self.lock:
+            chunks, self.pending = self.pending, []
+            self.pending_bytes = 0
+        if chunks:
+            try:
+                self.file.write(b''.join(chunks))
+                self.file.flush()
+            except OSError as e:
+                logger.error("Writing capture %s failed: %s", self.path, e)
+
+    def shutdown(self):
+        """Write what is queued and close the file"""
+        self.stop.set()
+        self.writer.join()
+        if self.dropped:
+            logger.warning("Capture %s is missing %d records the writer could not keep up with",
+                           self.path, self.dropped)
+
+
+def read_trace(path):
+    """(capture start unix time, [(kind, frame type, connection, microseconds, payload)]).
+
+    A record cut off at the end (the server died mid-write) is left out.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError(f"{path} is not a version {VERSION} capture")
+    magic, version, started = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} capture")
+    records = []
+    pos = FILE_HEADER.size
+    while pos + RECORD.size <= len(data):
+        kind, frame_type, conn_id, us, length = RECORD.unpack_from(data, pos)
+        start = pos + RECORD.size
+        if start + length > len(data):
+            break
+        records.append((kind, frame_type, conn_id, us, data[start:start + length]))
+        pos = start + length
+    return started, records
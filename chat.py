@@ -0,0 +1,139 @@
+"""Chat: lobby, match and direct-message channels.
+
+A player sends {'type': 'chat', 'channel': 'lobby' | 'match' | 'dm',
+'text': ..., 'to': name (dm only)} and everyone on the channel, the
+sender included, gets
+
+    {'type': 'chat', 'channel': 'lobby', 'from': name, 'text': ..., 'ts': unix time}
+
+with 'to' added for a dm. Posting only appends the message to the
+channel's history (the last HISTORY_SIZE messages, for late joiners)
+and to its pending list. A flush, at most one per CHAT_WINDOW seconds,
+joins what is pending into one bytes object per wire format and hands
+that same object to every member as a droppable send: a crowded lobby
+costs one encode per window and one queue append per member, and a
+slow reader loses chat before anything else. One flush takes at most
+FLUSH_MAX messages, the rest waiting for the next window, and on the
+event loop reaches at most `batch` members per callback before
+yielding, so a busy channel never holds up the plays queued behind it.
+
+Channels do not track members: they ask their `members` callable at
+flush time (everyone connected, the players and spectators of a
+match, the two ends of a dm), so there is nobody to unsubscribe.
+"""
+import threading
+from collections import deque
+
+# Messages a channel keeps for chat_history
+HISTORY_SIZE = 50
+# Seconds a channel collects messages before sending them out together
+CHAT_WINDOW = 0.05
+# Most messages one flush sends; most waiting before the oldest are skipped (they stay in the history)
+FLUSH_MAX = 100
+MAX_PENDING = 1000
+# Members one fanout callback reaches before yielding to the event loop
+FANOUT_BATCH = 250
+# Longest chat text accepted, in characters
+MAX_TEXT = 500
+
+
+class Fanout:
+    """One flush: the messages taken from the pending list and who they go to"""
+
+    __slots__ = ('messages', 'targets', 'position', 'data')
+
+    def __init__(self, messages, targets):
+        self.messages = messages
+        self.targets = targets
+        self.position = 0
+        self.data = {}  # {codec: bytes}
+
+    def encoded(self, codec):
+        data = self.data.get(codec)
+        if data is None:
+            data = self.data[codec] = b''.join(codec.encode(msg) for msg in self.messages)
+        return data
+
+    def deliver(self, batch):
+        """Send to the next batch of targets (all of them for batch None)"""
+        end = len(self.targets) if batch is None else min(len(self.targets), self.position + batch)
+        for sock in self.targets[self.position:end]:
+            try:
+                if sock.codec is None:
+                    for msg in self.messages:  # Encoded wherever the player really is
+                        sock.send_message(msg, droppable=True)
+                else:
+                    sock.send(self.encoded(sock.codec), droppable=True)
+            except:
+                pass  # Gone: not a member at the next flush
+        self.position = end
+
+
+class Channel:
+    """A chat channel's history and the messages on their way to its members"""
+
+    def __init__(self, server, members, window=CHAT_WINDOW, batch=None, history=HISTORY_SIZE):
+        self.server = server
+        self.members = members  # () -> sockets to send to
+        self.window = window
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # one flush at a time, in order
+        self.history = deque(maxlen=history)
+        self.pending = deque()
+        self.current = None  # Fanout in progress
+        self.flush_scheduled = False
+        self.skipped = 0  # Messages dropped from a full pending list
+
+    def post(self, msg):
+        with self.lock:
+            self.history.append(msg)
+            if len(self.pending) >= MAX_PENDING:
+                self.pending.popleft()
+                self.skipped += 1
+            self.pending.append(msg)
+            self.schedule_locked(self.window)
+
+    def recent(self):
+        with self.lock:
+            return list(self.history)
+
+    def export(self):
+        """(history, pending) for a successor process (handoff.py)"""
+        with self.lock:
+            return list(self.history), list(self.pending)
+
+    def adopt(self, history, pending):
+        """Carry on with the messages of the same channel in a predecessor process"""
+        with self.lock:
+            self.history.extend(history)
+            self.pending.extend(pending)
+            if self.pending:
+                self.schedule_locked(self.window)
+
+    def schedule_locked(self, delay):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.server.call_later(delay, self.flush)
+
+    def flush(self):
+        with self.send_lock:
+            with self.lock:
+                self.flush_scheduled = False
+                current = self.current
+                if current is None and not self.pending:
+                    return
+            if current is None:
+                # Members first, outside the channel lock: listing them may take the server's locks
+                targets = self.members()
+                with self.lock:
+                    messages = [self.pending.popleft() for _ in range(min(len(self.pending), FLUSH_MAX))]
+                current = self.current = Fanout(messages, targets)
+            current.deliver(self.batch)
+            with self.lock:
+                if current.position < len(current.targets):
+                    self.schedule_locked(0)
+                    return
+                self.current = None
+                if self.pending:
+                    self.schedule_locked(self.window)
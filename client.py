@@ -1,17 +1,157 @@
 import tkinter as tk
+import tkinter.font
 from tkinter import messagebox, simpledialog, Listbox, END
 import socket
-import json
 import threading
 import time
-import os
+import random
+import argparse
+from collections import deque
+
+import log
+import assets
+from protocol import NDJSON, BINARY, CODECS, UNSEQUENCED
+
+logger = log.get_logger('client')
+
+# Reconnect backoff: a random delay up to min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt),
+# so a server restart does not get every client back in the same instant
+RECONNECT_BASE = 0.5
+RECONNECT_MAX = 10.0
+# Give up and close after this long without a connection
+RECONNECT_GIVE_UP = 120.0
+# The receiver thread only queues messages; the UI drains the queue every PUMP_INTERVAL ms,
+# handling for at most PUMP_BUDGET seconds per tick so a burst cannot freeze the window
+PUMP_INTERVAL = 15
+PUMP_BUDGET = 0.008
+# Chat lines kept for the lobby's chat box
+CHAT_LINES = 100
+ROSTER_TYPES = ('player_list', 'roster_update')
+
+
+def collapse_roster(batch):
+    """Drop the roster messages of a batch that a later player_list snapshot makes moot"""
+    last = None
+    for i, msg in enumerate(batch):
+        if isinstance(msg, dict) and msg.get('type') == 'player_list':
+            last = i
+    if not last:
+        return batch
+    return [msg for i, msg in enumerate(batch)
+            if i >= last or not isinstance(msg, dict) or msg.get('type') not in ROSTER_TYPES]
+
+
+class PlayerList:
+    """Lobby roster in a Listbox that only ever holds the rows in sight.
+
+    With thousands of players online, filling a Listbox with all of them
+    (and refilling it on every status change) takes longer than a frame.
+    Here the Listbox has just as many rows as fit, showing the slice of
+    the roster under the scrollbar, which this class drives itself;
+    render() rewrites only the rows whose text changed. The selection is
+    kept by name, so it follows its player while rows scroll or shift.
+    """
+
+    def __init__(self, parent, players, me, **options):
+        self.players = players  # The client's {name: status}, read on every render
+        self.me = me
+        self.frame = tk.Frame(parent, bg=options.get('bg'))
+        self.scrollbar = tk.Scrollbar(self.frame, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = Listbox(self.frame, selectmode=tk.SINGLE, exportselection=False, **options)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.linespace = tk.font.Font(font=self.listbox.cget('font')).metrics('linespace') + 1
+        self.top = 0  # Roster index of the first row shown
+        self.rows = 1  # Rows that fit, updated on <Configure>
+        self.shown = []  # (name, text) of each row in the Listbox
+        self.selected = None
+        self.listbox.bind('<Configure>', self.on_resize)
+        self.listbox.bind('<<ListboxSelect>>', self.on_select)
+        self.listbox.bind('<MouseWheel>', lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.listbox.bind('<Button-4>', lambda e: self.scroll(-1))
+        self.listbox.bind('<Button-5>', lambda e: self.scroll(1))
+        self.listbox.bind('<Up>', lambda e: self.step(-1))
+        self.listbox.bind('<Down>', lambda e: self.step(1))
+
+    def pack(self, **options):
+        self.frame.pack(**options)
+
+    def exists(self):
+        try:
+            return self.listbox.winfo_exists()
+        except tk.TclError:
+            return False  # The whole window is gone
+
+    def label(self, name):
+        status = self.players.get(name)
+        text = f"{name} (Bạn)" if name == self.me else name
+        if status != 'idle':
+            text += f" [{status.upper()}]"
+        return text
+
+    def render(self):
+        order = list(self.players)
+        self.top = max(0, min(self.top, len(order) - self.rows))
+        wanted = [(name, self.label(name)) for name in order[self.top:self.top + self.rows]]
+        listbox = self.listbox
+        for i, row in enumerate(wanted):
+            if i >= len(self.shown):
+                listbox.insert(END, row[1])
+            elif self.shown[i] != row:
+                listbox.delete(i)
+                listbox.insert(i, row[1])
+        if len(self.shown) > len(wanted):
+            listbox.delete(len(wanted), END)
+        self.shown = wanted
+        listbox.selection_clear(0, END)
+        for i, (name, _) in enumerate(wanted):
+            if name == self.selected:
+                listbox.selection_set(i)
+                break
+        if order:
+            self.scrollbar.set(self.top / len(order), min(1.0, (self.top + self.rows) / len(order)))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def on_resize(self, event):
+        border = int(self.listbox.cget('borderwidth')) + int(self.listbox.cget('highlightthickness'))
+        rows = max(1, (event.height - 2 * border) // self.linespace)
+        if rows != self.rows:
+            self.rows = rows
+            self.render()
+
+    def on_select(self, event):
+        selection = self.listbox.curselection()
+        if selection and selection[0] < len(self.shown):
+            self.selected = self.shown[selection[0]][0]
+
+    def scroll(self, rows):
+        self.top += rows
+        self.render()
+        return 'break'
+
+    def step(self, delta):
+        """Move the selection by one row with the arrow keys, scrolling at the edges"""
+        names = [name for name, _ in self.shown]
+        index = names.index(self.selected) + delta if self.selected in names else 0
+        if index < 0 or index >= len(names):
+            self.top += delta
+            self.render()
+            names = [name for name, _ in self.shown]
+            index = max(0, min(index, len(names) - 1))
+        if names:
+            self.selected = names[index]
+            self.render()
+        return 'break'
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.players))
+        elif args[0] == 'scroll':
+            self.top += int(args[1]) * (self.rows if args[2] == 'pages' else 1)
+        self.render()
 
-# Try to import PIL for better image support (especially for jpg)
-try:
-    from PIL import Image, ImageTk
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
 
 class RPSClient:
     def __init__(self, root):
@@ -24,13 +164,28 @@ class RPSClient:
         self.host = '127.0.0.1'
         self.port = 5555
         self.client_socket = None
+        self.codec = NDJSON  # Until the server agrees on something more compact
         self.player_name = ""
         self.opponent_name = ""
         self.is_connected = False
-        
-        # Images
+        self.players = {}  # {name: status} lobby roster
+        self.roster_version = None
+        self.roster_dirty = False  # Roster changed since the player list was last drawn
+        self.player_list = None
+        self.inbox = deque()  # Messages (and callbacks) from the receiver thread, for pump()
+        self.chat_lines = deque(maxlen=CHAT_LINES)  # Lobby, match and direct messages, oldest first
+        self.chat_box = None
+        self.in_queue = False
+        self.opponent_rating = None
+        self.spectate_seq = None  # seq of the match being watched, None when not watching
+        self.series_best_of = None  # best_of of the tournament series being played, None in a casual match
+        self.own_tournament = None  # id of the tournament we created and have not started yet
+        self.session = None  # Token from connect_ack, for resuming after a dropped connection
+        self.last_seq = 0  # Number of the last sequenced message received
+        self.closing = False
+        
+        # Images, loaded by image() when the game screen first needs them
         self.images = {}
-        self.load_images()
         
         # UI Frames
         self.main_container = tk.Frame(root, bg="#1a1a2e")
@@ -41,45 +196,25 @@ class RPSClient:
         self.game_frame = None
         
         self.setup_login_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
+        self.root.after(PUMP_INTERVAL, self.pump)
 
-    def load_images(self):
-        """Load images safely"""
-        # Mapping: key -> filename
-        image_files = {
-            'rock': 'bua.png',
-            'paper': 'bao.jpg',
-            'scissors': 'keo.png'
-        }
-        
-        cwd = os.getcwd()
-        # Check current folder and bt-game-keo-bua-bao folder
-        possible_paths = [cwd, os.path.join(cwd, 'bt-game-keo-bua-bao')]
-        
-        for key, filename in image_files.items():
-            path = filename
-            for p in possible_paths:
-                full_path = os.path.join(p, filename)
-                if os.path.exists(full_path):
-                    path = full_path
-                    break
-            
+    def image(self, key):
+        """The picture for a choice button, from the asset cache; None for a text-only button"""
+        if key not in self.images:
+            img = None
+            path = assets.scaled(assets.IMAGES[key])
             try:
-                if HAS_PIL:
-                    img = Image.open(path)
-                    img = img.resize((150, 150), Image.Resampling.LANCZOS)
-                    self.images[key] = ImageTk.PhotoImage(img)
-                else:
-                    # Fallback for standard tkinter (PNG only usually, JPG might fail)
-                    if filename.endswith('.png'):
-                        img = tk.PhotoImage(file=path)
-                        # Zoom/Subsample for resizing if needed, but PhotoImage is limited
-                        self.images[key] = img
-                    else:
-                        print(f"Cannot load {filename} without PIL")
-                        self.images[key] = None
-            except Exception as e:
-                print(f"Error loading {key}: {e}")
-                self.images[key] = None
+                if path is not None:
+                    img = tk.PhotoImage(file=path)
+                elif assets.IMAGES[key].endswith('.png'):
+                    # Not cached and no PIL to render it: shrink the original by a whole factor
+                    img = tk.PhotoImage(file=assets.source_path(assets.IMAGES[key]))
+                    img = img.subsample(max(1, img.width() // assets.IMAGE_SIZE[0]))
+            except tk.TclError as e:
+                logger.warning("Error loading %s: %s", key, e)
+            self.images[key] = img
+        return self.images[key]
 
     def clear_frame(self):
         for widget in self.main_container.winfo_children():
@@ -123,8 +258,19 @@ class RPSClient:
         
         tk.Label(left_panel, text="Danh sách người chơi online:", font=("Segoe UI", 12), fg="#00ff88", bg="#1a1a2e").pack(anchor="w")
         
-        self.player_listbox = Listbox(left_panel, font=("Segoe UI", 12), bg="#0f3460", fg="white", selectmode=tk.SINGLE, relief=tk.FLAT)
-        self.player_listbox.pack(fill=tk.BOTH, expand=True, pady=10)
+        self.player_list = PlayerList(left_panel, self.players, self.player_name, font=("Segoe UI", 12),
+                                      bg="#0f3460", fg="white", relief=tk.FLAT)
+        self.player_list.pack(fill=tk.BOTH, expand=True, pady=10)
+        self.refresh_player_list()
+
+        # Chat: lobby by default, "/w name text" for a direct message
+        self.chat_box = tk.Text(left_panel, height=7, font=("Segoe UI", 10), bg="#16213e", fg="white",
+                                relief=tk.FLAT, wrap=tk.WORD, state=tk.DISABLED)
+        self.chat_box.pack(fill=tk.X)
+        self.show_chat()
+        self.chat_entry = tk.Entry(left_panel, font=("Segoe UI", 11))
+        self.chat_entry.pack(fill=tk.X, pady=(5, 0))
+        self.chat_entry.bind('<Return>', lambda e: self.send_chat())
         
         # Buttons
         btn_frame = tk.Frame(content, bg="#1a1a2e")
@@ -133,6 +279,19 @@ class RPSClient:
         tk.Button(btn_frame, text="⚔️ THÁCH ĐẤU", font=("Segoe UI", 12, "bold"), bg="#e94560", fg="white", width=15,
                  command=self.challenge_player).pack(pady=10)
 
+        self.queue_button = tk.Button(btn_frame, font=("Segoe UI", 12, "bold"), bg="#9b59b6", fg="white", width=15,
+                                      command=self.toggle_queue)
+        self.queue_button.pack(pady=10)
+        self.update_queue_button()
+
+        tk.Button(btn_frame, text="👁️ XEM TRẬN", font=("Segoe UI", 12, "bold"), bg="#16a085", fg="white", width=15,
+                 command=self.watch_player).pack(pady=10)
+
+        self.tournament_button = tk.Button(btn_frame, font=("Segoe UI", 12, "bold"), bg="#d35400", fg="white",
+                                           width=15, command=self.tournament_action)
+        self.tournament_button.pack(pady=10)
+        self.update_tournament_button()
+
         tk.Button(btn_frame, text="🤖 CHƠI VỚI MÁY", font=("Segoe UI", 12, "bold"), bg="#3498db", fg="white", width=15,
                  command=self.start_bot_game).pack(pady=10)
         
@@ -142,6 +301,10 @@ class RPSClient:
     def setup_game_ui(self, mode="pvp"): # mode: pvp or bot
         self.clear_frame()
         opponent_display = self.opponent_name if mode == "pvp" else "MÁY TÍNH 🤖"
+        if mode == "pvp" and self.opponent_rating is not None:
+            opponent_display += f" ({self.opponent_rating})"
+        if mode == "pvp" and self.series_best_of is not None:
+            opponent_display += f" · BO{self.series_best_of}"
         self.root.title(f"Trận đấu: {self.player_name} vs {opponent_display}")
         self.current_mode = mode
         
@@ -175,7 +338,7 @@ class RPSClient:
             frame = tk.Frame(choices_frame, bg="#1a1a2e", padx=20)
             frame.pack(side=tk.LEFT)
             
-            img = self.images.get(key)
+            img = self.image(key)
             if img:
                 btn = tk.Button(frame, image=img, bg="#1a1a2e", activebackground="#1a1a2e", bd=0,
                                command=lambda k=key: self.make_choice(k))
@@ -198,6 +361,28 @@ class RPSClient:
         self.timer_running = True
         self.update_timer()
 
+    def setup_spectate_ui(self, players):
+        self.clear_frame()
+        self.root.title(f"Đang xem: {players[0]} vs {players[1]}")
+
+        header = tk.Frame(self.main_container, bg="#16213e", pady=10)
+        header.pack(fill=tk.X)
+        tk.Label(header, text=players[0], font=("Segoe UI", 16, "bold"), fg="#00ff88", bg="#16213e").pack(side=tk.LEFT, padx=50)
+        self.score_label = tk.Label(header, font=("Segoe UI", 24, "bold"), fg="#f39c12", bg="#16213e")
+        self.score_label.pack(side=tk.LEFT, expand=True)
+        tk.Label(header, text=players[1], font=("Segoe UI", 16, "bold"), fg="#f1c40f", bg="#16213e").pack(side=tk.RIGHT, padx=50)
+
+        self.status_label = tk.Label(self.main_container, text="", font=("Segoe UI", 18), fg="white", bg="#1a1a2e")
+        self.status_label.pack(expand=True)
+        self.audience_label = tk.Label(self.main_container, text="", font=("Segoe UI", 10), fg="#888", bg="#1a1a2e")
+        self.audience_label.pack()
+
+        tk.Button(self.main_container, text="THÔI XEM", font=("Segoe UI", 10, "bold"), bg="#555", fg="white",
+                 command=self.stop_watching).pack(side=tk.BOTTOM, pady=20)
+
+    def show_score(self, score, draws):
+        self.score_label.config(text=f"{score[0]} - {score[1]}" + (f"  (hòa {draws})" if draws else ""))
+
     def update_timer(self):
         if not self.timer_running: return
         
@@ -208,7 +393,6 @@ class RPSClient:
         else:
             self.timer_running = False
             self.status_label.config(text="Hết giờ! Tự động chọn ngẫu nhiên...", fg="#e74c3c")
-            import random
             auto_choice = random.choice(['rock', 'paper', 'scissors'])
             self.make_choice(auto_choice)
 
@@ -222,86 +406,195 @@ class RPSClient:
             return
             
         try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            # Disable Nagle's algorithm
-            self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            self.client_socket.connect((self.host, self.port))
+            self.open_socket()
             
             # Start listening thread
             threading.Thread(target=self.listen_to_server, daemon=True).start()
             
-            # Send connect
-            self.send_request({'type': 'connect', 'player_name': name})
+            self.send_connect(name)
             
         except Exception as e:
             messagebox.showerror("Lỗi kết nối", f"Không thể kết nối đến server: {e}")
 
+    def open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Disable Nagle's algorithm
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.connect((self.host, self.port))
+        self.codec = NDJSON
+        self.client_socket = sock
+
+    def send_connect(self, name):
+        # Ask for incremental roster updates and the binary protocol
+        self.send_request({'type': 'connect', 'player_name': name, 'features': ['roster_deltas'],
+                           'protocols': [BINARY.name, NDJSON.name]})
+
+    def reconnect(self):
+        """Open a new connection and resume the session on it; False after RECONNECT_GIVE_UP"""
+        deadline = time.monotonic() + RECONNECT_GIVE_UP
+        attempt = 0
+        while not self.closing and time.monotonic() < deadline:
+            time.sleep(random.uniform(0, min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt)))
+            attempt += 1
+            try:
+                self.open_socket()
+            except OSError as e:
+                logger.info("Reconnect attempt %d failed: %s", attempt, e)
+                continue
+            self.send_request({'type': 'resume', 'session': self.session, 'last_seq': self.last_seq,
+                               'features': ['roster_deltas'], 'protocols': [BINARY.name, NDJSON.name]})
+            return True
+        return False
+
+    def quit(self):
+        self.closing = True
+        if self.session is not None:
+            # Not coming back: let the server free the name now rather than after the grace period
+            self.send_request({'type': 'logout'})
+        self.root.destroy()
+
     def send_request(self, data):
         if self.client_socket:
             try:
-                self.client_socket.send((json.dumps(data) + '\n').encode('utf-8'))
+                self.client_socket.sendall(self.codec.encode(data))
             except Exception as e:
-                print(f"Error sending: {e}")
+                logger.error("Error sending: %s", e)
 
     def listen_to_server(self):
-        buffer = ""
         while True:
             try:
-                data = self.client_socket.recv(4096).decode('utf-8')
-                if not data: 
-                    print(f"[CLIENT] No data received (connection closed)")
-                    break
-                
-                buffer += data
-                print(f"[CLIENT] Received: {buffer[:100]}")
-                
-                # Process complete messages (delimited by newline)
-                while '\n' in buffer:
-                    message_str, buffer = buffer.split('\n', 1)
-                    if message_str.strip():
-                        try:
-                            msg = json.loads(message_str)
-                            print(f"[CLIENT] Parsed message: {msg.get('type')}")
-                            self.root.after(0, self.handle_message, msg)
-                        except json.JSONDecodeError as je:
-                            print(f"[CLIENT] Failed to parse message: {je}")
-                            # Try to recover from concatenated messages (simple heuristic)
-                            if '}{' in message_str:
-                                print(f"[CLIENT] Attempting to parse merged messages...")
-                                parts = message_str.replace('}{', '}|{').split('|')
-                                for part in parts:
-                                    try:
-                                        msg = json.loads(part)
-                                        print(f"[CLIENT] Recovered message: {msg.get('type')}")
-                                        self.root.after(0, self.handle_message, msg)
-                                    except json.JSONDecodeError:
-                                        pass
-                        
+                self.receive_messages()
             except Exception as e:
-                print(f"[CLIENT] Connection lost: {e}")
-                self.root.after(0, lambda: messagebox.showerror("Mất kết nối", "Đã mất kết nối đến máy chủ"))
-                self.root.after(0, self.root.destroy)
+                logger.warning("Connection lost: %s", e)
+            if self.closing:
                 break
+            if self.session is not None:
+                # Keep the match going: the server holds the session for a while
+                self.inbox.append(self.show_reconnecting)
+                if self.reconnect():
+                    continue
+            self.inbox.append(lambda: messagebox.showerror("Mất kết nối", "Đã mất kết nối đến máy chủ"))
+            self.inbox.append(self.root.destroy)
+            break
+
+    def receive_messages(self):
+        """Read from the current socket until it closes"""
+        sock = self.client_socket
+        decoder = self.codec.decoder()
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                logger.info("No data received (connection closed)")
+                return
+
+            logger.debug("Received %d bytes", len(data))
+            decoder.feed(data)
+            while True:
+                msg = decoder.next_message()
+                if msg is None:
+                    break
+                msg_type = msg.get('type')
+                logger.debug("Parsed message: %s", msg_type)
+                if msg_type in ('connect_ack', 'resume_ack'):
+                    # Counted from here on; a resume continues where the server's backlog starts
+                    self.session = msg.get('session')
+                    self.last_seq = msg.get('seq', 0)
+                    if msg.get('protocol') in CODECS:
+                        # Server agreed on a wire format: everything after the ack uses it
+                        self.codec = CODECS[msg['protocol']]
+                        decoder = self.codec.decoder(decoder.remaining())
+                elif msg_type not in UNSEQUENCED:
+                    self.last_seq += 1
+                self.inbox.append(msg)
+
+    def pump(self):
+        """UI tick: handle what the receiver thread queued, then redraw the roster once"""
+        batch = []
+        while self.inbox:
+            batch.append(self.inbox.popleft())
+        batch = collapse_roster(batch)
+        deadline = time.perf_counter() + PUMP_BUDGET
+        done = 0
+        try:
+            for item in batch:
+                done += 1
+                if callable(item):
+                    item()
+                else:
+                    self.handle_message(item)
+                if time.perf_counter() > deadline:
+                    break
+        finally:
+            if done < len(batch):
+                # Out of time: the rest goes first next tick
+                self.inbox.extendleft(reversed(batch[done:]))
+            if self.roster_dirty and self.player_list is not None and self.player_list.exists():
+                self.roster_dirty = False
+                self.player_list.render()
+            try:
+                self.root.after(PUMP_INTERVAL, self.pump)
+            except tk.TclError:
+                pass  # Window closed
+
+    def show_reconnecting(self):
+        self.show_status("Mất kết nối, đang kết nối lại...", "#e67e22")
+
+    def show_status(self, text, color):
+        """Status line of the match screen, if that is the one showing"""
+        label = getattr(self, 'status_label', None)
+        if label is not None and label.winfo_exists():
+            label.config(text=text, fg=color)
 
     def handle_message(self, msg):
         msg_type = msg.get('type')
-        print(f"[CLIENT] Handling message type: {msg_type}")
+        logger.debug("Handling message type: %s", msg_type)
         
         if msg_type == 'connect_ack':
             self.player_name = msg['name']
             self.setup_lobby_ui()
+
+        elif msg_type == 'resume_ack':
+            logger.info("Session resumed")
+            self.in_queue = msg['status'] == 'waiting'
+            if msg['complete']:
+                # Missed messages follow; the screen is still right (a spectator's view resyncs by itself)
+                self.show_status("Đã kết nối lại!", "white")
+                self.update_queue_button()
+            elif 'match' in msg:
+                self.spectate_seq = None
+                self.opponent_name = msg['match']['opponent']
+                self.setup_game_ui(mode="pvp")
+            else:
+                self.spectate_seq = None
+                self.setup_lobby_ui()
+
+        elif msg_type == 'resume_failed':
+            # Session expired (or another server holds it): start over under the same name
+            self.session = None
+            self.in_queue = False
+            self.send_connect(self.player_name)
             
         elif msg_type == 'player_list':
-            if hasattr(self, 'player_listbox') and self.player_listbox and self.player_listbox.winfo_exists():
-                self.players_data = msg['players'] # Store raw data
-                self.player_listbox.delete(0, END)
-                for p in msg['players']:
-                    display = p['name']
-                    if p['name'] == self.player_name:
-                        display += " (Bạn)"
-                    if p['status'] != 'idle':
-                        display += f" [{p['status'].upper()}]"
-                    self.player_listbox.insert(END, display)
+            # Full snapshot
+            self.players.clear()
+            self.players.update((p['name'], p['status']) for p in msg['players'])
+            self.roster_version = msg.get('version')
+            self.refresh_player_list()
+
+        elif msg_type == 'roster_update':
+            if self.roster_version is None or msg['version'] <= self.roster_version:
+                return  # Snapshot still on its way, or already included in it
+            if msg['base'] != self.roster_version:
+                # Missed an update: ask for a fresh snapshot
+                self.send_request({'type': 'get_players'})
+                return
+            for event in msg['events']:
+                if event[0] == 'player_left':
+                    self.players.pop(event[1], None)
+                else:
+                    self.players[event[1]] = event[2]
+            self.roster_version = msg['version']
+            self.refresh_player_list()
                     
         elif msg_type == 'challenge_request':
             challenger = msg['challenger']
@@ -311,18 +604,26 @@ class RPSClient:
                 self.send_request({'type': 'accept_challenge', 'challenger': challenger, 'accept': False})
                 
         elif msg_type == 'game_start':
+            self.spectate_seq = None  # The server stops a spectator's watching when it starts playing
             self.opponent_name = msg['opponent']
+            self.opponent_rating = msg.get('opponent_rating')
+            self.series_best_of = msg.get('best_of') if 'tournament' in msg else None
+            self.in_queue = False
             self.setup_game_ui(mode="pvp")
+
+        elif msg_type in ('queue_joined', 'queue_left'):
+            self.in_queue = msg_type == 'queue_joined'
+            self.update_queue_button()
             
         elif msg_type == 'challenge_rejected':
             messagebox.showinfo("Từ chối", f"Người chơi {msg['opponent']} đã từ chối.")
 
         elif msg_type == 'opponent_choosed':
-            print(f"[CLIENT] Opponent has chosen, waiting for result")
+            logger.debug("Opponent has chosen, waiting for result")
             self.status_label.config(text="Đối thủ đã chọn xong! Đến lượt bạn!", fg="#f1c40f")
             
         elif msg_type == 'game_result':
-            print(f"[CLIENT] Received game result!")
+            logger.debug("Received game result")
             self.timer_running = False # Stop timer
             result = msg['result']
             my_move = self.translate(msg['my_choice'])
@@ -337,19 +638,145 @@ class RPSClient:
             else:
                 text = f"HÒA!\nBạn: {my_move}   vs   Địch: {opp_move}"
                 text_color = "#f39c12"
-                
+            if msg.get('timeout'):
+                # The server resolved the round because someone ran out of time
+                text = "Hết giờ! " + text
+            series = msg.get('series')
+            if series:
+                text += f"\nTỉ số: {series[0]} - {series[1]}"
+
             self.status_label.config(text=text, fg=text_color)
+
+            # Next round countdown, unless that round decided the series (series_result follows)
+            if not series or max(series) <= self.series_best_of // 2:
+                self.root.after(3000, self.next_round)
             
-            # Next round countdown
-            self.root.after(3000, self.next_round)
-            
+        elif msg_type == 'spectate_state':
+            # First view of a match, or a resync after missing updates
+            if self.spectate_seq is None:
+                self.setup_spectate_ui(msg['players'])
+            self.spectate_seq = msg['seq']
+            self.show_score(msg['score'], msg['draws'])
+            self.audience_label.config(text=f"👁️ {msg['spectators']} người đang xem")
+            chosen = msg['chosen']
+            self.status_label.config(text=f"{', '.join(chosen)} đã chọn..." if chosen else f"Ván {msg['round'] + 1}",
+                                     fg="white")
+            if msg['over']:
+                self.match_watched_over(None)
+
+        elif msg_type == 'spectate_update':
+            if self.spectate_seq is None or msg['seq'] <= self.spectate_seq:
+                return  # Not watching any more, or already in the snapshot
+            self.spectate_seq = msg['seq']
+            if msg['event'] == 'chose':
+                self.status_label.config(text=f"{msg['player']} đã chọn...", fg="white")
+            elif msg['event'] == 'result':
+                moves = f"{self.translate(msg['choices'][0])}   vs   {self.translate(msg['choices'][1])}"
+                winner = f"{msg['winner']} THẮNG!" if msg['winner'] else "HÒA!"
+                self.status_label.config(text=f"{winner}\n{moves}", fg="#00ff88" if msg['winner'] else "#f39c12")
+                self.show_score(msg['score'], msg['draws'])
+            elif msg['event'] == 'end':
+                self.match_watched_over(msg['leaver'])
+
+        elif msg_type == 'opponent_away':
+            self.show_status(f"Đối thủ mất kết nối, chờ tối đa {msg['grace']:.0f} giây...", "#e67e22")
+
+        elif msg_type == 'opponent_back':
+            self.show_status("Đối thủ đã quay lại!", "white")
+
         elif msg_type == 'opponent_left':
             messagebox.showinfo("Thông báo", "Đối thủ đã thoát trận.")
             self.setup_lobby_ui()
+
+        elif msg_type == 'series_result':
+            self.timer_running = False
+            self.series_best_of = None
+            text = "Bạn THẮNG loạt đấu!" if msg['result'] == 'win' else "Bạn THUA loạt đấu."
+            text += f" ({msg['score'][0]} - {msg['score'][1]})"
+            if msg['forfeit']:
+                text += "\nĐối thủ đã bỏ cuộc." if msg['result'] == 'win' else "\nXử thua do bỏ cuộc."
+            messagebox.showinfo(f"Giải đấu #{msg['tournament']}", text)
+            self.setup_lobby_ui()  # The next series starts on its own
+
+        elif msg_type == 'tournament_created':
+            # Enter our own tournament; the button starts it once others have joined
+            self.own_tournament = msg['tournament']['id']
+            self.send_request({'type': 'join_tournament', 'id': self.own_tournament})
+            self.update_tournament_button()
+
+        elif msg_type == 'tournament_joined':
+            t = msg['tournament']
+            messagebox.showinfo("Giải đấu", f"Đã vào giải #{t['id']} ({t['name']}), {t['players']} người chơi.")
+
+        elif msg_type == 'tournament_left':
+            # Also sent when the creator left before starting it
+            messagebox.showinfo("Giải đấu", f"Bạn không còn trong giải #{msg['id']}.")
+
+        elif msg_type == 'tournament_started':
+            t = msg['tournament']
+            if t['id'] == self.own_tournament:
+                self.own_tournament = None
+                self.update_tournament_button()
+            messagebox.showinfo("Giải đấu", f"Giải #{t['id']} bắt đầu với {t['players']} người chơi!")
+
+        elif msg_type == 'tournament_finished':
+            t = msg['tournament']
+            podium = "\n".join(f"{i}. {entry['name']}" for i, entry in enumerate(msg['standings'][:3], 1))
+            messagebox.showinfo("Giải đấu", f"Giải #{t['id']} ({t['name']}) đã kết thúc!\n{podium}")
             
+        elif msg_type == 'chat':
+            self.chat_lines.append(self.chat_line(msg))
+            self.show_chat(msg)
+
+        elif msg_type == 'chat_history':
+            if msg['channel'] == 'lobby':
+                self.chat_lines.clear()
+            self.chat_lines.extend(self.chat_line(m) for m in msg['messages'])
+            self.show_chat()
+
         elif msg_type == 'error':
             messagebox.showerror("Lỗi", msg['message'])
 
+    def refresh_player_list(self):
+        # Drawn at the end of the pump tick, however many roster messages it handled
+        self.roster_dirty = True
+
+    def chat_line(self, msg):
+        if msg['channel'] == 'dm' and msg['from'] == self.player_name:
+            return f"[→ {msg['to']}] {msg['text']}"
+        if msg['channel'] == 'dm':
+            return f"[{msg['from']} →] {msg['text']}"
+        prefix = "[Trận] " if msg['channel'] == 'match' else ""
+        return f"{prefix}{msg['from']}: {msg['text']}"
+
+    def show_chat(self, msg=None):
+        """Append msg's line to the chat box, or redraw it from chat_lines without msg"""
+        box = self.chat_box
+        if box is None or not box.winfo_exists():
+            return
+        box.config(state=tk.NORMAL)
+        if msg is None:
+            box.delete('1.0', END)
+            box.insert(END, "\n".join(self.chat_lines))
+        else:
+            if int(box.index('end-1c').split('.')[0]) > CHAT_LINES:
+                box.delete('1.0', '2.0')
+            box.insert(END, ("\n" if box.index('end-1c') != '1.0' else "") + self.chat_lines[-1])
+        box.config(state=tk.DISABLED)
+        box.see(END)
+
+    def send_chat(self):
+        text = self.chat_entry.get().strip()
+        if not text:
+            return
+        self.chat_entry.delete(0, END)
+        if text.startswith('/w '):
+            _, to, text = (text.split(None, 2) + [''])[:3]
+            if text:
+                self.send_request({'type': 'chat', 'channel': 'dm', 'to': to, 'text': text})
+        else:
+            self.send_request({'type': 'chat', 'channel': 'lobby', 'text': text})
+
     def next_round(self):
         # Reset UI for next round
         self.status_label.config(text="Ván mới! Hãy chọn tiếp...", fg="white")
@@ -360,19 +787,65 @@ class RPSClient:
         for btn in self.choice_btns:
             btn.config(state=tk.NORMAL)
 
-    def challenge_player(self):
-        selection = self.player_listbox.curselection()
-        if not selection:
-            messagebox.showwarning("Chú ý", "Hãy chọn một người chơi!")
+    def watch_player(self):
+        target_name = self.selected_player()
+        if target_name is None:
             return
-            
-        target_index = selection[0]
-        if target_index < len(self.players_data):
-            target_name = self.players_data[target_index]['name']
+        if self.players.get(target_name) != 'playing':
+            messagebox.showwarning("Chú ý", "Người chơi này không ở trong trận!")
+            return
+        self.send_request({'type': 'spectate', 'player': target_name})
+
+    def stop_watching(self):
+        self.spectate_seq = None
+        self.send_request({'type': 'unspectate'})
+        self.setup_lobby_ui()
+
+    def match_watched_over(self, leaver):
+        self.spectate_seq = None
+        text = f"{leaver} đã rời trận." if leaver else "Trận đấu đã kết thúc."
+        messagebox.showinfo("Thông báo", text)
+        self.setup_lobby_ui()
+
+    def toggle_queue(self):
+        """Ask the server for an opponent of similar rating, or stop looking"""
+        self.send_request({'type': 'leave_queue' if self.in_queue else 'join_queue'})
+
+    def update_queue_button(self):
+        if hasattr(self, 'queue_button') and self.queue_button.winfo_exists():
+            self.queue_button.config(text="⏳ HỦY TÌM TRẬN" if self.in_queue else "🎯 TÌM TRẬN")
+
+    def tournament_action(self):
+        """Start the tournament we created, or join one by its number (blank: create one)"""
+        if self.own_tournament is not None:
+            self.send_request({'type': 'start_tournament', 'id': self.own_tournament})
+            return
+        answer = simpledialog.askstring("Giải đấu", "Nhập mã giải để tham gia (để trống để tạo giải mới):",
+                                        parent=self.root)
+        if answer is None:
+            return
+        if not answer.strip():
+            self.send_request({'type': 'create_tournament', 'format': 'single_elimination', 'best_of': 3})
+        elif answer.strip().isdigit():
+            self.send_request({'type': 'join_tournament', 'id': int(answer)})
         else:
-            # Fallback (should not happen if synced)
-            target_str = self.player_listbox.get(target_index)
-            target_name = target_str.split(' ')[0]
+            messagebox.showwarning("Chú ý", "Mã giải đấu là một số!")
+
+    def update_tournament_button(self):
+        if hasattr(self, 'tournament_button') and self.tournament_button.winfo_exists():
+            self.tournament_button.config(text="▶️ BẮT ĐẦU GIẢI" if self.own_tournament is not None else "🏆 GIẢI ĐẤU")
+
+    def selected_player(self):
+        name = self.player_list.selected if self.player_list is not None else None
+        if name is None or name not in self.players:
+            messagebox.showwarning("Chú ý", "Hãy chọn một người chơi!")
+            return None
+        return name
+
+    def challenge_player(self):
+        target_name = self.selected_player()
+        if target_name is None:
+            return
         
         if target_name == self.player_name:
             messagebox.showwarning("Chú ý", "Không thể tự thách đấu bản thân!")
@@ -382,7 +855,7 @@ class RPSClient:
         self.status_label = tk.Label(self.root, text="Đã gửi lời mời...", bg="#1a1a2e", fg="white") # Temp hint
 
     def make_choice(self, choice):
-        print(f"[CLIENT] Making choice: {choice}")
+        logger.debug("Making choice: %s", choice)
         self.status_label.config(text="Đã chọn! Đang chờ kết quả...", fg="#3498db")
         self.timer_running = False # Stop timer once chosen waiting for opponent
         
@@ -392,7 +865,7 @@ class RPSClient:
             
         req_type = 'play_bot' if self.current_mode == 'bot' else 'play'
         self.send_request({'type': req_type, 'choice': choice})
-        print(f"[CLIENT] Sent {req_type} request")
+        logger.debug("Sent %s request", req_type)
 
     def leave_game(self):
         if messagebox.askyesno("Thoát", "Bạn muốn rời trận đấu?"):
@@ -403,9 +876,16 @@ class RPSClient:
 
             
     def translate(self, key):
+        if key is None:
+            return '—'  # Forfeited by running out of time
         return {'rock': 'Búa 🪨', 'paper': 'Bao 📄', 'scissors': 'Kéo ✂️'}.get(key, key)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rock-Paper-Scissors game client")
+    log.add_arguments(parser)
+    args = parser.parse_args()
+    log.setup_logging(args.log_level, args.log_sample)
+
     root = tk.Tk()
     app = RPSClient(root)
     root.mainloop()
@@ -0,0 +1,358 @@
+import os
+import socket
+import threading
+import queue
+import multiprocessing
+from multiprocessing.connection import wait
+
+import log
+from server import RPSServer
+
+# Requests from a player whose match is hosted on another shard
+FORWARDED_REQUESTS = ('play', 'quit_match')
+
+logger = log.get_logger('cluster')
+
+
+class RemotePlayer:
+    """Socket-like stand-in for a player connected to another shard.
+
+    Anything sent to it is routed through the coordinator to the shard that
+    owns the real socket, so the handle_* methods work unchanged.
+    """
+
+    codec = None  # Not ours to encode for: pre-encoded fanouts (chat.py) use send_message instead
+
+    def __init__(self, link, name):
+        self.link = link
+        self.name = name
+
+    def send_message(self, msg, droppable=False):
+        # Encoded by the owning shard, in whatever format that client speaks
+        self.link.send(('deliver', self.name, msg))
+
+    def close(self):
+        pass
+
+
+class ShardLink:
+    """Thread-safe sender on a worker's pipe to the coordinator"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        with self.lock:
+            self.conn.send(msg)
+
+
+class ShardServer(RPSServer):
+    """One worker process: owns the players whose sockets it accepted.
+
+    Cross-shard matches are hosted on the shard of the player who accepted
+    the challenge. The other player is represented there by a RemotePlayer
+    entry in self.clients, and its own shard forwards play/quit_match to
+    the host until the match ends.
+    """
+
+    def __init__(self, shard_id, conn, host='0.0.0.0', port=5555, mode='asyncio', **options):
+        super().__init__(host, port, mode=mode, **options)
+        self.shard_id = shard_id
+        self.conn = conn
+        self.link = ShardLink(conn)
+        self.reuse_port = True
+        self.remote_roster = {}  # {name: (shard, status)} for players on other shards
+        self.proxies = {}  # {name: RemotePlayer} registered in self.clients
+        self.stale_proxies = set()  # proxies to drop once the current request is done
+        self.hosts = {}  # {local socket: shard hosting its match}
+
+    def start(self):
+        threading.Thread(target=self.listen_to_coordinator, daemon=True).start()
+        super().start()
+
+    def listen_to_coordinator(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                # Orphaned worker: nothing can be routed any more
+                logger.error("Shard %d lost coordinator, exiting", self.shard_id)
+                log.stop_logging()
+                os._exit(1)
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.handle_link_message, msg)
+            else:
+                self.handle_link_message(msg)
+
+    def handle_link_message(self, msg):
+        kind = msg[0]
+        if kind == 'roster':
+            _, name, shard, status = msg
+            with self.lock:
+                self.remote_roster[name] = (shard, status)
+            self.presence.update(name, status)
+        elif kind == 'roster_del':
+            with self.lock:
+                self.remote_roster.pop(msg[1], None)
+            self.presence.update(msg[1], None)
+        elif kind == 'deliver':
+            sock = self.local_player(msg[1])
+            if sock:
+                try:
+                    sock.send_message(msg[2])
+                except:
+                    pass
+        elif kind == 'attach':
+            _, name, host = msg
+            sock = self.local_player(name)
+            if sock:
+                self.hosts[sock] = host
+                self.set_player_state(sock, 'playing')
+        elif kind == 'detach':
+            sock = self.local_player(msg[1])
+            if sock and self.hosts.pop(sock, None) is not None:
+                self.set_player_state(sock, 'idle')
+        elif kind == 'rename':
+            # Another shard registered the same name first
+            _, name, new_name = msg
+            sock = self.local_player(name)
+            if sock:
+                with self.lock:
+                    self.clients.rename(sock, new_name)
+                try:
+                    # Same session, counted on from where it is: the client keeps resuming it
+                    with sock.lock:
+                        sock.send_message({'type': 'connect_ack', 'status': 'success', 'name': new_name,
+                                           'session': sock.token, 'seq': sock.seq})
+                except:
+                    pass
+        elif kind == 'forward':
+            _, name, request = msg
+            proxy = self.proxies.get(name)
+            if proxy is None:
+                return
+            if request.get('type') == '_disconnect':
+                self.disconnect_client(proxy)
+            else:
+                self.dispatch(proxy, request)
+
+    def local_player(self, name):
+        sock = RPSServer.find_player(self, name)
+        return None if isinstance(sock, RemotePlayer) else sock
+
+    def allocate_name(self, name):
+        # Names are unique cluster-wide as far as this shard's roster view goes
+        with self.lock:
+            return self.clients.allocate_name(
+                name, lambda candidate: candidate in self.remote_roster or candidate in self.proxies)
+
+    def find_player(self, name, status=None):
+        sock = super().find_player(name, status)
+        if sock is not None:
+            return sock
+        with self.lock:
+            entry = self.remote_roster.get(name)
+            if entry is None or (status is not None and entry[1] != status):
+                return None
+            proxy = self.proxies.get(name)
+            if proxy is None:
+                proxy = self.proxies[name] = RemotePlayer(self.link, name)
+                self.clients.add(proxy, name, entry[1])
+                self.stale_proxies.add(proxy)
+            return proxy
+
+    def prune_proxies(self):
+        """Drop proxies that did not end up in a match hosted here"""
+        with self.lock:
+            for proxy in self.stale_proxies:
+                info = self.clients.get(proxy)
+                if info is None or info['status'] != 'playing':
+                    self.clients.remove(proxy)
+                    if self.proxies.get(proxy.name) is proxy:
+                        del self.proxies[proxy.name]
+            self.stale_proxies.clear()
+
+    def set_player_state(self, sock, status, match=None):
+        super().set_player_state(sock, status, match)
+        if isinstance(sock, RemotePlayer):
+            if status == 'playing':
+                logger.debug("Shard %d hosting cross-shard match for %s", self.shard_id, sock.name)
+                self.link.send(('attach', sock.name, self.shard_id))
+            else:
+                self.link.send(('detach', sock.name))
+                self.stale_proxies.add(sock)
+        else:
+            info = self.clients.get(sock)
+            if info is not None:
+                self.link.send(('status', info['name'], status))
+
+    def dispatch(self, client_socket, request):
+        host = self.hosts.get(client_socket)
+        if host is not None and request.get('type') in FORWARDED_REQUESTS:
+            name = self.clients[client_socket]['name']
+            self.link.send(('forward', host, name, request))
+            return
+        try:
+            super().dispatch(client_socket, request)
+        finally:
+            self.prune_proxies()
+
+    def handle_connect(self, client_sock, request):
+        super().handle_connect(client_sock, request)
+        with self.lock:
+            # Only a connection that just got its session; a repeated connect arrives as the session itself
+            info = self.clients.get(getattr(client_sock, 'session', None))
+        if info:
+            self.link.send(('join', info['name'], info['status']))
+
+    def disconnect_client(self, sock):
+        with self.lock:
+            info = self.clients.get(sock)
+            host = self.hosts.pop(sock, None)
+        if info and host is not None:
+            # The host shard tells the opponent and drops its proxy
+            self.link.send(('forward', host, info['name'], {'type': '_disconnect'}))
+        super().disconnect_client(sock)
+        if info and not isinstance(sock, RemotePlayer):
+            self.link.send(('leave', info['name']))
+        self.prune_proxies()
+
+    def on_roster_change(self, sock, name, status):
+        # Proxies are already in the lobby view through the remote roster
+        if not isinstance(sock, RemotePlayer):
+            super().on_roster_change(sock, name, status)
+
+    def lobby_clients(self):
+        delta_socks, legacy_socks = super().lobby_clients()
+        return ([sock for sock in delta_socks if not isinstance(sock, RemotePlayer)],
+                [sock for sock in legacy_socks if not isinstance(sock, RemotePlayer)])
+
+    def chat_members(self):
+        # Lobby chat stays within the shard; match and dm channels reach proxies too
+        return [sock for sock in super().chat_members() if not isinstance(sock, RemotePlayer)]
+
+
+class Coordinator:
+    """Routes messages between shards and keeps the global roster.
+
+    Each shard has its own outbox thread so a busy worker can never block
+    the coordinator while that worker is itself blocked sending to us.
+    """
+
+    def __init__(self, conns):
+        self.conns = {conn: shard for shard, conn in enumerate(conns)}
+        self.roster = {}  # {name: [shard, status]}
+        self.outboxes = [queue.Queue() for _ in conns]
+        for conn, outbox in zip(conns, self.outboxes):
+            threading.Thread(target=self.drain_outbox, args=(conn, outbox), daemon=True).start()
+
+    def drain_outbox(self, conn, outbox):
+        while True:
+            msg = outbox.get()
+            try:
+                conn.send(msg)
+            except (OSError, ValueError):
+                return
+
+    def send(self, shard, msg):
+        self.outboxes[shard].put(msg)
+
+    def broadcast(self, msg, exclude):
+        for shard in range(len(self.outboxes)):
+            if shard != exclude:
+                self.send(shard, msg)
+
+    def allocate_name(self, name):
+        suffix = 1
+        while f"{name}_{suffix}" in self.roster or suffix == 1:
+            suffix += 1
+        return f"{name}_{suffix}"
+
+    def owner(self, name):
+        entry = self.roster.get(name)
+        return entry[0] if entry else None
+
+    def route(self, shard, msg):
+        kind = msg[0]
+        if kind == 'join':
+            _, name, status = msg
+            if name in self.roster:
+                # Two shards accepted the same name at once: the later one renames
+                new_name = self.allocate_name(name)
+                self.send(shard, ('rename', name, new_name))
+                name = new_name
+            self.roster[name] = [shard, status]
+            self.broadcast(('roster', name, shard, status), exclude=shard)
+        elif kind == 'status':
+            _, name, status = msg
+            if self.owner(name) == shard:
+                self.roster[name][1] = status
+                self.broadcast(('roster', name, shard, status), exclude=shard)
+        elif kind == 'leave':
+            if self.owner(msg[1]) == shard:
+                del self.roster[msg[1]]
+                self.broadcast(('roster_del', msg[1]), exclude=shard)
+        elif kind in ('deliver', 'attach', 'detach'):
+            owner = self.owner(msg[1])
+            if owner is not None:
+                self.send(owner, msg)
+        elif kind == 'forward':
+            _, host, name, request = msg
+            self.send(host, ('forward', name, request))
+
+    def run(self):
+        conns = list(self.conns)
+        while conns:
+            for conn in wait(conns):
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    conns.remove(conn)
+                    continue
+                self.route(self.conns[conn], msg)
+
+
+def run_shard(shard_id, conn, host, port, mode, log_options, options):
+    # Spawned workers start with a fresh logging setup
+    log.setup_logging(*log_options)
+    if options.get('admin_port') is not None:
+        # One admin port per worker
+        options = dict(options, admin_port=options['admin_port'] + shard_id)
+    if options.get('history_dir') is not None:
+        # Each worker logs the matches it hosts
+        options = dict(options, history_dir=os.path.join(options['history_dir'], f'shard{shard_id}'))
+    if options.get('capture') is not None:
+        options = dict(options, capture=f"{options['capture']}.shard{shard_id}")
+    ShardServer(shard_id, conn, host, port, mode, **options).start()
+
+
+def run_cluster(host='0.0.0.0', port=5555, mode='asyncio', workers=2, log_level='info', log_sample=None,
+                **options):
+    """Start N worker processes sharing the port plus the coordinator.
+
+    options are passed on to every ShardServer (presence_window, ...).
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError("Multi-process mode needs SO_REUSEPORT (Linux/BSD/macOS)")
+
+    # spawn rather than fork so workers never inherit each other's pipe ends
+    # and notice when the coordinator goes away
+    ctx = multiprocessing.get_context('spawn')
+    parent_conns, procs = [], []
+    for shard_id in range(workers):
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=run_shard, daemon=True,
+                           args=(shard_id, child_conn, host, port, mode, (log_level, log_sample), options))
+        proc.start()
+        parent_conns.append(parent_conn)
+        procs.append(proc)
+    logger.info("Cluster started on %s:%s with %d %s workers", host, port, workers, mode)
+
+    try:
+        Coordinator(parent_conns).run()
+    except KeyboardInterrupt:
+        logger.info("Cluster stopping...")
+    finally:
+        for proc in procs:
+            proc.terminate()
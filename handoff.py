@@ -0,0 +1,268 @@
+"""Hot restart: a new server process takes over from the running one without dropping anyone.
+
+Run the server with --handoff PATH. It listens on the Unix socket PATH
+for a successor, and a new server started with the same --handoff PATH
+finds it there and takes over:
+
+1. The successor connects and asks for the server.
+2. The old server freezes: it stops accepting, stops reading from its
+   clients (transports paused, or reader threads parked between reads)
+   and holds its timers, then gives what it already queued for its
+   clients up to DRAIN_TIMEOUT to reach the kernel. A client whose
+   queue does not drain in time stays behind: it drops when the old
+   server exits and resumes its session on the new one.
+3. It writes out its round history and sends the listening socket, the
+   client sockets (SCM_RIGHTS, MAX_FDS per message) and the pickled game
+   state (RPSServer.export_state): sessions with their replay buffers,
+   matches with their pending choices, the queue, tournaments, chat and
+   the roster version.
+4. The successor adopts all of it, starts serving and says it is ready;
+   the old server exits without touching the sockets. If the successor
+   hangs up or is not ready within READY_TIMEOUT, the old server thaws
+   and carries on as before.
+
+Only processes of the same user take part: the socket is created for
+its owner alone, and each end checks the other's SO_PEERCRED before
+anything is sent or unpickled.
+
+Clients see a pause, not a disconnect: whatever they send meanwhile
+waits in the kernel for the new process to read it. Round clocks and
+session grace periods start over in the new process, and request rate
+limits start out full.
+"""
+import os
+import pickle
+import select
+import socket
+import struct
+import threading
+import time
+
+import log
+
+MAGIC = b'RPSH'
+# Bumped whenever export_state changes shape: a successor refuses state it does not know
+VERSION = 1
+HEADER = struct.Struct('<4sBII')  # magic, version, sockets, state bytes
+PEERCRED = struct.Struct('3i')  # pid, uid, gid
+REQUEST = b'T'
+READY = b'R'
+# File descriptors per message (the kernel takes at most 253) and state bytes per message
+MAX_FDS = 250
+CHUNK = 64 * 1024
+# Seconds the old server waits for its clients' queues to drain, and for a successor to be ready
+DRAIN_TIMEOUT = 2.0
+READY_TIMEOUT = 30.0
+# Seconds the threads of a threaded server get to park
+FREEZE_TIMEOUT = 5.0
+POLL = 0.005
+
+logger = log.get_logger('handoff')
+
+
+class HandoffError(Exception):
+    """The handoff failed; the old server carries on"""
+
+
+def peer_uid(channel):
+    """The user the process at the other end of a Unix socket runs as"""
+    _, uid, _ = PEERCRED.unpack(channel.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size))
+    return uid
+
+
+class Gate:
+    """Where a threaded server's accept loop and reader threads wait while it is frozen.
+
+    Each thread polls its socket together with the read end of a pipe.
+    freeze() writes to the pipe, which wakes them all at once, and every
+    thread parks at its next poll until thaw(). A thread busy with a
+    request finishes it first, so nothing is left half done.
+    """
+
+    def __init__(self):
+        self.wake_r, self.wake_w = os.pipe()
+        self.cond = threading.Condition()
+        self.frozen = False
+        self.parked = 0
+
+    def poller(self, fileno):
+        poller = select.poll()
+        poller.register(fileno, select.POLLIN)
+        poller.register(self.wake_r, select.POLLIN)
+        return poller
+
+    def hold(self, poller):
+        """Return once the polled socket is readable, parking meanwhile if the server freezes"""
+        while True:
+            if all(fd != self.wake_r for fd, _ in poller.poll()):
+                return
+            with self.cond:
+                self.parked += 1
+                self.cond.notify_all()
+                while self.frozen:
+                    self.cond.wait()
+                self.parked -= 1
+
+    def freeze(self, threads, timeout=FREEZE_TIMEOUT):
+        """Park every thread, threads() being how many there are; False if they did not in time"""
+        with self.cond:
+            self.frozen = True
+        os.write(self.wake_w, b'x')
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.parked < threads():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(min(remaining, POLL))
+        return True
+
+    def thaw(self):
+        with self.cond:
+            os.read(self.wake_r, 1)
+            self.frozen = False
+            self.cond.notify_all()
+
+
+class Successor:
+    """The old server's end of a handoff"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def send(self, fds, state):
+        """The listening socket and client sockets (fds), then the state"""
+        data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        self.channel.sendall(HEADER.pack(MAGIC, VERSION, len(fds), len(data)))
+        for start in range(0, len(fds), MAX_FDS):
+            socket.send_fds(self.channel, [b'F'], fds[start:start + MAX_FDS])
+        for start in range(0, len(data), CHUNK):
+            self.channel.sendall(data[start:start + CHUNK])
+        return len(data)
+
+    def ready(self, timeout=READY_TIMEOUT):
+        """Whether the successor took everything over and is serving"""
+        self.channel.settimeout(timeout)
+        try:
+            return self.channel.recv(1) == READY
+        except OSError:
+            return False
+
+
+class Takeover:
+    """The new server's end: what the old one handed over"""
+
+    def __init__(self, channel, listener, sockets, state, timings):
+        self.channel = channel
+        self.listener = listener
+        self.sockets = sockets
+        self.state = state
+        self.timings = timings  # {phase: seconds}
+
+    def ready(self):
+        """Tell the old server to go; logs how long the takeover took"""
+        self.timings['adopt'] = time.perf_counter() - self.timings.pop('received_at')
+        self.channel.sendall(READY)
+        total = sum(self.timings.values())
+        logger.info("Took over %d connections and %d sessions in %.1f ms (freeze %.1f ms, transfer %.1f ms, "
+                    "adopt %.1f ms)", len(self.sockets), len(self.state['sessions']), total * 1000,
+                    self.timings['freeze'] * 1000, self.timings['transfer'] * 1000, self.timings['adopt'] * 1000)
+
+    def wait_gone(self):
+        """Block until the old server has exited"""
+        self.channel.settimeout(None)
+        try:
+            while self.channel.recv(1):
+                pass
+        except OSError:
+            pass
+        self.channel.close()
+
+
+class Handoff:
+    """A server's handoff socket: takes over from a predecessor, then waits for a successor"""
+
+    def __init__(self, server, path):
+        self.server = server
+        self.path = path
+        self.gate = Gate() if server.mode == 'threaded' else None
+        self.takeover = None
+
+    def take_over(self):
+        """Everything a server still listening on path hands over, or None if there is none"""
+        channel = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            channel.connect(self.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            channel.close()
+            return None
+        started = time.perf_counter()
+        try:
+            # What it sends is unpickled: only from a server of our own user
+            if peer_uid(channel) != os.getuid():
+                raise HandoffError(f"{self.path} belongs to a server of another user")
+            channel.sendall(REQUEST)
+            header = channel.recv(HEADER.size)
+            frozen = time.perf_counter()
+            if len(header) != HEADER.size:
+                raise HandoffError("the running server hung up")
+            magic, version, count, size = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise HandoffError(f"the running server speaks handoff version {version}, not {VERSION}")
+            fds = []
+            while len(fds) < count:
+                _, received, flags, _ = socket.recv_fds(channel, 1, MAX_FDS)
+                fds += received
+                if flags & socket.MSG_CTRUNC or not received:
+                    for fd in fds:
+                        os.close(fd)
+                    raise HandoffError("could not receive every socket (too many open files?)")
+            data = bytearray()
+            while len(data) < size:
+                chunk = channel.recv(CHUNK)
+                if not chunk:
+                    raise HandoffError("the running server hung up")
+                data += chunk
+        except (HandoffError, OSError):
+            channel.close()
+            raise
+        received = time.perf_counter()
+        sockets = [socket.socket(fileno=fd) for fd in fds]
+        self.takeover = Takeover(channel, sockets[0], sockets[1:], pickle.loads(data),
+                                 {'freeze': frozen - started, 'transfer': received - frozen, 'received_at': received})
+        return self.takeover
+
+    def listen(self):
+        """Once the predecessor, if any, is gone: start the admin server and wait for a successor"""
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        if self.takeover is not None:
+            self.takeover.wait_gone()
+            self.takeover = None
+        self.server.start_admin()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # Bound aside and renamed into place, so a successor never finds the path missing;
+        # only our own user may connect
+        staging = f'{self.path}.{os.getpid()}'
+        if os.path.exists(staging):
+            os.unlink(staging)
+        umask = os.umask(0o077)
+        try:
+            listener.bind(staging)
+        finally:
+            os.umask(umask)
+        listener.listen(1)
+        os.replace(staging, self.path)
+        logger.info("Waiting for a successor on %s", self.path)
+        while True:
+            channel, _ = listener.accept()
+            try:
+                if peer_uid(channel) != os.getuid():
+                    logger.warning("Refused a handoff to a process of another user")
+                elif channel.recv(len(REQUEST)) == REQUEST:
+                    self.server.hand_over(Successor(channel))
+            except OSError as e:
+                logger.warning("Handoff failed: %s", e)
+            finally:
+                channel.close()
@@ -0,0 +1,332 @@
+"""Persistent round history and the leaderboard built from it.
+
+Every played round (PvP or a single play_bot round; play_bot_batch is
+not recorded) is appended to <dir>/rounds.log as one fixed-size binary
+record, so the file can be read back with plain struct offsets and a
+torn write at the end is cut off on load:
+
+HEADER  kind, log generation
+ROUND   kind, player choice, opponent choice, player result, player id,
+        opponent id, time in ms
+TOTALS  kind, player id, wins, losses, draws
+RATING  kind, player id, Elo rating (matchmaker.py)
+
+Player ids index <dir>/names, one JSON string per line. Results are from
+the first player's side; the bot is opponent BOT.
+
+Nothing touches the disk on the caller's thread: record_round() updates
+the in-memory leaderboard and unsealed rows and queues the encoded
+record. A writer thread wakes when records arrive, waits commit_interval
+for more to pile up, then writes the whole group and fsyncs once (group
+commit). Every compact_every records it compacts: the rounds of the
+current generation are sealed into a columnar segment of the archive
+(archive.py), which answers history queries from then on, and the log
+is replaced by the next generation's header plus leaderboard TOTALS
+and RATINGs.
+If the server dies between the two steps, the segment already carrying
+the log's generation tells the next start not to seal those rounds
+twice.
+"""
+import json
+import os
+import struct
+import threading
+import time
+
+import log
+from archive import Archive, Tail, BOT, NO_CHOICE, CODES, HAS_NUMPY
+from leaderboard import Leaderboard
+from matchmaker import Ratings
+from protocol import CHOICES, RESULTS, CHOICE_CODES, RESULT_CODES
+
+ROUND = struct.Struct('<BBBBIIQ')
+TOTALS = struct.Struct('<B3xIIII')
+RATING = struct.Struct('<B3xId4x')
+RECORD_SIZE = ROUND.size
+assert TOTALS.size == RATING.size == RECORD_SIZE
+KIND_ROUND = 0
+KIND_TOTALS = 1
+KIND_HEADER = 2
+KIND_RATING = 3
+
+# Most rounds one get_history returns; also what each player keeps without a history directory
+HISTORY_KEEP = 100
+# Group commit window: how long the writer waits for more records before an fsync
+COMMIT_INTERVAL = 0.005
+COMPACT_EVERY = 1000000
+# Result codes seen from the other player's side
+FLIPPED = (RESULT_CODES['lose'], RESULT_CODES['win'], RESULT_CODES['draw'])
+
+logger = log.get_logger('history')
+
+
+class HistoryStore:
+    """Round log, archive, unsealed rows, the PvP leaderboard and ratings.
+
+    With path=None everything stays in memory (nothing survives a
+    restart) and each player keeps only their last HISTORY_KEEP rounds.
+    """
+
+    def __init__(self, path=None, commit_interval=COMMIT_INTERVAL, compact_every=COMPACT_EVERY,
+                 use_numpy=HAS_NUMPY):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.compact_every = compact_every
+        self.cond = threading.Condition()
+        self.leaderboard = Leaderboard()
+        self.ratings = Ratings()
+        self.tail = Tail(limit=HISTORY_KEEP if path is None else None)
+        self.sealing = None  # tail being written to a segment, still queried meanwhile
+        self.archive = None
+        self.generation = 0
+        self.names = []  # id -> name
+        self.ids = {}  # name -> id
+        self.pending = []  # encoded records not written yet
+        self.pending_names = []
+        self.appended = 0  # records in the log since it was last compacted
+        self.closed = False
+        self.log_file = None
+        self.names_file = None
+        self.writer = None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self.archive = Archive(os.path.join(path, 'archive'), use_numpy)
+            self.load()
+            self.log_file = open(os.path.join(path, 'rounds.log'), 'ab')
+            if self.log_file.tell() == 0:
+                self.log_file.write(TOTALS.pack(KIND_HEADER, self.generation, 0, 0, 0))
+            self.names_file = open(os.path.join(path, 'names'), 'a', encoding='utf-8')
+            self.writer = threading.Thread(target=self.run, daemon=True)
+            self.writer.start()
+
+    @property
+    def pending_records(self):
+        return len(self.pending)
+
+    def export(self):
+        """What an in-memory store holds, for a successor process (handoff.py); None if it is on disk"""
+        if self.path is not None:
+            return None
+        with self.cond:
+            return {'leaderboard': self.leaderboard, 'ratings': self.ratings, 'tail': self.tail,
+                    'names': self.names, 'ids': self.ids}
+
+    def adopt(self, state):
+        """Take over an in-memory store exported by a predecessor"""
+        with self.cond:
+            self.leaderboard, self.ratings, self.tail = state['leaderboard'], state['ratings'], state['tail']
+            self.names, self.ids = state['names'], state['ids']
+
+    def player_id(self, name):
+        """Id for name, assigning (and queueing) a new one; call with cond held"""
+        player = self.ids.get(name)
+        if player is None:
+            player = self.ids[name] = len(self.names)
+            self.names.append(name)
+            if self.path is not None:
+                self.pending_names.append(name)
+        return player
+
+    def record_round(self, name, opponent, choice, opponent_choice, result):
+        """Add a finished round; opponent None for the bot. Returns immediately."""
+        mine, theirs = CHOICE_CODES.get(choice, NO_CHOICE), CHOICE_CODES.get(opponent_choice, NO_CHOICE)
+        result = RESULT_CODES[result]
+        with self.cond:
+            now = int(time.time() * 1000)
+            player = self.player_id(name)
+            other = BOT if opponent is None else self.player_id(opponent)
+            self.remember(now, player, other, mine, theirs, result)
+            if self.path is not None:
+                self.pending.append(ROUND.pack(KIND_ROUND, mine, theirs, result, player, other, now))
+                self.cond.notify()
+
+    def remember(self, ms, player, opponent, mine, theirs, result, sealed=False):
+        """Apply a round to the leaderboard and, unless already archived, the unsealed rows"""
+        if not sealed:
+            self.tail.add(player, ms, opponent, mine, theirs, result)
+        if opponent != BOT:
+            if not sealed:
+                self.tail.add(opponent, ms, player, theirs, mine, FLIPPED[result])
+            self.leaderboard.record(self.names[player], result)
+            self.leaderboard.record(self.names[opponent], FLIPPED[result])
+            self.ratings.update(self.names[player], self.names[opponent], RESULTS[result])
+
+    def sources(self, player):
+        """player's rows, newest first: unsealed, being sealed, then the archive"""
+        with self.cond:
+            found = [rows for rows in (self.tail.rows_of(player),
+                                       self.sealing.rows_of(player) if self.sealing else None) if rows]
+            segments = list(self.archive.rows_of(player)) if self.archive is not None else []
+        return found + segments
+
+    def history(self, name, limit=HISTORY_KEEP, opponent=None):
+        """name's last rounds (only those against opponent if given), newest first, from name's side"""
+        player = self.ids.get(name)
+        other = self.ids.get(opponent) if opponent is not None else None
+        if player is None or (opponent is not None and other is None):
+            return []
+        rounds = []
+        for rows in self.sources(player):
+            if other is not None:
+                rows = rows.against(other)
+            rounds.extend(rows.last(limit - len(rounds)))
+            if len(rounds) >= limit:
+                break
+        return [{'time': ms / 1000, 'opponent': None if other_id == BOT else self.names[other_id],
+                 'bot': other_id == BOT,
+                 'my_choice': CHOICES[mine] if mine < len(CHOICES) else None,
+                 'opponent_choice': CHOICES[theirs] if theirs < len(CHOICES) else None,
+                 'result': RESULTS[result]} for ms, other_id, mine, theirs, result in rounds]
+
+    def stats(self, name, opponent=None):
+        """Totals, win rate and choice mix over all of name's rounds (or those against opponent)"""
+        player = self.ids.get(name)
+        other = self.ids.get(opponent) if opponent is not None else None
+        results = [0] * CODES
+        choices = [0] * CODES
+        if player is not None and (opponent is None or other is not None):
+            for rows in self.sources(player):
+                if other is not None:
+                    rows = rows.against(other)
+                results = [a + b for a, b in zip(results, rows.counts('result'))]
+                choices = [a + b for a, b in zip(choices, rows.counts('mine'))]
+        wins, losses, draws = (results[RESULT_CODES[result]] for result in ('win', 'lose', 'draw'))
+        rounds = sum(results)
+        return {'player': name, 'opponent': opponent, 'rating': round(self.rating(name)), 'rounds': rounds,
+                'wins': wins, 'losses': losses, 'draws': draws,
+                'win_rate': round(wins / rounds, 4) if rounds else None,
+                'choices': {choice: choices[code] for code, choice in enumerate(CHOICES)}}
+
+    def rating(self, name):
+        with self.cond:
+            return self.ratings.get(name)
+
+    def top(self, offset=0, limit=10):
+        with self.cond:
+            return len(self.leaderboard), self.leaderboard.top(offset, limit)
+
+    def standing(self, name):
+        with self.cond:
+            if name not in self.leaderboard.stats:
+                return None
+            return self.leaderboard.entry(name)
+
+    def load(self):
+        names_path = os.path.join(self.path, 'names')
+        if os.path.exists(names_path):
+            with open(names_path, encoding='utf-8') as f:
+                self.names = [json.loads(line) for line in f]
+            self.ids = {name: player for player, name in enumerate(self.names)}
+
+        log_path = os.path.join(self.path, 'rounds.log')
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, 'rb') as f:
+            data = f.read()
+        whole = len(data) - len(data) % RECORD_SIZE
+        if whole != len(data):
+            logger.warning("Dropping %d bytes of a torn record at the end of %s", len(data) - whole, log_path)
+            with open(log_path, 'r+b') as f:
+                f.truncate(whole)
+        sealed = False
+        for offset in range(0, whole, RECORD_SIZE):
+            kind = data[offset]
+            if kind == KIND_ROUND:
+                _, mine, theirs, result, player, opponent, ms = ROUND.unpack_from(data, offset)
+                self.remember(ms, player, opponent, mine, theirs, result, sealed)
+            elif kind == KIND_TOTALS:
+                _, player, wins, losses, draws = TOTALS.unpack_from(data, offset)
+                self.leaderboard.add(self.names[player], wins, losses, draws)
+            elif kind == KIND_RATING:
+                _, player, rating = RATING.unpack_from(data, offset)
+                self.ratings.set(self.names[player], rating)
+            elif kind == KIND_HEADER:
+                self.generation = TOTALS.unpack_from(data, offset)[1]
+                # Sealed but the log was not replaced yet: finish that compaction
+                sealed = self.archive.has(self.generation)
+        self.appended = whole // RECORD_SIZE
+        logger.info("Loaded %d history records, %d players on the leaderboard, %d archived rows",
+                    self.appended, len(self.leaderboard), len(self.archive))
+        if sealed:
+            self.replace_log(self.snapshot_totals())
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    break
+            if not self.closed:
+                # Let the rest of this burst join the same fsync
+                time.sleep(self.commit_interval)
+            try:
+                self.commit()
+                if self.appended >= self.compact_every:
+                    self.compact()
+            except OSError as e:
+                logger.error("Writing round history failed: %s", e)
+
+    def commit(self):
+        with self.cond:
+            records, self.pending = self.pending, []
+            names, self.pending_names = self.pending_names, []
+        self.write(records, names)
+
+    def write(self, records, names):
+        if names:
+            self.names_file.write(''.join(json.dumps(name) + '\n' for name in names))
+            self.names_file.flush()
+            os.fsync(self.names_file.fileno())
+        if records:
+            self.log_file.write(b''.join(records))
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+            self.appended += len(records)
+
+    def snapshot_totals(self):
+        return ([TOTALS.pack(KIND_TOTALS, self.ids[name], *stats)
+                 for name, stats in self.leaderboard.stats.items() if any(stats)] +
+                [RATING.pack(KIND_RATING, self.ids[name], rating) for name, rating in self.ratings.ratings.items()])
+
+    def compact(self):
+        """Seal this generation's rounds into the archive and restart the log from totals"""
+        started = time.perf_counter()
+        with self.cond:
+            # Everything recorded so far; later rounds go to the next generation's log
+            self.sealing, self.tail = self.tail, Tail()
+            totals = self.snapshot_totals()
+            records, self.pending = self.pending, []
+            names, self.pending_names = self.pending_names, []
+        self.write(records, names)
+        segment = self.archive.seal(self.sealing, self.generation)
+        with self.cond:
+            self.archive.segments.append(segment)
+            self.sealing = None
+        self.replace_log(totals)
+        logger.info("Sealed %d rows into %s, log restarted with %d totals in %.2fs",
+                    segment.row_count, os.path.basename(segment.path), len(totals), time.perf_counter() - started)
+
+    def replace_log(self, totals):
+        self.generation += 1
+        log_path = os.path.join(self.path, 'rounds.log')
+        with open(log_path + '.tmp', 'wb') as f:
+            f.write(TOTALS.pack(KIND_HEADER, self.generation, 0, 0, 0))
+            f.write(b''.join(totals))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(log_path + '.tmp', log_path)
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = open(log_path, 'ab')
+        self.appended = len(totals) + 1
+
+    def close(self):
+        """Flush what is queued and stop the writer"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.writer is not None:
+            self.writer.join()
+            self.log_file.close()
+            self.names_file.close()
@@ -0,0 +1,189 @@
+"""Leaderboard index: players ordered by score with O(log N) rank queries.
+
+Players are kept in a RankedList ordered by (losses - wins, -wins, name),
+so the best player comes first and ties go to more wins, then the name.
+The list is split into sorted blocks of LOAD to 2 * LOAD keys: finding a
+key is two C bisects (over the blocks' last keys, then inside one
+block), and a Fenwick tree over the block lengths turns a block index
+into a rank and a rank into a block in O(log B). Recording a result,
+looking up a player's rank and reading K entries from any offset cost
+O(log N), O(log N) and O(log N + K), with the per-step work in C rather
+than chasing one Python object per element as a skip list would.
+"""
+from bisect import bisect_left, insort
+
+# Block size; blocks split when they reach twice this
+LOAD = 512
+
+
+class RankedList:
+    """Sorted set of unique, comparable keys, indexable by rank (0-based)"""
+
+    def __init__(self):
+        self.blocks = []  # sorted lists, each key greater than every key in the blocks before
+        self.maxes = []  # last key of each block
+        self.tree = [0]  # Fenwick tree over len(block), 1-based
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    def rebuild(self):
+        """Recompute the Fenwick tree after blocks were added or removed"""
+        count = len(self.blocks)
+        tree = [0] * (count + 1)
+        for i, block in enumerate(self.blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent <= count:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def bump(self, index, delta):
+        tree = self.tree
+        i = index + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def before(self, index):
+        """Keys in the blocks before blocks[index]"""
+        tree = self.tree
+        total = 0
+        while index:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def locate(self, position):
+        """(block index, offset in block) of the key at position"""
+        tree = self.tree
+        index = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = index + step
+            if nxt < len(tree) and tree[nxt] <= position:
+                index = nxt
+                position -= tree[nxt]
+            step >>= 1
+        return index, position
+
+    def insert(self, key):
+        blocks, maxes = self.blocks, self.maxes
+        self.size += 1
+        if not blocks:
+            blocks.append([key])
+            maxes.append(key)
+            self.rebuild()
+            return
+        i = bisect_left(maxes, key)
+        if i == len(maxes):
+            i -= 1
+            blocks[i].append(key)
+            maxes[i] = key
+        else:
+            insort(blocks[i], key)
+        block = blocks[i]
+        if len(block) >= 2 * LOAD:
+            blocks.insert(i + 1, block[LOAD:])
+            del block[LOAD:]
+            maxes.insert(i, block[-1])
+            self.rebuild()
+        else:
+            self.bump(i, 1)
+
+    def remove(self, key):
+        """Remove key; raises KeyError if it is not there"""
+        blocks, maxes = self.blocks, self.maxes
+        i = bisect_left(maxes, key)
+        block = blocks[i] if i < len(blocks) else ()
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            raise KeyError(key)
+        del block[j]
+        self.size -= 1
+        if not block:
+            del blocks[i]
+            del maxes[i]
+            self.rebuild()
+            return
+        if j == len(block):
+            maxes[i] = block[-1]
+        self.bump(i, -1)
+
+    def rank(self, key):
+        """0-based position of key, None if it is not there"""
+        i = bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            return None
+        block = self.blocks[i]
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            return None
+        return self.before(i) + j
+
+    def slice(self, start, count):
+        """Up to count keys from position start on"""
+        if start >= self.size or count <= 0:
+            return []
+        i, j = self.locate(start)
+        keys = self.blocks[i][j:j + count]
+        i += 1
+        while len(keys) < count and i < len(self.blocks):
+            keys.extend(self.blocks[i][:count - len(keys)])
+            i += 1
+        return keys
+
+
+class Leaderboard:
+    """PvP win/loss/draw totals per player name, ranked"""
+
+    def __init__(self):
+        self.stats = {}  # {name: [wins, losses, draws]}
+        self.ranking = RankedList()
+
+    def __len__(self):
+        return len(self.stats)
+
+    @staticmethod
+    def key(name, stats):
+        return (stats[1] - stats[0], -stats[0], name)
+
+    def add(self, name, wins=0, losses=0, draws=0):
+        """Add to a player's totals (results are RESULTS indexes: win, lose, draw)"""
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = [0, 0, 0]
+            old = None
+        else:
+            old = self.key(name, stats)
+        stats[0] += wins
+        stats[1] += losses
+        stats[2] += draws
+        new = self.key(name, stats)
+        if new != old:  # draws do not move anyone
+            if old is not None:
+                self.ranking.remove(old)
+            self.ranking.insert(new)
+
+    def record(self, name, result):
+        self.add(name, *((1, 0, 0), (0, 1, 0), (0, 0, 1))[result])
+
+    def rank(self, name):
+        """1-based rank, None for a player without PvP rounds"""
+        stats = self.stats.get(name)
+        if stats is None:
+            return None
+        return self.ranking.rank(self.key(name, stats)) + 1
+
+    def entry(self, name, rank=None):
+        wins, losses, draws = self.stats[name]
+        return {'rank': rank or self.rank(name), 'name': name, 'wins': wins, 'losses': losses, 'draws': draws}
+
+    def top(self, offset=0, limit=10):
+        keys = self.ranking.slice(offset, limit)
+        return [self.entry(key[2], offset + i + 1) for i, key in enumerate(keys)]
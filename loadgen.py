@@ -0,0 +1,395 @@
+"""Headless load generator: a swarm of scripted players on asyncio.
+
+A scenario is a JSON file (see benchmarks/scenarios/) such as
+
+    {"description": "...", "duration": 10, "ramp": 2, "protocol": "rpsb1",
+     "groups": [{"behavior": "pvp", "players": 1000, "think_time": 0.05}]}
+
+Every group starts `players` players running one behavior, spread over
+`ramp` seconds, and runs until `duration` seconds after the ramp:
+
+lobby   connect, get_players, then idle receiving roster updates
+pvp     pairs up: one challenges, the other accepts, then both play rounds
+        and finally quit_match
+bot     play_bot rounds ('strategy' option), or play_bot_batch rounds of
+        'batch' moves when that is set
+churn   connect, get_players, disconnect, over and over
+queue   join_queue, play 'rounds' rounds (default 3) against whoever it
+        is paired with, quit_match and queue again; 'queue_wait' in the
+        report is join_queue until game_start
+
+Players speak the same protocol module as the Tk client. The report has
+p50/p95/p99 latency per request type (time until the reply it waits for),
+throughput and error counts, printed as JSON.
+
+Usage: python loadgen.py benchmarks/scenarios/steady_pvp.json [--port 5555]
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import time
+from collections import defaultdict, deque
+
+from protocol import NDJSON, CODECS
+
+# How long to wait for any single reply before counting a timeout
+REPLY_TIMEOUT = 10.0
+# Attempts at a challenge the server answered with an error
+CHALLENGE_RETRIES = 20
+CHOICES = ('rock', 'paper', 'scissors')
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # {request type: [seconds]}
+        self.errors = defaultdict(int)  # {kind: count}
+        self.received = 0
+        self.rounds = 0
+
+    def record(self, msg_type, seconds):
+        self.latencies[msg_type].append(seconds)
+
+    def error(self, kind):
+        self.errors[kind] += 1
+
+    def report(self, elapsed):
+        requests = {}
+        for msg_type, values in sorted(self.latencies.items()):
+            values.sort()
+            pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+            requests[msg_type] = {'count': len(values), 'per_s': round(len(values) / elapsed),
+                                  'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+                                  'max_ms': round(values[-1] * 1000, 3)}
+        return {'elapsed_s': round(elapsed, 2),
+                'requests': requests,
+                'requests_per_s': round(sum(len(v) for v in self.latencies.values()) / elapsed),
+                'rounds_per_s': round(self.rounds / elapsed),
+                'messages_received': self.received,
+                'errors': dict(self.errors)}
+
+
+class Player:
+    """One simulated client: a reader task plus per-type reply waiters"""
+
+    def __init__(self, stats, protocol):
+        self.stats = stats
+        self.protocol = protocol
+        self.codec = NDJSON
+        self.decoder = NDJSON.decoder()
+        self.name = None
+        self.reader = None
+        self.writer = None
+        self.waiters = defaultdict(deque)  # {message type: futures in order}
+        self.reader_task = None
+
+    async def connect(self, host, port, name):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.reader_task = asyncio.ensure_future(self.read_loop())
+        ack = await self.request({'type': 'connect', 'player_name': name, 'features': ['roster_deltas'],
+                                  'protocols': [self.protocol]}, 'connect_ack', 'connect')
+        self.name = ack['name']
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                self.decoder.feed(data)
+                while True:
+                    msg = self.decoder.next_message()
+                    if msg is None:
+                        break
+                    self.on_message(msg)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            for waiters in self.waiters.values():
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(ConnectionError("connection closed"))
+
+    def on_message(self, msg):
+        self.stats.received += 1
+        msg_type = msg.get('type')
+        if msg_type == 'connect_ack' and msg.get('protocol') in CODECS:
+            self.codec = CODECS[msg['protocol']]
+            self.decoder = self.codec.decoder(self.decoder.remaining())
+        elif msg_type == 'error':
+            self.stats.error('server_error')
+        waiters = self.waiters.get(msg_type)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(msg)
+                break
+
+    def send(self, msg):
+        self.writer.write(self.codec.encode(msg))
+
+    def expect(self, msg_type):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[msg_type].append(future)
+        return future
+
+    async def wait(self, future, label):
+        try:
+            return await asyncio.wait_for(future, REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.stats.error(f'timeout_{label}')
+            raise
+
+    async def request(self, msg, reply_type, label=None):
+        """Send msg, wait for reply_type and record the latency under label"""
+        label = label or msg['type']
+        future = self.expect(reply_type)
+        t = time.perf_counter()
+        self.send(msg)
+        reply = await self.wait(future, label)
+        self.stats.record(label, time.perf_counter() - t)
+        return reply
+
+    async def close(self):
+        for waiters in self.waiters.values():
+            for future in waiters:
+                # Nobody is going to wait for these any more
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()
+        if self.writer is not None:
+            if self.name is not None and not self.writer.is_closing():
+                # Leave for good, or the server holds the name for its session grace period
+                self.send({'type': 'logout'})
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+
+
+class Swarm:
+    def __init__(self, host, port, scenario):
+        self.host = host
+        self.port = port
+        self.scenario = scenario
+        self.protocol = scenario.get('protocol', 'ndjson')
+        self.stats = Stats()
+        self.deadline = None
+        self.run_id = random.randrange(1 << 20)
+
+    def running(self):
+        return time.perf_counter() < self.deadline
+
+    async def new_player(self, name):
+        player = Player(self.stats, self.protocol)
+        try:
+            await player.connect(self.host, self.port, name)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.stats.error('connect_failed')
+            await player.close()
+            return None
+        return player
+
+    async def idle_until_end(self):
+        await asyncio.sleep(max(0, self.deadline - time.perf_counter()))
+
+    async def behave_lobby(self, name, group):
+        player = await self.new_player(name)
+        if player is None:
+            return
+        try:
+            await player.request({'type': 'get_players'}, 'player_list')
+            await self.idle_until_end()
+        finally:
+            await player.close()
+
+    async def behave_bot(self, name, group):
+        player = await self.new_player(name)
+        if player is None:
+            return
+        think = group.get('think_time', 0)
+        batch = group.get('batch')
+        try:
+            while self.running():
+                if batch:
+                    choices = ''.join(random.choice('rps') for _ in range(batch))
+                    await player.request({'type': 'play_bot_batch', 'choices': choices}, 'bot_batch_result')
+                    self.stats.rounds += batch
+                else:
+                    msg = {'type': 'play_bot', 'choice': random.choice(CHOICES)}
+                    if group.get('strategy'):
+                        msg['strategy'] = group['strategy']
+                    await player.request(msg, 'game_result')
+                    self.stats.rounds += 1
+                if think:
+                    await asyncio.sleep(think)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            await player.close()
+
+    async def behave_churn(self, name, group):
+        think = group.get('think_time', 0)
+        while self.running():
+            player = await self.new_player(name)
+            if player is None:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                await player.request({'type': 'get_players'}, 'player_list')
+            except (ConnectionError, asyncio.TimeoutError):
+                pass
+            await player.close()
+            if think:
+                await asyncio.sleep(think)
+
+    async def behave_queue(self, name, group):
+        player = await self.new_player(name)
+        if player is None:
+            return
+        rounds = group.get('rounds', 3)
+        think = group.get('think_time', 0)
+        try:
+            while self.running():
+                started = player.expect('game_start')
+                t = time.perf_counter()
+                await player.request({'type': 'join_queue'}, 'queue_joined')
+                try:
+                    await asyncio.wait_for(asyncio.shield(started), max(0.1, self.deadline - time.perf_counter()))
+                except asyncio.TimeoutError:
+                    await player.request({'type': 'leave_queue'}, 'queue_left')
+                    break
+                self.stats.record('queue_wait', time.perf_counter() - t)
+                for _ in range(rounds):
+                    await player.request({'type': 'play', 'choice': random.choice(CHOICES)}, 'game_result')
+                    self.stats.rounds += 0.5  # Each round is counted by both of its players
+                    if think:
+                        await asyncio.sleep(think)
+                player.send({'type': 'quit_match'})
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            await player.close()
+
+    async def behave_pvp_pair(self, name, group):
+        a = await self.new_player(f'{name}a')
+        b = await self.new_player(f'{name}b')
+        if a is None or b is None:
+            for player in (a, b):
+                if player is not None:
+                    await player.close()
+            return
+        think = group.get('think_time', 0)
+        try:
+            # Challenge latency: challenge sent until the challenger's game_start
+            challenged = b.expect('challenge_request')
+            started = a.expect('game_start')
+            t = time.perf_counter()
+            for attempt in range(CHALLENGE_RETRIES):
+                # In a cluster b may not have reached a's shard's roster yet
+                rejected = a.expect('error')
+                a.send({'type': 'challenge', 'target_name': b.name})
+                done, _ = await asyncio.wait((challenged, rejected), timeout=REPLY_TIMEOUT,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if challenged in done:
+                    break
+                if not done:
+                    self.stats.error('timeout_challenge')
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep(0.1)
+            else:
+                raise ConnectionError("challenge kept failing")
+            rejected.cancel()
+            await b.request({'type': 'accept_challenge', 'challenger': a.name, 'accept': True},
+                            'game_start', 'accept_challenge')
+            await a.wait(started, 'challenge')
+            self.stats.record('challenge', time.perf_counter() - t)
+
+            while self.running():
+                await asyncio.gather(
+                    a.request({'type': 'play', 'choice': random.choice(CHOICES)}, 'game_result'),
+                    b.request({'type': 'play', 'choice': random.choice(CHOICES)}, 'game_result'))
+                self.stats.rounds += 1
+                if think:
+                    await asyncio.sleep(think)
+            left = b.expect('opponent_left')
+            a.send({'type': 'quit_match'})
+            await b.wait(left, 'quit_match')
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            await a.close()
+            await b.close()
+
+    async def run(self):
+        scenario = self.scenario
+        duration = scenario.get('duration', 10)
+        ramp = scenario.get('ramp', 0)
+        self.deadline = time.perf_counter() + ramp + duration
+
+        tasks = []
+        starts = []
+        for index, group in enumerate(scenario['groups']):
+            behavior = group['behavior']
+            count = group['players']
+            if behavior == 'pvp':
+                count //= 2  # one task per pair
+            runner = getattr(self, f'behave_{"pvp_pair" if behavior == "pvp" else behavior}')
+            for i in range(count):
+                starts.append((runner, f'lg{self.run_id}g{index}p{i}', group))
+        random.shuffle(starts)
+
+        t0 = time.perf_counter()
+        for i, (runner, name, group) in enumerate(starts):
+            if ramp:
+                delay = t0 + ramp * i / len(starts) - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(runner(name, group)))
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.stats.report(time.perf_counter() - t0)
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def load_scenario(path, overrides=None, scale=1.0):
+    """Read a scenario file; scale multiplies every group's player count"""
+    with open(path) as f:
+        scenario = json.load(f)
+    scenario.update(overrides or {})
+    for group in scenario['groups']:
+        group['players'] = max(1, round(group['players'] * scale))
+    return scenario
+
+
+def run_scenario(scenario, host='127.0.0.1', port=5555):
+    raise_fd_limit()
+    return asyncio.run(Swarm(host, port, scenario).run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenario', help="scenario JSON file")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--duration', type=float, help="override the scenario's duration")
+    parser.add_argument('--protocol', choices=list(CODECS), help="override the scenario's protocol")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply every group's player count")
+    args = parser.parse_args()
+
+    overrides = {key: value for key, value in (('duration', args.duration), ('protocol', args.protocol))
+                 if value is not None}
+    scenario = load_scenario(args.scenario, overrides, args.scale)
+    print(json.dumps(run_scenario(scenario, args.host, args.port), indent=2))
+
+
+if __name__ == '__main__':
+    main()
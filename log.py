@@ -0,0 +1,174 @@
+"""Logging for the server, the cluster workers and the client.
+
+Built on the standard logging module, set up so a log call on the hot
+path costs next to nothing:
+
+- Messages use %-style arguments, so nothing is formatted unless the
+  record is actually emitted, and a disabled level is a single
+  isEnabledFor() check.
+- Records go onto a bounded queue and are formatted and written by a
+  background thread. A handler thread never waits for stdout; if the
+  writer falls behind, records are dropped and counted.
+- Debug messages can be sampled per message type, e.g. keep 1 in 100
+  'play' messages. The type is the msg_type argument of debug() or else
+  the logger's own name, so get_logger('play') logs under type 'play'.
+  Sampling happens before a LogRecord is built, so skipped messages cost
+  a dict lookup. Warnings and errors are never sampled out.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+QUEUE_SIZE = 10000
+
+# Each running process sets this up once
+_listener = None
+_handler = None
+_sampler = None
+
+
+class Sampler:
+    """Keep one in every round(1 / rate) messages per message type.
+
+    Counting instead of drawing random numbers keeps the check cheap and
+    the output evenly spaced.
+    """
+
+    def __init__(self, rates, default=1.0):
+        self.every = {}  # {msg_type: keep 1 in n, 0 for none}
+        for msg_type, rate in rates.items():
+            self.every[msg_type] = round(1 / rate) if rate > 0 else 0
+        self.default = round(1 / default) if default > 0 else 0
+        self.counts = {}
+
+    def keep(self, msg_type):
+        every = self.every.get(msg_type, self.default)
+        if every == 1:
+            return True
+        if every == 0:
+            return False
+        count = self.counts.get(msg_type, 0) + 1
+        self.counts[msg_type] = count
+        return count % every == 1
+
+
+class Logger:
+    """Thin wrapper around a standard logger that applies debug sampling"""
+
+    __slots__ = ('logger', 'msg_type')
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(f'rps.{name}')
+        self.msg_type = name
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, msg, *args, msg_type=None):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            if _sampler is None or _sampler.keep(msg_type or self.msg_type):
+                self.logger._log(logging.DEBUG, msg, args, stacklevel=2)
+
+    def info(self, msg, *args):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger._log(logging.INFO, msg, args, stacklevel=2)
+
+    def warning(self, msg, *args):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger._log(logging.WARNING, msg, args, stacklevel=2)
+
+    def error(self, msg, *args):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger._log(logging.ERROR, msg, args, stacklevel=2)
+
+
+def get_logger(name):
+    return Logger(name)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that neither formats nor blocks in the calling thread"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_sample(specs):
+    """['play=0.01', 'play_bot=0.1', '*=0.5'] -> ({type: rate}, default rate)"""
+    rates, default = {}, 1.0
+    for spec in specs or ():
+        msg_type, sep, rate = spec.partition('=')
+        if not sep:
+            raise ValueError(f"Bad sample spec (want type=rate): {spec}")
+        if msg_type == '*':
+            default = float(rate)
+        else:
+            rates[msg_type] = float(rate)
+    return rates, default
+
+
+def setup_logging(level='info', sample=None, stream=None, queue_size=QUEUE_SIZE):
+    """Route all 'rps.*' loggers through a queue to a background writer.
+
+    level is one of LEVELS (or 'off'); sample is a list of 'type=rate'
+    specs as accepted by parse_sample(). Calling it again replaces the
+    previous setup.
+    """
+    global _listener, _handler, _sampler
+    stop_logging()
+
+    root = logging.getLogger('rps')
+    root.propagate = False
+    if level == 'off':
+        root.setLevel(logging.CRITICAL + 1)
+        return None
+    root.setLevel(level.upper())
+
+    rates, default = parse_sample(sample)
+    _sampler = Sampler(rates, default) if rates or default < 1 else None
+
+    log_queue = queue.Queue(queue_size)
+    _handler = DroppingQueueHandler(log_queue)
+    root.addHandler(_handler)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter(FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    return _handler
+
+
+def stop_logging():
+    """Flush what is queued and detach the handler"""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger('rps').removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def add_arguments(parser):
+    parser.add_argument('--log-level', choices=LEVELS + ('off',), default='info')
+    parser.add_argument('--log-sample', nargs='+', metavar='TYPE=RATE', default=None,
+                        help="keep only this fraction of debug records per message type, "
+                             "e.g. play=0.01 play_bot=0.1 '*=0.5'")
+
+
+atexit.register(stop_logging)
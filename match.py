@@ -0,0 +1,68 @@
+import threading
+
+
+class Match:
+    """One PvP match: its two players, their pending choices and its own lock.
+
+    Everything that changes during play (the choices, the round clock,
+    whether the match is still on) lives here and is guarded by
+    match.lock, so rounds of unrelated matches never wait on each other.
+    The server's registry lock only covers roster changes. Lock order:
+    a match lock may be held while taking the registry lock, never the
+    other way round.
+    """
+
+    __slots__ = ('players', 'names', 'choices', 'lock', 'round', 'timer', 'active', 'wins', 'draws', 'audience',
+                 'chat', 'tournament', 'series')
+
+    def __init__(self, a, a_name, b, b_name):
+        self.players = (a, b)
+        self.names = {a: a_name, b: b_name}
+        self.choices = {a: None, b: None}
+        self.lock = threading.Lock()
+        self.round = 0  # bumped every round so a stale round timer can tell
+        self.timer = None
+        self.active = True
+        self.wins = {a: 0, b: 0}
+        self.draws = 0
+        self.audience = None  # spectators.Audience, once someone watches
+        self.chat = None  # chat.Channel of the players and spectators, once someone says something
+        self.tournament = None  # tournament.Tournament and its Series this match plays, if any
+        self.series = None
+
+    def other(self, sock):
+        a, b = self.players
+        return b if sock is a else a
+
+    def late(self):
+        """Players who have not chosen yet this round"""
+        return [sock for sock in self.players if self.choices[sock] is None]
+
+    def scored(self, winner):
+        """Count a round won by winner (None: a draw)"""
+        if winner is None:
+            self.draws += 1
+        else:
+            self.wins[winner] += 1
+
+    def summary(self):
+        """What a spectator needs to draw the match; call with lock held"""
+        a, b = self.players
+        return {'players': [self.names[a], self.names[b]], 'score': [self.wins[a], self.wins[b]],
+                'draws': self.draws, 'round': self.round,
+                'chosen': [self.names[sock] for sock in self.players if self.choices[sock] is not None]}
+
+    def next_round(self):
+        for sock in self.players:
+            self.choices[sock] = None
+        self.round += 1
+
+    def close(self):
+        """End the match; False if it had already ended. Call with lock held."""
+        if not self.active:
+            return False
+        self.active = False
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return True
@@ -0,0 +1,180 @@
+"""Skill-based matchmaking: Elo ratings and a rating-bucketed queue.
+
+Every PvP round moves both players' ratings by the Elo rule: the winner
+takes K_FACTOR * (1 - expected score) from the loser, so beating a
+stronger player gains more than beating a weaker one.
+
+Players who send join_queue wait in buckets of BUCKET_WIDTH rating
+points; the numbers of the buckets holding anyone are kept sorted. Two
+players can be paired when their ratings differ by at most the wider of
+their search windows, which start at WINDOW points and grow by WIDEN
+points per second of waiting, up to MAX_WINDOW. A joining player is
+paired at once if possible: one bisect finds their bucket, then the
+oldest ticket of each non-empty bucket is tried outward, nearest bucket
+first, until the gap is wider than any window in the queue. That is
+O(log B) plus at most 2 * MAX_WINDOW / BUCKET_WIDTH buckets, however
+long the queue. The oldest ticket in a bucket has the widest window
+there, so it is the only one worth trying; and as WINDOW is at least
+BUCKET_WIDTH, two players in one bucket never wait side by side anyway.
+sweep(), run every SWEEP_INTERVAL while anyone is queued, retries
+everyone with their widened window.
+"""
+import time
+from bisect import bisect_left, insort
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32
+BUCKET_WIDTH = 25
+WINDOW = 50
+WIDEN = 10  # window points per second waited
+MAX_WINDOW = 400
+SWEEP_INTERVAL = 1.0
+# Score of a result for the player it belongs to (protocol.RESULTS names)
+SCORES = {'win': 1.0, 'lose': 0.0, 'draw': 0.5}
+
+
+class Ratings:
+    """Elo rating per player name; callers serialize access (history.py holds its lock)"""
+
+    def __init__(self, initial=INITIAL_RATING, k=K_FACTOR):
+        self.ratings = {}
+        self.initial = initial
+        self.k = k
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def get(self, name):
+        return self.ratings.get(name, self.initial)
+
+    def set(self, name, rating):
+        self.ratings[name] = rating
+
+    def update(self, name, opponent, result):
+        """Apply one round between name and opponent; result is name's 'win', 'lose' or 'draw'"""
+        mine, theirs = self.get(name), self.get(opponent)
+        expected = 1 / (1 + 10 ** ((theirs - mine) / 400))
+        delta = self.k * (SCORES[result] - expected)
+        self.ratings[name] = mine + delta
+        self.ratings[opponent] = theirs - delta
+
+
+class Ticket:
+    """One queued player"""
+
+    __slots__ = ('sock', 'name', 'rating', 'bucket', 'joined')
+
+    def __init__(self, sock, name, rating, bucket, joined):
+        self.sock = sock
+        self.name = name
+        self.rating = rating
+        self.bucket = bucket
+        self.joined = joined
+
+
+class Matchmaker:
+    """The matchmaking queue. Not thread-safe: the server calls it with its registry lock held."""
+
+    def __init__(self, window=WINDOW, widen=WIDEN, max_window=MAX_WINDOW, bucket_width=BUCKET_WIDTH):
+        if window < bucket_width:
+            raise ValueError("the initial window must cover a whole bucket")
+        self.window = window
+        self.widen = widen
+        self.max_window = max_window
+        self.bucket_width = bucket_width
+        self.buckets = {}  # {bucket number: {sock: Ticket} in join order}
+        self.keys = []  # sorted numbers of the non-empty buckets
+        self.tickets = {}  # {sock: Ticket} in join order
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, sock):
+        return sock in self.tickets
+
+    def window_of(self, ticket, now):
+        return min(self.max_window, self.window + self.widen * (now - ticket.joined))
+
+    def join(self, sock, name, rating, now=None):
+        """Queue a player; returns (ticket, opponent's ticket) if paired at once (neither stays
+        queued), else (ticket, None)"""
+        if now is None:
+            now = time.monotonic()
+        self.leave(sock)
+        ticket = Ticket(sock, name, rating, int(rating // self.bucket_width), now)
+        opponent = self.find(ticket, now)
+        if opponent is not None:
+            self.remove(opponent)
+        else:
+            self.add(ticket)
+        return ticket, opponent
+
+    def leave(self, sock):
+        """Take a player out of the queue; returns its ticket, None if it was not queued"""
+        ticket = self.tickets.get(sock)
+        if ticket is not None:
+            self.remove(ticket)
+        return ticket
+
+    def sweep(self, now=None):
+        """Pair whoever can be paired with the windows grown since they joined, oldest first.
+
+        Returns [(ticket, opponent's ticket)]; paired players are no longer queued.
+        """
+        if now is None:
+            now = time.monotonic()
+        pairs = []
+        for ticket in list(self.tickets.values()):
+            if ticket.sock not in self.tickets:
+                continue  # Paired earlier in this sweep
+            opponent = self.find(ticket, now, exclude=ticket)
+            if opponent is not None:
+                self.remove(ticket)
+                self.remove(opponent)
+                pairs.append((ticket, opponent))
+        return pairs
+
+    def find(self, ticket, now, exclude=None):
+        """Oldest queued ticket of the nearest bucket that ticket can be paired with"""
+        if not self.tickets:
+            return None
+        window = self.window_of(ticket, now)
+        # Nobody's window is wider than the longest waiter's
+        reach = max(window, self.window_of(next(iter(self.tickets.values())), now))
+        keys, width = self.keys, self.bucket_width
+        above = bisect_left(keys, ticket.bucket)
+        below = above - 1
+        while below >= 0 or above < len(keys):
+            # Whichever side's next bucket is nearer
+            if above < len(keys) and (below < 0 or keys[above] - ticket.bucket <= ticket.bucket - keys[below]):
+                key = keys[above]
+                above += 1
+            else:
+                key = keys[below]
+                below -= 1
+            if (abs(key - ticket.bucket) - 1) * width > reach:
+                break  # Every rating in this bucket, and in any bucket further out, is too far
+            for candidate in self.buckets[key].values():
+                if candidate is exclude:
+                    continue
+                gap = abs(candidate.rating - ticket.rating)
+                if gap <= window or gap <= self.window_of(candidate, now):
+                    return candidate
+                break  # Later tickets in the bucket joined later: narrower windows
+        return None
+
+    def add(self, ticket):
+        bucket = self.buckets.get(ticket.bucket)
+        if bucket is None:
+            bucket = self.buckets[ticket.bucket] = {}
+            insort(self.keys, ticket.bucket)
+        bucket[ticket.sock] = ticket
+        self.tickets[ticket.sock] = ticket
+
+    def remove(self, ticket):
+        del self.tickets[ticket.sock]
+        bucket = self.buckets[ticket.bucket]
+        del bucket[ticket.sock]
+        if not bucket:
+            del self.buckets[ticket.bucket]
+            del self.keys[bisect_left(self.keys, ticket.bucket)]
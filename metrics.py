@@ -0,0 +1,168 @@
+"""Server metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain Python objects updated from the
+handlers; gauges are callbacks read at scrape time, so values the server
+already tracks (registry counts, outbound stats) cost nothing between
+scrapes. render() produces the text served on the admin port's
+/metrics (see admin.py).
+
+Everything here is only created when the server runs with an admin
+port; without one the hot path skips instrumentation entirely.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+# Request latencies, lock waits and broadcasts all fit this range
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            yield f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}'
+        yield f'{name}_sum{format_labels(labels)} {total}'
+        yield f'{name}_count{format_labels(labels)} {cumulative}'
+
+
+class Family:
+    """One metric name with a child per label value, e.g. requests by type"""
+
+    def __init__(self, kind, name, help_text, label=None, factory=None):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, value=None):
+        child = self.children.get(value)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(value, self.factory())
+        return child
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for value, child in sorted(self.children.items(), key=lambda item: str(item[0])):
+            labels = ((self.label, value),) if self.label else ()
+            if self.kind == 'histogram':
+                yield from child.samples(self.name, labels)
+            else:
+                yield f'{self.name}{format_labels(labels)} {child.value}'
+
+
+class Gauge:
+    """Read at scrape time: callback() returns a number or {label value: number}"""
+
+    def __init__(self, name, help_text, callback, label=None, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.label = label
+        self.kind = kind
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        value = self.callback()
+        if isinstance(value, dict):
+            for key, number in sorted(value.items()):
+                yield f'{self.name}{format_labels(((self.label, key),))} {number}'
+        else:
+            yield f'{self.name} {value}'
+
+
+class Metrics:
+    def __init__(self):
+        self.families = []
+
+    def counter(self, name, help_text, label=None):
+        return self.add(Family('counter', name, help_text, label, Counter))
+
+    def histogram(self, name, help_text, label=None, buckets=BUCKETS):
+        return self.add(Family('histogram', name, help_text, label, lambda: Histogram(buckets)))
+
+    def gauge(self, name, help_text, callback, label=None, kind='gauge'):
+        return self.add(Gauge(name, help_text, callback, label, kind))
+
+    def add(self, family):
+        self.families.append(family)
+        return family
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+class TimedLock:
+    """Drop-in for the server's registry RLock that records wait and hold times.
+
+    Only the outermost acquisition by a thread is timed; roster helpers
+    take the lock re-entrantly (start_match -> set_player_state). Rounds
+    are played under their match's own lock, which may be held while
+    taking this one, never the other way round, so the hold times are
+    roster changes, not play. depth and acquired_at are only touched
+    while holding the lock.
+    """
+
+    def __init__(self, wait, hold):
+        self.lock = threading.RLock()
+        self.wait = wait
+        self.hold = hold
+        self.depth = 0
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        if self.depth == 0:
+            self.acquired_at = time.perf_counter()
+            self.wait.observe(self.acquired_at - started)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            self.hold.observe(time.perf_counter() - self.acquired_at)
+        self.lock.release()
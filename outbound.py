@@ -0,0 +1,169 @@
+import socket
+import threading
+from collections import deque
+
+import log
+from protocol import NDJSON, MAX_FRAME
+
+logger = log.get_logger('outbound')
+
+# Above this many queued bytes, droppable messages (roster updates, ...) are skipped
+HIGH_WATER = 256 * 1024
+# Above this the client is considered stalled and gets disconnected
+HARD_LIMIT = 1024 * 1024
+# Seconds a closing connection gets to flush what is still queued
+CLOSE_TIMEOUT = 5.0
+# Kernel send buffer per client. Without a cap Linux autotunes it up to
+# several MB, which would hide a stalled client from the queue accounting.
+SEND_BUFFER = 64 * 1024
+
+
+class OutboundStats:
+    """Server-wide counters shared by every connection's outbound queue"""
+
+    def __init__(self):
+        self.dropped_messages = 0
+        self.slow_disconnects = 0
+        self.max_queue_depth = 0
+        self.bytes_queued = 0
+
+
+class Connection:
+    """Outbound side of one client connection.
+
+    send() never blocks: messages are queued and written by the I/O layer
+    (a writer thread in threaded mode, the event loop transport in asyncio
+    mode). When a client stops reading, droppable messages are skipped once
+    its queue passes high_water, and past hard_limit it is cut off so it
+    cannot hold up anyone else.
+    """
+
+    def __init__(self, stats=None, high_water=HIGH_WATER, hard_limit=HARD_LIMIT, max_frame=MAX_FRAME, limiter=None):
+        self.stats = stats if stats is not None else OutboundStats()
+        self.high_water = high_water
+        self.hard_limit = hard_limit
+        self.dropped = 0
+        self.codec = NDJSON
+        self.max_frame = max_frame  # Longest request accepted from the client
+        self.decoder = NDJSON.decoder(max_frame=max_frame)
+        self.limiter = limiter  # ratelimit.Limiter for the client's requests, if any
+        self.session = None  # sessions.Session of the player on this connection, once connected
+        self.trace_id = None  # Connection number in the server's capture, while capturing
+
+    def set_protocol(self, codec):
+        """Switch wire format; bytes already received but not parsed carry over"""
+        self.codec = codec
+        self.decoder = codec.decoder(self.decoder.remaining(), self.max_frame)
+
+    def send_message(self, msg, droppable=False):
+        return self.send(self.codec.encode(msg), droppable)
+
+    @property
+    def queue_depth(self):
+        raise NotImplementedError
+
+    def admit(self, size, droppable):
+        """Apply the slow-consumer policy; True if the message may be queued"""
+        depth = self.queue_depth + size
+        if depth > self.stats.max_queue_depth:
+            self.stats.max_queue_depth = depth
+        if depth > self.hard_limit:
+            logger.warning("Disconnecting slow client (%d bytes queued)", self.queue_depth)
+            self.stats.slow_disconnects += 1
+            self.abort()
+            return False
+        if droppable and depth > self.high_water:
+            self.dropped += 1
+            self.stats.dropped_messages += 1
+            return False
+        self.stats.bytes_queued += size
+        return True
+
+    def abort(self):
+        """Drop the connection without flushing; the reader side cleans up"""
+        raise NotImplementedError
+
+
+class ThreadedConnection(Connection):
+    """Blocking socket with a bounded queue drained by its own writer thread"""
+
+    def __init__(self, sock, stats=None, high_water=HIGH_WATER, hard_limit=HARD_LIMIT, max_frame=MAX_FRAME,
+                 limiter=None):
+        super().__init__(stats, high_water, hard_limit, max_frame, limiter)
+        self.sock = sock
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self.drain, daemon=True).start()
+
+    @property
+    def queue_depth(self):
+        return self.queued_bytes
+
+    def recv(self, bufsize):
+        return self.sock.recv(bufsize)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def getpeername(self):
+        return self.sock.getpeername()
+
+    def send(self, data, droppable=False):
+        with self.cond:
+            if self.closed:
+                raise ConnectionError("connection closed")
+            if not self.admit(len(data), droppable):
+                return 0
+            self.queue.append(data)
+            self.queued_bytes += len(data)
+            self.cond.notify()
+        return len(data)
+
+    def drain(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if not self.queue:
+                    break
+                # Everything queued so far goes out in one sendall()
+                data = b''.join(self.queue)
+                self.queue.clear()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.abort()
+                break
+            finally:
+                with self.cond:
+                    self.queued_bytes -= len(data)
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def close(self):
+        """Flush what is queued, then close"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+            pending = self.queued_bytes
+        if pending:
+            # Do not let a client that stopped reading keep the writer alive forever
+            timer = threading.Timer(CLOSE_TIMEOUT, self.abort)
+            timer.daemon = True
+            timer.start()
+
+    def abort(self):
+        try:
+            # Wakes the blocked reader and writer threads. Before waking the
+            # writer: if it closed the socket first, a reader still blocked
+            # in recv() would keep it open and the peer would never see a FIN.
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
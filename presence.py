@@ -0,0 +1,83 @@
+import threading
+
+
+class Presence:
+    """Lobby roster feed that coalesces changes and sends versioned deltas.
+
+    Roster changes are collected for `window` seconds, collapsed per player
+    (a join followed by a leave inside one window sends nothing) and then
+    broadcast once as
+
+        {'type': 'roster_update', 'base': v - 1, 'version': v,
+         'events': [['player_joined', name, status],
+                    ['player_left', name],
+                    ['status_changed', name, status], ...]}
+
+    A client applies an update only if `base` matches its own version and
+    otherwise asks for a fresh snapshot with get_players. Clients that did
+    not announce 'roster_deltas' in their connect request get the full
+    player_list instead, still at most once per window.
+    """
+
+    def __init__(self, server, window=0.1):
+        self.server = server
+        self.window = window
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # keeps flushes in version order
+        self.version = 0
+        self.published = {}  # {name: status} as of self.version
+        self.pending = {}  # {name: status, or None if gone} since the last flush
+        self.flush_scheduled = False
+
+    def update(self, name, status):
+        """Record that name joined/changed status (status=None: left)"""
+        with self.lock:
+            self.pending[name] = status
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        if self.window > 0:
+            self.server.call_later(self.window, self.flush)
+        else:
+            # No coalescing: every change goes out immediately
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return self.snapshot_locked()
+
+    def snapshot_locked(self):
+        players = [{'name': name, 'status': status} for name, status in self.published.items()]
+        return {'type': 'player_list', 'version': self.version, 'players': players}
+
+    def flush(self):
+        delta_socks, legacy_socks = self.server.lobby_clients()
+        with self.send_lock:
+            with self.lock:
+                self.flush_scheduled = False
+                events = []
+                for name, status in self.pending.items():
+                    before = self.published.get(name)
+                    if status == before:
+                        continue
+                    if status is None:
+                        events.append(['player_left', name])
+                        del self.published[name]
+                    elif before is None:
+                        events.append(['player_joined', name, status])
+                        self.published[name] = status
+                    else:
+                        events.append(['status_changed', name, status])
+                        self.published[name] = status
+                self.pending.clear()
+                if not events:
+                    return
+                self.version += 1
+                delta = {'type': 'roster_update', 'base': self.version - 1, 'version': self.version, 'events': events}
+                snapshot = self.snapshot_locked() if legacy_socks else None
+
+            # Roster traffic is the first thing to go for a slow client; a
+            # skipped delta shows up as a version gap and it resyncs later
+            self.server.broadcast(delta, delta_socks, droppable=True)
+            if legacy_socks:
+                self.server.broadcast(snapshot, legacy_socks, droppable=True)
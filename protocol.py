@@ -0,0 +1,307 @@
+"""Wire formats shared by the server, the Tk client and the tools.
+
+Two formats are supported:
+
+ndjson  One JSON object per line. What every client speaks at first.
+rpsb1   Length-prefixed binary frames: a 4-byte big-endian payload length,
+        a 1-byte message type and the payload. The small fixed-shape
+        messages (play, play_bot, game_result, ...) pack their choices and
+        results as one-byte enums; anything else is carried as a JSON
+        payload in a MSG_JSON frame.
+
+Batches of moves (play_bot_batch, bot_batch_result) are strings with one
+letter per round, 'r'/'p'/'s' and 'w'/'l'/'d', in both formats; rpsb1
+sends them as one code byte per round.
+
+A client opts in by listing 'rpsb1' in the 'protocols' field of its
+(ndjson) connect request. If the server agrees, connect_ack carries
+'protocol': 'rpsb1' and both sides switch to binary frames right after it.
+
+connect_ack also carries a session token. Every message the server
+sends on a session after that is numbered 1, 2, 3, ... except the
+UNSEQUENCED types, and both sides count them the same way, so a client
+that reconnects can say which was the last one it got (see sessions.py).
+
+Decoders hand out raw frames (next_frame) before parsing them (parse),
+so a receiver can look at a frame's type (frame_type) and drop it
+without decoding any JSON. A frame, or a partial line, longer than the
+decoder's max_frame is a ProtocolError.
+"""
+import json
+import re
+import struct
+
+import log
+
+logger = log.get_logger('protocol')
+
+HEADER = struct.Struct('>IB')
+MAX_FRAME = 16 * 1024 * 1024
+# The "type" field of a JSON frame, found without parsing it
+TYPE_FIELD = re.compile(rb'"type"\s*:\s*"([A-Za-z_]{1,40})"')
+
+CHOICES = ('rock', 'paper', 'scissors')
+RESULTS = ('win', 'lose', 'draw')
+CHOICE_CODES = {choice: code for code, choice in enumerate(CHOICES)}
+RESULT_CODES = {result: code for code, result in enumerate(RESULTS)}
+CHOICE_LETTERS = ''.join(choice[0] for choice in CHOICES)  # 'rps'
+RESULT_LETTERS = ''.join(result[0] for result in RESULTS)  # 'wld'
+
+# Not numbered for session replay: roster, spectator and chat traffic (a resumed
+# client gets fresh snapshots and chat history instead) and the acks that start or resume a session
+UNSEQUENCED = frozenset(('player_list', 'roster_update', 'spectate_state', 'spectate_update', 'chat',
+                         'chat_history', 'connect_ack', 'resume_ack'))
+
+MSG_JSON = 0x01
+MSG_PLAY = 0x10
+MSG_PLAY_BOT = 0x11
+MSG_PLAY_BOT_BATCH = 0x12
+MSG_GAME_RESULT = 0x20
+MSG_GAME_RESULT_BOT = 0x21
+MSG_OPPONENT_CHOOSED = 0x22
+MSG_OPPONENT_LEFT = 0x23
+MSG_BOT_BATCH_RESULT = 0x24
+# Request type of each fixed-shape frame
+FRAME_TYPES = {MSG_PLAY: 'play', MSG_PLAY_BOT: 'play_bot', MSG_PLAY_BOT_BATCH: 'play_bot_batch',
+               MSG_GAME_RESULT: 'game_result', MSG_GAME_RESULT_BOT: 'game_result',
+               MSG_OPPONENT_CHOOSED: 'opponent_choosed', MSG_OPPONENT_LEFT: 'opponent_left',
+               MSG_BOT_BATCH_RESULT: 'bot_batch_result'}
+
+
+def byte_table(mapping):
+    """256-byte bytes.translate() table; bytes not in mapping become 0xff"""
+    table = bytearray(b'\xff' * 256)
+    for src, dst in mapping.items():
+        table[src] = dst
+    return bytes(table)
+
+
+LETTER_TO_CODE = byte_table({ord(letter): code for code, letter in enumerate(CHOICE_LETTERS)})
+CODE_TO_LETTER = byte_table({code: ord(letter) for code, letter in enumerate(CHOICE_LETTERS)})
+RESULT_TO_LETTER = byte_table({code: ord(letter) for code, letter in enumerate(RESULT_LETTERS)})
+LETTER_TO_RESULT = byte_table({ord(letter): code for code, letter in enumerate(RESULT_LETTERS)})
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def frame_type(frame):
+    """The message type of a (frame type, payload) frame, sniffed from the raw bytes; None if not found.
+
+    Only a hint: a JSON payload may contain another "type" before its own,
+    so whatever parse() returns is what counts.
+    """
+    msg_type, payload = frame
+    if msg_type != MSG_JSON:
+        return FRAME_TYPES.get(msg_type)
+    match = TYPE_FIELD.search(payload)
+    return match.group(1).decode('ascii') if match else None
+
+
+class LineDecoder:
+    """Incremental ndjson decoder.
+
+    Bytes are appended to one bytearray and lines are found with find()
+    from a moving offset; consumed bytes are cut off once per feed() rather
+    than re-slicing the rest of the buffer for every message. A partial
+    line is not searched again from its start on every feed().
+    """
+
+    def __init__(self, data=b'', max_frame=MAX_FRAME):
+        self.buffer = bytearray(data)
+        self.pos = 0
+        self.scanned = 0  # No newline in buffer[pos:scanned]
+        self.max_frame = max_frame
+
+    def feed(self, data):
+        if self.pos:
+            del self.buffer[:self.pos]
+            self.scanned -= self.pos
+            self.pos = 0
+        self.buffer += data
+
+    def next_frame(self):
+        """Return the next non-empty line as (MSG_JSON, bytes), or None if more bytes are needed"""
+        while True:
+            end = self.buffer.find(b'\n', max(self.pos, self.scanned))
+            if end < 0:
+                self.scanned = len(self.buffer)
+                if self.scanned - self.pos > self.max_frame:
+                    raise ProtocolError(f"line longer than {self.max_frame} bytes")
+                return None
+            start = self.pos
+            self.pos = end + 1
+            if end - start > self.max_frame:
+                raise ProtocolError(f"line of {end - start} bytes")
+            if end > start:
+                return MSG_JSON, bytes(self.buffer[start:end])
+
+    def wire(self, frame):
+        """A frame's bytes as they were received"""
+        return frame[1] + b'\n'
+
+    def parse(self, frame):
+        """The message in a frame, or None if it is not a JSON object"""
+        line = frame[1].decode('utf-8', 'replace')
+        try:
+            msg = json.loads(line)
+        except ValueError as e:
+            if line.strip():
+                logger.warning("JSON error: %s for line: %.100s", e, line)
+            return None
+        return msg if isinstance(msg, dict) else None
+
+    def next_message(self):
+        """Return the next complete message, or None if more bytes are needed"""
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return None
+            msg = self.parse(frame)
+            if msg is not None:
+                return msg
+
+    def remaining(self):
+        """Unconsumed bytes, handed over when the connection switches format"""
+        return bytes(self.buffer[self.pos:])
+
+
+class BinaryDecoder:
+    """Incremental rpsb1 decoder working on a reusable bytearray"""
+
+    def __init__(self, data=b'', max_frame=MAX_FRAME):
+        self.buffer = bytearray(data)
+        self.pos = 0
+        self.max_frame = max_frame
+
+    def feed(self, data):
+        if self.pos:
+            del self.buffer[:self.pos]
+            self.pos = 0
+        self.buffer += data
+
+    def next_frame(self):
+        """Return the next frame as (frame type, payload bytes), or None if more bytes are needed"""
+        buf = self.buffer
+        if len(buf) - self.pos < HEADER.size:
+            return None
+        length, msg_type = HEADER.unpack_from(buf, self.pos)
+        if length > self.max_frame:
+            raise ProtocolError(f"frame of {length} bytes")
+        start = self.pos + HEADER.size
+        end = start + length
+        if len(buf) < end:
+            return None
+        self.pos = end
+        return msg_type, bytes(buf[start:end])
+
+    def wire(self, frame):
+        """A frame's bytes as they were received"""
+        return HEADER.pack(len(frame[1]), frame[0]) + frame[1]
+
+    def next_message(self):
+        frame = self.next_frame()
+        return self.parse(frame) if frame is not None else None
+
+    def parse(self, frame):
+        msg_type, payload = frame
+        try:
+            if msg_type == MSG_PLAY:
+                return {'type': 'play', 'choice': CHOICES[payload[0]]}
+            if msg_type == MSG_PLAY_BOT:
+                return {'type': 'play_bot', 'choice': CHOICES[payload[0]]}
+            if msg_type == MSG_GAME_RESULT or msg_type == MSG_GAME_RESULT_BOT:
+                msg = {'type': 'game_result', 'my_choice': CHOICES[payload[0]],
+                       'opponent_choice': CHOICES[payload[1]], 'result': RESULTS[payload[2]]}
+                if msg_type == MSG_GAME_RESULT_BOT:
+                    msg['mode'] = 'bot'
+                return msg
+            if msg_type == MSG_OPPONENT_CHOOSED:
+                return {'type': 'opponent_choosed'}
+            if msg_type == MSG_OPPONENT_LEFT:
+                return {'type': 'opponent_left'}
+            if msg_type == MSG_PLAY_BOT_BATCH:
+                return {'type': 'play_bot_batch', 'choices': payload.translate(CODE_TO_LETTER).decode('ascii')}
+            if msg_type == MSG_BOT_BATCH_RESULT:
+                half = len(payload) // 2
+                results = payload[half:]
+                return {'type': 'bot_batch_result',
+                        'bot_choices': payload[:half].translate(CODE_TO_LETTER).decode('ascii'),
+                        'results': results.translate(RESULT_TO_LETTER).decode('ascii'),
+                        'wins': results.count(RESULT_CODES['win']), 'losses': results.count(RESULT_CODES['lose']),
+                        'draws': results.count(RESULT_CODES['draw'])}
+            if msg_type == MSG_JSON:
+                msg = json.loads(payload.decode('utf-8'))
+                if not isinstance(msg, dict):
+                    raise ValueError("not an object")
+                return msg
+        except (IndexError, ValueError) as e:
+            raise ProtocolError(f"bad frame type {msg_type:#x}: {e}")
+        raise ProtocolError(f"unknown frame type {msg_type:#x}")
+
+    def remaining(self):
+        return bytes(self.buffer[self.pos:])
+
+
+class JsonCodec:
+    name = 'ndjson'
+
+    def encode(self, msg):
+        return (json.dumps(msg) + '\n').encode('utf-8')
+
+    def decoder(self, data=b'', max_frame=MAX_FRAME):
+        return LineDecoder(data, max_frame)
+
+
+class BinaryCodec:
+    name = 'rpsb1'
+
+    def __init__(self):
+        self.play = {choice: HEADER.pack(1, MSG_PLAY) + bytes([code]) for choice, code in CHOICE_CODES.items()}
+        self.play_bot = {choice: HEADER.pack(1, MSG_PLAY_BOT) + bytes([code]) for choice, code in CHOICE_CODES.items()}
+        self.result_headers = {None: HEADER.pack(3, MSG_GAME_RESULT), 'bot': HEADER.pack(3, MSG_GAME_RESULT_BOT)}
+        self.fixed = {'opponent_choosed': HEADER.pack(0, MSG_OPPONENT_CHOOSED),
+                      'opponent_left': HEADER.pack(0, MSG_OPPONENT_LEFT)}
+
+    def encode(self, msg):
+        msg_type = msg.get('type')
+        try:
+            if msg_type == 'play' and len(msg) == 2:
+                return self.play[msg['choice']]
+            if msg_type == 'play_bot' and len(msg) == 2:
+                return self.play_bot[msg['choice']]
+            if msg_type == 'game_result' and len(msg) == 4 + ('mode' in msg):
+                return self.result_headers[msg.get('mode')] + bytes((
+                    CHOICE_CODES[msg['my_choice']], CHOICE_CODES[msg['opponent_choice']], RESULT_CODES[msg['result']]))
+            if msg_type in self.fixed and len(msg) == 1:
+                return self.fixed[msg_type]
+            if msg_type == 'play_bot_batch' and len(msg) == 2 and isinstance(msg['choices'], str):
+                payload = msg['choices'].encode('ascii', 'replace').translate(LETTER_TO_CODE)
+                if 0xff not in payload:
+                    return HEADER.pack(len(payload), MSG_PLAY_BOT_BATCH) + payload
+            if msg_type == 'bot_batch_result' and len(msg) == 6:
+                # The win/loss/draw counts are recomputed by the decoder
+                payload = (msg['bot_choices'].encode('ascii', 'replace').translate(LETTER_TO_CODE) +
+                           msg['results'].encode('ascii', 'replace').translate(LETTER_TO_RESULT))
+                if len(msg['bot_choices']) == len(msg['results']) and 0xff not in payload:
+                    return HEADER.pack(len(payload), MSG_BOT_BATCH_RESULT) + payload
+        except KeyError:
+            pass  # Unusual values (e.g. an invalid choice) go out as JSON
+        payload = json.dumps(msg).encode('utf-8')
+        return HEADER.pack(len(payload), MSG_JSON) + payload
+
+    def decoder(self, data=b'', max_frame=MAX_FRAME):
+        return BinaryDecoder(data, max_frame)
+
+
+NDJSON = JsonCodec()
+BINARY = BinaryCodec()
+CODECS = {codec.name: codec for codec in (NDJSON, BINARY)}
+
+
+def negotiate(offered):
+    """Pick the best protocol both sides speak from a client's 'protocols' list"""
+    if offered and BINARY.name in offered:
+        return BINARY
+    return NDJSON
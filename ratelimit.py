@@ -0,0 +1,125 @@
+"""Abuse protection at the connection layer: token buckets per request type and per peer address.
+
+Every connection gets a Limiter: one token bucket per request class of
+MESSAGE_LIMITS (a fixed-size list, whatever the client sends) plus a
+bucket of strikes. A request is charged before its JSON is parsed, by
+the type sniffed from the raw frame (protocol.frame_type); one whose
+parsed type turns out to be in another class is charged to that class
+too, so a crafted frame cannot pick a cheaper bucket. A request over
+its limit is dropped and costs a strike; a connection out of strikes
+is cut off.
+
+AcceptLimiter caps the rate of new connections from one IP address,
+tracking at most MAX_TRACKED_PEERS addresses (the longest unseen ones
+are forgotten first). In cluster mode every worker keeps its own.
+
+Not thread-safe: a Limiter is only used by its connection's reader,
+and the AcceptLimiter by the accepting thread or the event loop.
+"""
+import time
+from collections import OrderedDict
+
+# (class, request types, tokens per second, burst); unknown types fall in the last class
+MESSAGE_LIMITS = (
+    ('play', ('play', 'play_bot'), 10.0, 20),
+    ('play_bot_batch', ('play_bot_batch',), 1.0, 3),
+    ('challenge', ('challenge', 'accept_challenge'), 2.0, 5),
+    ('chat', ('chat',), 2.0, 5),
+    ('lookup', ('get_players', 'get_leaderboard', 'get_history', 'get_stats', 'get_tournament',
+                'spectate', 'unspectate', 'chat_history'), 5.0, 10),
+    ('session', ('connect', 'resume', 'logout'), 1.0, 3),
+    ('other', (), 5.0, 20),
+)
+# Dropped requests a connection may pile up (per second, burst) before it is disconnected
+STRIKES = (10.0, 50)
+# New connections per second from one IP address, and the burst allowed
+ACCEPT_RATE = 20.0
+ACCEPT_BURST = 100
+MAX_TRACKED_PEERS = 65536
+
+
+class RateLimits:
+    """The bucket settings shared by every connection's Limiter"""
+
+    def __init__(self, limits=MESSAGE_LIMITS, strikes=STRIKES):
+        self.names = [name for name, _, _, _ in limits]
+        self.rates = [rate for _, _, rate, _ in limits]
+        self.bursts = [burst for _, _, _, burst in limits]
+        self.classes = {req_type: index for index, (_, types, _, _) in enumerate(limits) for req_type in types}
+        self.other = len(limits) - 1
+        self.strike_rate, self.strike_burst = strikes
+
+    def classify(self, req_type):
+        """Index of the bucket a request type is charged to"""
+        return self.classes.get(req_type, self.other)
+
+    def limiter(self):
+        return Limiter(self)
+
+
+class Limiter:
+    """One connection's buckets: a token count and a refill time per request class"""
+
+    __slots__ = ('limits', 'tokens', 'stamps', 'strikes', 'strike_stamp')
+
+    def __init__(self, limits):
+        now = time.monotonic()
+        self.limits = limits
+        self.tokens = [float(burst) for burst in limits.bursts]
+        self.stamps = [now] * len(limits.bursts)
+        self.strikes = float(limits.strike_burst)
+        self.strike_stamp = now
+
+    def take(self, index, now=None):
+        """Charge one request to bucket index; False if it is empty"""
+        if now is None:
+            now = time.monotonic()
+        limits = self.limits
+        tokens = min(limits.bursts[index], self.tokens[index] + (now - self.stamps[index]) * limits.rates[index])
+        self.stamps[index] = now
+        if tokens < 1:
+            self.tokens[index] = tokens
+            return False
+        self.tokens[index] = tokens - 1
+        return True
+
+    def strike(self, now=None):
+        """Count a dropped request; False once the connection has run out of strikes"""
+        if now is None:
+            now = time.monotonic()
+        limits = self.limits
+        self.strikes = min(limits.strike_burst, self.strikes + (now - self.strike_stamp) * limits.strike_rate) - 1
+        self.strike_stamp = now
+        return self.strikes >= 0
+
+
+class AcceptLimiter:
+    """Token bucket per peer address for accepting connections"""
+
+    def __init__(self, rate=ACCEPT_RATE, burst=ACCEPT_BURST, max_peers=MAX_TRACKED_PEERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_peers = max_peers
+        self.peers = OrderedDict()  # {address: [tokens, stamp]}, least recently seen first
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.peers)
+
+    def admit(self, address, now=None):
+        if now is None:
+            now = time.monotonic()
+        bucket = self.peers.get(address)
+        if bucket is None:
+            bucket = self.peers[address] = [float(self.burst), now]
+            if len(self.peers) > self.max_peers:
+                self.peers.popitem(last=False)
+        else:
+            self.peers.move_to_end(address)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            self.rejected += 1
+            return False
+        bucket[0] -= 1
+        return True
@@ -0,0 +1,118 @@
+STATUSES = ('idle', 'playing', 'waiting')
+
+
+class PlayerRegistry:
+    """Connected players indexed by socket, by name and by status.
+
+    Behaves like the old {socket: info} dict for reads (`sock in reg`,
+    `reg[sock]`, `reg.items()`), but players must be added and removed
+    through add()/remove() and moved with set_status() so the name and
+    status indexes stay in sync. Every operation is O(1).
+
+    on_change(sock, name, status) is called for every roster change, with
+    status=None when the player leaves.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.players = {}  # {socket: {'name': str, 'status': str, 'match': Match}}
+        self.by_name = {}  # {name: socket}
+        self.by_status = {status: set() for status in STATUSES}
+        self.name_suffix = {}  # {requested name: last suffix handed out}
+
+    def __contains__(self, sock):
+        return sock in self.players
+
+    def __getitem__(self, sock):
+        return self.players[sock]
+
+    def __iter__(self):
+        return iter(self.players)
+
+    def __len__(self):
+        return len(self.players)
+
+    def get(self, sock, default=None):
+        return self.players.get(sock, default)
+
+    def items(self):
+        return self.players.items()
+
+    def values(self):
+        return self.players.values()
+
+    def allocate_name(self, name, is_taken=None):
+        """Return name, or name_2, name_3, ... if it is already in use.
+
+        The last suffix handed out per name is remembered so a burst of
+        logins with the same name does not rescan the suffixes each time.
+        is_taken lets callers reserve names held elsewhere (other shards).
+        """
+        def taken(candidate):
+            return candidate in self.by_name or (is_taken is not None and is_taken(candidate))
+
+        if not taken(name):
+            return name
+        suffix = self.name_suffix.get(name, 1)
+        while True:
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+            if not taken(candidate):
+                self.name_suffix[name] = suffix
+                return candidate
+
+    def add(self, sock, name, status='idle'):
+        if name in self.by_name:
+            raise ValueError(f"Name already registered: {name}")
+        info = {'name': name, 'status': status, 'match': None}
+        self.players[sock] = info
+        self.by_name[name] = sock
+        self.by_status[status].add(sock)
+        if self.on_change:
+            self.on_change(sock, name, status)
+        return info
+
+    def remove(self, sock):
+        """Forget a player, returning its info (None if unknown)"""
+        info = self.players.pop(sock, None)
+        if info is None:
+            return None
+        if self.by_name.get(info['name']) is sock:
+            del self.by_name[info['name']]
+        # Once the base name is free again its suffix counter can start over
+        self.name_suffix.pop(info['name'], None)
+        self.by_status[info['status']].discard(sock)
+        if self.on_change:
+            self.on_change(sock, info['name'], None)
+        return info
+
+    def rename(self, sock, name):
+        info = self.players[sock]
+        if name in self.by_name:
+            raise ValueError(f"Name already registered: {name}")
+        if self.by_name.get(info['name']) is sock:
+            del self.by_name[info['name']]
+        self.by_name[name] = sock
+        if self.on_change:
+            self.on_change(sock, info['name'], None)
+            self.on_change(sock, name, info['status'])
+        info['name'] = name
+        return info
+
+    def find(self, name, status=None):
+        sock = self.by_name.get(name)
+        if sock is None or (status is not None and self.players[sock]['status'] != status):
+            return None
+        return sock
+
+    def set_status(self, sock, status):
+        info = self.players[sock]
+        if info['status'] != status:
+            self.by_status[info['status']].discard(sock)
+            self.by_status[status].add(sock)
+            info['status'] = status
+            if self.on_change:
+                self.on_change(sock, info['name'], status)
+
+    def count(self, status):
+        return len(self.by_status[status])
@@ -0,0 +1,221 @@
+"""Replay a traffic capture (capture.py) against a server.
+
+Every captured connection is opened again and sent its frames byte for
+byte, at the captured times scaled by --speed (1: as recorded, 10: ten
+times faster) or, with --speed max, one after the other as fast as the
+server takes them. Events go out in the capture's order, so each
+connection sees its frames in the order it sent them and in the same
+order relative to the others' as the server first saw them. Once sent,
+only a connection's own order is certain: a server falling behind reads
+several frames of one connection ahead of another's earlier ones, and a
+PvP round whose plays cross that way shows up as unanswered plays. A captured
+close goes out as a half-close: the server sees the end of the stream
+where the capture has it, and the replies already on their way are
+still read.
+
+Replies are read with the same decoders as the Tk client. Requests with
+a direct reply (REPLIES) are timed until it arrives, per request type;
+the report is loadgen's (p50/p95/p99 per type) plus:
+
+  divergence  where the run went differently from the capture: error
+              replies by request type and the most common messages,
+              requests never answered, connect_acks naming the player
+              differently than requested, and connections the server
+              closed while the capture still had frames for them
+  lag         how far behind its scheduled time each frame went out
+              (not with --speed max)
+
+A capture holds session tokens of the server it was taken on, so resume
+requests are expected to fail in a replay; so are challenges of players
+named differently this time. Replay against a fresh server with the
+same options, or the divergence counts say little. Faster than 1x, a
+connection soon goes over its request limits and the server drops what
+it would have answered: start it with --no-rate-limits.
+
+Usage: python replay.py trace.rpst [--port 5555] [--speed 1|10|max] [--settle 2]
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, deque
+
+from capture import read_trace, KIND_OPEN, KIND_FRAME, KIND_CLOSE, KIND_DROPPED
+from loadgen import Player, Stats, raise_fd_limit
+from protocol import frame_type
+
+# Reply on the same connection that ends each request type's latency
+REPLIES = {
+    'connect': ('connect_ack',), 'resume': ('resume_ack', 'resume_failed'), 'play': ('game_result',),
+    'play_bot': ('game_result',), 'play_bot_batch': ('bot_batch_result',), 'get_players': ('player_list',),
+    'get_leaderboard': ('leaderboard',), 'get_history': ('history',), 'get_stats': ('stats',),
+    'join_queue': ('queue_joined',), 'leave_queue': ('queue_left',), 'spectate': ('spectate_state',),
+    'unspectate': ('spectate_stopped',), 'create_tournament': ('tournament_created',),
+    'join_tournament': ('tournament_joined',), 'leave_tournament': ('tournament_left',),
+    'get_tournament': ('tournament', 'tournaments'), 'chat_history': ('chat_history',),
+}
+# Error messages listed in the report
+TOP_ERRORS = 10
+
+
+class Divergence:
+    def __init__(self):
+        self.errors = Counter()  # {request type: error replies}
+        self.messages = Counter()  # {error text: count}
+        self.unanswered = Counter()
+        self.renamed = 0
+        self.cut_off = 0
+        self.connect_failed = 0
+        self.dropped_in_capture = 0
+
+    def report(self):
+        return {'errors': dict(self.errors), 'error_messages': dict(self.messages.most_common(TOP_ERRORS)),
+                'unanswered': dict(self.unanswered), 'renamed': self.renamed, 'cut_off': self.cut_off,
+                'connect_failed': self.connect_failed, 'dropped_in_capture': self.dropped_in_capture}
+
+
+class ReplayedConnection(Player):
+    """One captured connection played back: its frames out, replies matched to them"""
+
+    def __init__(self, stats, divergence):
+        super().__init__(stats, None)
+        self.divergence = divergence
+        self.outstanding = deque()  # [request type, reply types, sent at, requested name] in send order
+        self.server_closed = False
+        self.cut_off = False
+
+    async def open(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.reader_task = asyncio.ensure_future(self.read_loop())
+
+    def send_frame(self, wire, req_type):
+        if self.server_closed or self.writer.is_closing():
+            if not self.cut_off:
+                self.cut_off = True
+                self.divergence.cut_off += 1
+            return
+        self.writer.write(wire)
+        replies = REPLIES.get(req_type)
+        if replies is not None:
+            name = None
+            if req_type == 'connect':
+                try:
+                    name = json.loads(wire).get('player_name')  # Always ndjson: nothing negotiated yet
+                except ValueError:
+                    pass
+            self.outstanding.append((req_type, replies, time.perf_counter(), name))
+
+    def on_message(self, msg):
+        super().on_message(msg)
+        msg_type = msg.get('type')
+        if msg_type == 'error':
+            req_type = self.outstanding.popleft()[0] if self.outstanding else 'other'
+            self.divergence.errors[req_type] += 1
+            self.divergence.messages[str(msg.get('message'))] += 1
+            return
+        for entry in self.outstanding:
+            if msg_type in entry[1]:
+                self.outstanding.remove(entry)
+                req_type, _, sent, name = entry
+                self.stats.record(req_type, time.perf_counter() - sent)
+                if req_type == 'connect' and name is not None and msg.get('name') != name:
+                    self.divergence.renamed += 1
+                break
+
+    async def read_loop(self):
+        await super().read_loop()
+        self.server_closed = True
+        self.finish()
+
+    def end_stream(self):
+        try:
+            self.writer.write_eof()
+        except OSError:
+            self.finish()
+
+    def finish(self):
+        for entry in self.outstanding:
+            self.divergence.unanswered[entry[0]] += 1
+        self.outstanding.clear()
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def replay(records, host, port, speed, settle):
+    stats = Stats()
+    divergence = Divergence()
+    conns = {}  # {captured connection: ReplayedConnection, or None if it could not connect}
+    opened = []
+    lags = []
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    wall = time.perf_counter()
+    for kind, ftype, conn_id, us, payload in records:
+        if speed is not None:
+            delay = started + us / 1e6 / speed - loop.time()
+            lags.append(max(0.0, -delay))
+            await asyncio.sleep(max(0.0, delay))  # Even when late: replies get read in between
+        else:
+            await asyncio.sleep(0)
+        if kind == KIND_OPEN:
+            conn = ReplayedConnection(stats, divergence)
+            try:
+                await conn.open(host, port)
+            except OSError:
+                divergence.connect_failed += 1
+                conn = None
+            else:
+                opened.append(conn)
+            conns[conn_id] = conn
+        elif kind == KIND_FRAME:
+            conn = conns.get(conn_id)
+            if conn is not None:
+                conn.send_frame(payload, frame_type((ftype, payload)))
+                if speed is None:
+                    await conn.writer.drain()  # As fast as the server takes them, and no faster
+        elif kind == KIND_CLOSE:
+            conn = conns.pop(conn_id, None)
+            if conn is not None:
+                conn.end_stream()
+        elif kind == KIND_DROPPED:
+            divergence.dropped_in_capture += int(payload)
+    sent_in = time.perf_counter() - wall
+    await asyncio.sleep(settle)
+    for conn in opened:
+        conn.finish()  # Once only: outstanding is empty after the first
+    await asyncio.sleep(0.1)  # Readers notice the closes
+    report = stats.report(sent_in)
+    report['divergence'] = divergence.report()
+    if lags:
+        lags.sort()
+        report['lag'] = {'p50_ms': round(lags[len(lags) // 2] * 1000, 3),
+                         'p99_ms': round(lags[int(len(lags) * 0.99)] * 1000, 3),
+                         'max_ms': round(lags[-1] * 1000, 3)}
+    return report
+
+
+def run_replay(path, host='127.0.0.1', port=5555, speed=1.0, settle=2.0):
+    _, records = read_trace(path)
+    raise_fd_limit()
+    report = asyncio.run(replay(records, host, port, speed, settle))
+    frames = sum(1 for record in records if record[0] == KIND_FRAME)
+    connections = sum(1 for record in records if record[0] == KIND_OPEN)
+    return {'trace': path, 'speed': 'max' if speed is None else speed, 'connections': connections,
+            'frames': frames, 'captured_s': round(records[-1][3] / 1e6, 2) if records else 0, **report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace', help="file written by server.py --capture")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--speed', default='1', help="time scale (1: as captured, 10: ten times faster) or max")
+    parser.add_argument('--settle', type=float, default=2.0, help="seconds to wait for replies after the last frame")
+    args = parser.parse_args()
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    print(json.dumps(run_replay(args.trace, args.host, args.port, speed, args.settle), indent=2))
+
+
+if __name__ == '__main__':
+    main()
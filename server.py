@@ -1,276 +1,1352 @@
+import os
 import socket
-import json
 import threading
+import asyncio
+import argparse
+import random
 import time
+from collections import deque, OrderedDict
+
+import log
+from registry import PlayerRegistry, STATUSES
+from presence import Presence
+from outbound import Connection, ThreadedConnection, OutboundStats, HIGH_WATER, HARD_LIMIT, SEND_BUFFER
+from protocol import negotiate, frame_type, ProtocolError, CODECS, CHOICES
+from ratelimit import RateLimits, AcceptLimiter, ACCEPT_RATE, ACCEPT_BURST
+from sessions import Session, SESSION_GRACE
+from timers import TimerWheel
+from bot import BotEngine, BotSession, MAX_BATCH
+from metrics import Metrics, TimedLock
+from match import Match
+from spectators import Audience, FANOUT_BATCH
+from history import HistoryStore, HISTORY_KEEP
+from matchmaker import Matchmaker, SWEEP_INTERVAL
+from capture import Capture
+from handoff import Handoff, HandoffError, DRAIN_TIMEOUT, POLL as HANDOFF_POLL
+from chat import Channel, CHAT_WINDOW, FANOUT_BATCH as CHAT_BATCH, MAX_TEXT as MAX_CHAT_TEXT
+import tournament
+
+SERVER_MODES = ('threaded', 'asyncio')
+# Request types with their own metrics; anything else is counted as 'other'
+REQUEST_TYPES = ('connect', 'challenge', 'accept_challenge', 'play', 'play_bot', 'play_bot_batch',
+                 'quit_match', 'get_players', 'get_leaderboard', 'get_history', 'get_stats', 'join_queue',
+                 'leave_queue', 'resume', 'logout', 'spectate', 'unspectate', 'create_tournament',
+                 'join_tournament', 'leave_tournament', 'start_tournament', 'get_tournament', 'chat',
+                 'chat_history')
+# What happens to a player who has not played when the round clock runs out
+ROUND_TIMEOUT_POLICIES = ('pick', 'forfeit')
+# The client gives 10s per move and shows a result for 3s; allow some slack on top
+ROUND_TIMEOUT = 15.0
+# Most leaderboard entries one get_leaderboard returns
+LEADERBOARD_PAGE = 100
+# Most standings entries get_tournament and tournament_finished carry
+TOURNAMENT_STANDINGS = 100
+# Finished tournaments kept around for get_tournament, oldest dropped first
+MAX_FINISHED_TOURNAMENTS = 64
+# Tournaments open for entries at once, and how many of them one player may own
+MAX_OPEN_TOURNAMENTS = 256
+MAX_OPEN_PER_OWNER = 1
+# Direct-message channels (and their history) kept, least recently used dropped first
+MAX_DM_CHANNELS = 4096
+# Longest request frame a client may send: a full play_bot_batch with room to spare
+MAX_REQUEST = 4 * MAX_BATCH
+# Time-to-match histogram buckets: from paired on arrival to a long wait at the edge of the ratings
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+logger = log.get_logger('server')
+request_log = log.get_logger('request')
+play_log = log.get_logger('play')
+bot_log = log.get_logger('play_bot')
+
+
+class AsyncConnection(Connection, asyncio.Protocol):
+    """Socket-like wrapper around an asyncio transport.
+
+    The handle_* methods only ever call send_message() and close() on a
+    client, so in asyncio mode they receive one of these instead of a raw
+    socket. The transport's write buffer is the outbound queue.
+    """
+
+    def __init__(self, server, handed_over=False):
+        super().__init__(server.outbound_stats, server.high_water, server.hard_limit, MAX_REQUEST,
+                         server.new_limiter())
+        self.server = server
+        self.transport = None
+        self.closing = False
+        self.handed_over = handed_over  # Taken over from a predecessor process (handoff.py)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peer = transport.get_extra_info('peername')
+        if self.handed_over:
+            transport.pause_reading()  # Until its session is back in place (RPSServer.adopt_async)
+        elif not self.server.admit_peer(peer):
+            self.closing = True
+            transport.abort()
+            return
+        transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        logger.debug("New connection from %s", peer)
+        self.server.connections.add(self)
+        if self.server.capture is not None:
+            self.server.capture.open(self, peer)
+
+    def data_received(self, data):
+        try:
+            self.server.process_data(self, data)
+        except Exception as e:
+            logger.warning("Error handling client: %s", e)
+            self.server.connection_closed(self)
+
+    def connection_lost(self, exc):
+        self.server.connections.discard(self)
+        if self.server.capture is not None:
+            self.server.capture.close(self)
+        # Closed by the server already, nothing left to clean up
+        if not self.closing:
+            self.server.connection_closed(self)
+
+    @property
+    def queue_depth(self):
+        return self.transport.get_write_buffer_size()
+
+    def fileno(self):
+        return self.transport.get_extra_info('socket').fileno()
+
+    def send(self, data, droppable=False):
+        if self.closing or self.transport.is_closing():
+            raise ConnectionError("connection closed")
+        if not self.admit(len(data), droppable):
+            return 0
+        self.transport.write(data)
+        return len(data)
+
+    def close(self):
+        self.closing = True
+        self.transport.close()
+
+    def abort(self):
+        # connection_lost() runs connection_closed once the loop gets to it
+        self.transport.abort()
+
 
 class RPSServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    def __init__(self, host='0.0.0.0', port=5555, mode='threaded', backlog=1024, presence_window=0.1,
+                 high_water=HIGH_WATER, hard_limit=HARD_LIMIT, round_timeout=ROUND_TIMEOUT, round_policy='pick',
+                 admin_port=None, history_dir=None, session_grace=SESSION_GRACE, rate_limits=True,
+                 accept_rate=ACCEPT_RATE, chat_window=CHAT_WINDOW, capture=None, handoff=None):
+        if mode not in SERVER_MODES:
+            raise ValueError(f"Unknown server mode: {mode}")
+        if round_policy not in ROUND_TIMEOUT_POLICIES:
+            raise ValueError(f"Unknown round timeout policy: {round_policy}")
         self.host = host
         self.port = port
+        self.mode = mode
+        self.backlog = backlog
+        self.reuse_port = False
         self.server_socket = None
-        self.clients = {}  # {socket: {'name': str, 'status': str, 'opponent': socket, 'choice': str}}
+        self.loop = None
+        self.aio_server = None
+        self.connections = set()  # live client connections, whether or not they have a session
+        self.outbound_stats = OutboundStats()
+        self.high_water = high_water
+        self.hard_limit = hard_limit
+        self.round_timeout = round_timeout
+        self.round_policy = round_policy
+        # Per-connection request limits and the per-IP accept cap; both off without rate_limits
+        self.rate_limits = RateLimits() if rate_limits else None
+        self.accept_limiter = AcceptLimiter(accept_rate, ACCEPT_BURST) if rate_limits and accept_rate > 0 else None
+        self.timers = TimerWheel()
+        self.bot = BotEngine()
+        self.history_dir = history_dir
+        # Opened once the history is ours: a successor waits until its predecessor has let go (take_over)
+        self.history = HistoryStore(history_dir) if handoff is None else None
+        self.matchmaker = Matchmaker()
+        self.queue_timer = None  # pending sweep of the matchmaking queue, under self.lock
+        self.tournaments = {}  # {id: tournament.Tournament}, under self.lock
+        self.next_tournament_id = 1
+        self.parked_series = {}  # {name: [(Tournament, Series)] waiting for that player's match to end}, under self.lock
+        self.clients = PlayerRegistry(self.on_roster_change)  # {Session: {'name', 'status', 'match'}} plus indexes
+        self.sessions = {}  # {token: Session}, under self.lock
+        self.session_grace = session_grace
+        self.presence = Presence(self, window=presence_window)
+        self.chat_window = chat_window
+        self.chat_batch = CHAT_BATCH if mode == 'asyncio' else None
+        self.lobby_chat = Channel(self, self.chat_members, chat_window, self.chat_batch)
+        self.dm_chats = OrderedDict()  # {(name, name): Channel}, least recently used first, under self.lock
+        # Registry lock: held briefly for roster changes only; play state is under each Match's lock
         self.lock = threading.RLock()
+        self.admin_port = admin_port
+        # Trace of every inbound frame for replay.py (capture.py), when given a file
+        self.capture = Capture(capture) if capture else None
+        # Unix socket to take over from a running server on and to hand over to the next (handoff.py)
+        self.handoff = Handoff(self, handoff) if handoff else None
+        self.metrics = None
+        if admin_port is not None:
+            self.setup_metrics()
         self.game_choices = ['rock', 'paper', 'scissors']
 
+    def setup_metrics(self):
+        """Instrument requests, the lock and broadcasts for the admin port"""
+        metrics = self.metrics = Metrics()
+        self.request_time = metrics.histogram('rps_request_duration_seconds',
+                                              "Time spent handling a request", 'type')
+        self.request_errors = metrics.counter('rps_request_errors_total', "Requests whose handler raised", 'type')
+        self.rejected = metrics.counter('rps_rejected_total',
+                                        "Requests dropped over their rate limit, by class, and connections refused "
+                                        "or cut off (accept, strikes, frame)", 'kind')
+        for req_type in REQUEST_TYPES + ('other',):
+            self.request_time.labels(req_type)
+        self.broadcast_time = metrics.histogram('rps_broadcast_duration_seconds',
+                                                "Time to send one message to many clients", 'type')
+        lock_wait = metrics.histogram('rps_lock_wait_seconds', "Time spent waiting for the registry lock")
+        lock_hold = metrics.histogram('rps_lock_hold_seconds', "Time the registry lock was held")
+        self.lock = TimedLock(lock_wait.labels(), lock_hold.labels())
+
+        stats = self.outbound_stats
+        metrics.gauge('rps_sessions', "Connected players by status",
+                      lambda: {status: self.clients.count(status) for status in STATUSES}, 'status')
+        metrics.gauge('rps_outbound_bytes_total', "Bytes queued for clients",
+                      lambda: stats.bytes_queued, kind='counter')
+        metrics.gauge('rps_outbound_dropped_messages_total', "Droppable messages skipped for slow clients",
+                      lambda: stats.dropped_messages, kind='counter')
+        metrics.gauge('rps_slow_disconnects_total', "Clients cut off for not reading",
+                      lambda: stats.slow_disconnects, kind='counter')
+        metrics.gauge('rps_outbound_max_queue_bytes', "Deepest outbound queue seen", lambda: stats.max_queue_depth)
+        metrics.gauge('rps_pending_timers', "Round timers and other deadlines pending", lambda: len(self.timers))
+        metrics.gauge('rps_roster_version', "Current lobby roster version", lambda: self.presence.version)
+        metrics.gauge('rps_history_pending_records', "Rounds waiting for the history writer",
+                      lambda: self.history.pending_records)
+        metrics.gauge('rps_sessions_detached', "Sessions kept for a resume after their connection dropped",
+                      lambda: sum(1 for session in list(self.sessions.values()) if session.conn is None))
+        self.resumes = metrics.counter('rps_session_resumes_total', "resume requests by outcome", 'result')
+        metrics.gauge('rps_spectators', "Players watching a match",
+                      lambda: sum(1 for info in list(self.clients.values()) if info.get('watching') is not None))
+        metrics.gauge('rps_tournaments', "Tournaments by status",
+                      lambda: {status: sum(1 for t in list(self.tournaments.values()) if t.status == status)
+                               for status in ('open', 'running', 'finished')}, 'status')
+        self.chat_messages = metrics.counter('rps_chat_messages_total', "Chat messages posted, by channel",
+                                             'channel')
+        metrics.gauge('rps_chat_skipped_total', "Lobby chat messages skipped behind a full pending list",
+                      lambda: self.lobby_chat.skipped, kind='counter')
+        if self.capture is not None:
+            metrics.gauge('rps_capture_records_total', "Records written to the traffic capture",
+                          lambda: self.capture.records, kind='counter')
+            metrics.gauge('rps_capture_dropped_total', "Capture records dropped behind a slow writer",
+                          lambda: self.capture.dropped, kind='counter')
+        metrics.gauge('rps_queue_depth', "Players waiting in the matchmaking queue", lambda: len(self.matchmaker))
+        self.queue_wait = metrics.histogram('rps_queue_wait_seconds', "Time from join_queue to being paired",
+                                            buckets=QUEUE_WAIT_BUCKETS).labels()
+
     def start(self):
+        if self.handoff is None:
+            self.start_admin()  # Else once a predecessor has let go of the port (Handoff.run)
+        if self.mode == 'asyncio':
+            self.start_asyncio()
+        else:
+            self.start_threaded()
+
+    def create_server_socket(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            # Let several worker processes accept on the same port
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         # Disable Nagle's algorithm for lower latency
         self.server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen()
-        print(f"Server started on {self.host}:{self.port}")
+        self.server_socket.listen(self.backlog)
+        logger.info("Server started on %s:%s (%s mode)", self.host, self.port, self.mode)
+
+    def start_admin(self):
+        if self.admin_port is not None:
+            from admin import AdminServer
+            AdminServer(self.metrics, port=self.admin_port).start()
 
+    def take_over(self):
+        """Bind the listening socket, or take it over with everything else from a server
+        handing over on the handoff path; returns the handoff.Takeover, if any"""
+        try:
+            taken = self.handoff.take_over() if self.handoff is not None else None
+        except (HandoffError, OSError) as e:
+            logger.error("Could not take over from the running server: %s", e)
+            raise SystemExit(1)
+        if taken is None:
+            self.create_server_socket()
+            if self.history is None:
+                self.history = HistoryStore(self.history_dir)
+        else:
+            self.server_socket = taken.listener
+            logger.info("Server taking over on %s:%s (%s mode)", self.host, self.port, self.mode)
+        return taken
+
+    def serving(self, taken):
+        """Up and running: let the predecessor go, and wait for a successor"""
+        if taken is not None:
+            taken.ready()
+        if self.handoff is not None:
+            self.handoff.listen()
+
+    def start_threaded(self):
+        """One thread per connection, each blocking on recv()"""
+        taken = self.take_over()
+        self.timers.start()
+        if taken is not None:
+            conns = [ThreadedConnection(sock, self.outbound_stats, self.high_water, self.hard_limit, MAX_REQUEST,
+                                        self.new_limiter()) for sock in taken.sockets]
+            self.adopt_state(taken.state, conns)
+            for conn in conns:
+                self.start_reader(conn, None)
+        self.serving(taken)
+        gate = self.handoff.gate if self.handoff is not None else None
+        poller = gate.poller(self.server_socket.fileno()) if gate is not None else None
         try:
             while True:
+                if poller is not None:
+                    gate.hold(poller)  # Parks here while a handoff has the server frozen
                 client_socket, addr = self.server_socket.accept()
+                if not self.admit_peer(addr):
+                    client_socket.close()
+                    continue
                 client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                print(f"New connection from {addr}")
-                threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True).start()
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+                logger.debug("New connection from %s", addr)
+                conn = ThreadedConnection(client_socket, self.outbound_stats, self.high_water, self.hard_limit,
+                                          MAX_REQUEST, self.new_limiter())
+                self.start_reader(conn, addr)
         except KeyboardInterrupt:
-            print("Server stopping...")
+            logger.info("Server stopping...")
         finally:
             self.shutdown()
 
-    def broadcast_player_list(self):
-        """Send updated player list to all clients in lobby"""
-        clients_to_send = {}
-        message = ""
-        
+    def start_reader(self, conn, addr):
+        self.connections.add(conn)
+        if self.capture is not None:
+            self.capture.open(conn, addr)
+        threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+
+    def start_asyncio(self):
+        """Serve every connection from a single event loop"""
+        taken = self.take_over()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.timers.start(self.loop)
+        try:
+            if taken is not None:
+                self.loop.run_until_complete(self.adopt_async(taken))
+            self.aio_server = self.loop.run_until_complete(
+                self.loop.create_server(lambda: AsyncConnection(self), sock=self.server_socket))
+            self.serving(taken)
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            logger.info("Server stopping...")
+        finally:
+            self.shutdown()
+            self.loop.close()
+
+    def new_limiter(self):
+        return self.rate_limits.limiter() if self.rate_limits is not None else None
+
+    def admit_peer(self, addr):
+        """Whether a new connection from addr is within its IP's accept rate"""
+        if self.accept_limiter is None or not addr:
+            return True
+        if self.accept_limiter.admit(addr[0]):
+            return True
+        if self.metrics is not None:
+            self.rejected.labels('accept').inc()
+        return False
+
+    def call_later(self, delay, callback):
+        """Run callback after delay seconds on the server's own thread(s)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback)
+        else:
+            self.timers.schedule(delay, callback)
+
+    def on_roster_change(self, sock, name, status):
+        self.presence.update(name, status)
+
+    def lobby_clients(self):
+        """Split connected players into (wants roster deltas, wants full player_list)"""
+        delta_socks, legacy_socks = [], []
         with self.lock:
-            # Build list of players
-            players_list = []
             for sock, info in self.clients.items():
-                if info['name']:  # Only list players who have identified themselves
-                    players_list.append({
-                        'name': info['name'],
-                        'status': info['status']
-                    })
-            
-            message = json.dumps({'type': 'player_list', 'players': players_list}) + '\n'
-            clients_to_send = {sock: info for sock, info in self.clients.items()}
-        
-        # Send outside of lock to avoid blocking other threads
-        for sock in clients_to_send:
+                (delta_socks if info.get('roster_deltas') else legacy_socks).append(sock)
+        return delta_socks, legacy_socks
+
+    def broadcast(self, msg, socks, droppable=False):
+        """Send one message to many clients, encoding it once per wire format"""
+        if self.metrics is not None:
+            started = time.perf_counter()
+            try:
+                self.send_to_all(msg, socks, droppable)
+            finally:
+                self.broadcast_time.labels(msg['type']).observe(time.perf_counter() - started)
+        else:
+            self.send_to_all(msg, socks, droppable)
+
+    def send_to_all(self, msg, socks, droppable):
+        encoded = {}
+        for sock in socks:
+            data = encoded.get(sock.codec)
+            if data is None:
+                data = encoded[sock.codec] = sock.codec.encode(msg)
             try:
-                sock.send(message.encode('utf-8'))
+                sock.send(data, droppable)
             except:
                 pass
 
     def handle_client(self, client_socket):
-        buffer = ""
+        gate = self.handoff.gate if self.handoff is not None else None
+        poller = gate.poller(client_socket.fileno()) if gate is not None else None
         try:
             while True:
-                data = client_socket.recv(4096).decode('utf-8')
+                if poller is not None:
+                    gate.hold(poller)  # Parks here while a handoff has the server frozen
+                data = client_socket.recv(4096)
                 if not data:
                     break
-                
-                buffer += data
-                
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    if not line.strip(): continue
-                    
-                    print(f"[SERVER] Processing line: {line[:100]}", flush=True)
-                    
-                    try:
-                        request = json.loads(line)
-                        req_type = request.get('type')
-                        print(f"[SERVER] Processing request type: {req_type}", flush=True)
-
-                        if req_type == 'connect':
-                            self.handle_connect(client_socket, request)
-                        elif req_type == 'challenge':
-                            self.handle_challenge(client_socket, request)
-                        elif req_type == 'accept_challenge':
-                            self.handle_accept_challenge(client_socket, request)
-                        elif req_type == 'play':
-                            self.handle_play(client_socket, request)
-                        elif req_type == 'play_bot':
-                            self.handle_play_bot(client_socket, request)
-                        elif req_type == 'quit_match':
-                            self.handle_quit_match(client_socket, request)
-                        elif req_type == 'chat':
-                            self.handle_chat(client_socket, request)
-                    except json.JSONDecodeError as je:
-                        print(f"[SERVER] JSON Error: {je} for line: {line}", flush=True)
+                self.process_data(client_socket, data)
 
         except Exception as e:
-            print(f"[SERVER] Error handling client: {e}", flush=True)
+            logger.warning("Error handling client: %s", e)
         finally:
+            self.connections.discard(client_socket)
+            if self.capture is not None:
+                self.capture.close(client_socket)
+            self.connection_closed(client_socket)
+
+    def process_data(self, client_socket, data):
+        """Feed received bytes to the connection's decoder and dispatch each request.
+
+        Requests are handled on behalf of the connection's session once it
+        has one (after connect or resume), else of the bare connection.
+        With rate limits, each frame is charged to its type's bucket before
+        it is parsed (see ratelimit.py); one over the limit is dropped, and
+        too many dropped, like an oversized frame, raise ProtocolError,
+        which closes the connection.
+        """
+        client_socket.decoder.feed(data)
+        limiter = client_socket.limiter
+        capture = self.capture
+        while True:
+            # Re-read the decoder every time: connect may switch the wire format
+            decoder = client_socket.decoder
+            try:
+                frame = decoder.next_frame()
+            except ProtocolError:
+                if self.metrics is not None:
+                    self.rejected.labels('frame').inc()
+                raise
+            if frame is None:
+                break
+            if capture is not None:
+                capture.frame(client_socket, frame, decoder.wire(frame))
+            if limiter is not None:
+                charged = self.rate_limits.classify(frame_type(frame))
+                if not limiter.take(charged):
+                    self.reject(client_socket, charged)
+                    continue
+            request = decoder.parse(frame)
+            if request is None:
+                continue
+            if limiter is not None:
+                actual = self.rate_limits.classify(request.get('type'))
+                if actual != charged and not limiter.take(actual):
+                    self.reject(client_socket, actual)
+                    continue
+            self.dispatch(client_socket.session or client_socket, request)
+
+    def reject(self, conn, bucket):
+        """A request was over its rate limit and dropped; cut off a connection that keeps at it"""
+        if self.metrics is not None:
+            self.rejected.labels(self.rate_limits.names[bucket]).inc()
+        if not conn.limiter.strike():
+            if self.metrics is not None:
+                self.rejected.labels('strikes').inc()
+            raise ProtocolError(f"too many {self.rate_limits.names[bucket]} requests")
+
+    def dispatch(self, client_socket, request):
+        """Route a decoded request to its handle_* method"""
+        req_type = request.get('type')
+        request_log.debug("Processing request type: %s", req_type, msg_type=req_type)
+        if self.metrics is None:
+            self.handle_request(client_socket, req_type, request)
+            return
+
+        label = req_type if req_type in REQUEST_TYPES else 'other'
+        started = time.perf_counter()
+        try:
+            self.handle_request(client_socket, req_type, request)
+        except Exception:
+            self.request_errors.labels(label).inc()
+            raise
+        finally:
+            self.request_time.labels(label).observe(time.perf_counter() - started)
+
+    def handle_request(self, client_socket, req_type, request):
+        if req_type == 'connect':
+            self.handle_connect(client_socket, request)
+        elif req_type == 'challenge':
+            self.handle_challenge(client_socket, request)
+        elif req_type == 'accept_challenge':
+            self.handle_accept_challenge(client_socket, request)
+        elif req_type == 'play':
+            self.handle_play(client_socket, request)
+        elif req_type == 'play_bot':
+            self.handle_play_bot(client_socket, request)
+        elif req_type == 'play_bot_batch':
+            self.handle_play_bot_batch(client_socket, request)
+        elif req_type == 'quit_match':
+            self.handle_quit_match(client_socket, request)
+        elif req_type == 'get_players':
+            self.handle_get_players(client_socket, request)
+        elif req_type == 'get_leaderboard':
+            self.handle_get_leaderboard(client_socket, request)
+        elif req_type == 'get_history':
+            self.handle_get_history(client_socket, request)
+        elif req_type == 'get_stats':
+            self.handle_get_stats(client_socket, request)
+        elif req_type == 'join_queue':
+            self.handle_join_queue(client_socket, request)
+        elif req_type == 'leave_queue':
+            self.handle_leave_queue(client_socket, request)
+        elif req_type == 'resume':
+            self.handle_resume(client_socket, request)
+        elif req_type == 'logout':
             self.disconnect_client(client_socket)
+        elif req_type == 'spectate':
+            self.handle_spectate(client_socket, request)
+        elif req_type == 'unspectate':
+            self.handle_unspectate(client_socket, request)
+        elif req_type == 'create_tournament':
+            self.handle_create_tournament(client_socket, request)
+        elif req_type == 'join_tournament':
+            self.handle_join_tournament(client_socket, request)
+        elif req_type == 'leave_tournament':
+            self.handle_leave_tournament(client_socket, request)
+        elif req_type == 'start_tournament':
+            self.handle_start_tournament(client_socket, request)
+        elif req_type == 'get_tournament':
+            self.handle_get_tournament(client_socket, request)
+        elif req_type == 'chat':
+            self.handle_chat(client_socket, request)
+        elif req_type == 'chat_history':
+            self.handle_chat_history(client_socket, request)
 
     # ... (handle_connect, handle_challenge, handle_accept_challenge remain same)
 
-    def handle_quit_match(self, client_sock, request):
+    def find_player(self, name, status=None):
+        """Return the socket of the player called name (optionally only if in status)"""
         with self.lock:
-            if client_sock not in self.clients: return
-            
-            # Reset this player
-            self.clients[client_sock]['status'] = 'idle'
-            opponent_sock = self.clients[client_sock]['opponent']
-            self.clients[client_sock]['opponent'] = None
-            self.clients[client_sock]['choice'] = None
-            
-            # Notify opponent
-            if opponent_sock and opponent_sock in self.clients:
-                self.clients[opponent_sock]['status'] = 'idle'
-                self.clients[opponent_sock]['opponent'] = None
-                self.clients[opponent_sock]['choice'] = None
+            return self.clients.find(name, status)
+
+    def allocate_name(self, name):
+        """Return a unique display name for a newly connecting player"""
+        with self.lock:
+            return self.clients.allocate_name(name)
+
+    def set_player_state(self, sock, status, match=None):
+        """Move a player between idle/playing, linking it to its match (if any)"""
+        with self.lock:
+            info = self.clients.get(sock)
+            if info is None:
+                return  # Already gone
+            self.clients.set_status(sock, status)
+            info['match'] = match
+
+    def start_match(self, a, b):
+        """Pair two players not in a match (taking them out of the matchmaking queue);
+        returns the Match, or None if either is already playing"""
+        with self.lock:
+            a_info, b_info = self.clients.get(a), self.clients.get(b)
+            if not a_info or not b_info or a_info['status'] == 'playing' or b_info['status'] == 'playing':
+                return None
+            self.matchmaker.leave(a)
+            self.matchmaker.leave(b)
+            for info, sock in ((a_info, a), (b_info, b)):
+                self.stop_watching(info, sock)
+            match = Match(a, a_info['name'], b, b_info['name'])
+            self.set_player_state(a, 'playing', match)
+            self.set_player_state(b, 'playing', match)
+        return match
+
+    def end_match(self, match, leaver=None):
+        """Stop match and send its players back to the lobby.
+
+        Everyone but leaver (who quit or disconnected) is told the opponent
+        left, or, for a tournament series, gets its series_result: a series
+        not decided by then goes against leaver (if nobody left, the match
+        was abandoned and the second player loses). Safe to call more than
+        once; only the first call does anything.
+        """
+        with match.lock:
+            if not match.close():
+                return
+            series = match.series
+            if series is not None and series.winner is None:
+                # Abandoned: whoever is behind loses, the second player on a tie
+                series.forfeit(match.names[leaver] if leaver is not None else
+                               min(reversed(series.players), key=series.wins.get))
+            audience = match.audience
+            if audience is not None:
+                audience.publish({'event': 'end', 'leaver': match.names.get(leaver)})
+                audience.close()
+        if audience is not None:
+            with self.lock:
+                for sock in audience.members():
+                    info = self.clients.get(sock)
+                    if info is not None and info.get('watching') is match:
+                        info['watching'] = None
+        for sock in match.players:
+            self.set_player_state(sock, 'idle')
+            if sock is leaver:
+                continue
+            if series is None:
+                msg = {'type': 'opponent_left'}
+            else:
+                name = match.names[sock]
+                msg = {'type': 'series_result', 'tournament': match.tournament.id,
+                       'result': 'win' if series.winner == name else 'lose',
+                       'score': [series.wins[name], series.wins[series.other(name)]],
+                       'forfeit': max(series.wins.values()) <= series.best_of // 2}
+            try:
+                sock.send_message(msg)
+            except:
+                pass
+        if series is not None:
+            self.start_series(match.tournament, self.series_finished(match.tournament, series))
+        self.unpark_series(match.names.values())
+
+    def begin_match(self, match, queued=False):
+        """Send both players game_start and start the first round's clock"""
+        with match.lock:
+            for sock in match.players:
+                opponent = match.names[match.other(sock)]
+                msg = {'type': 'game_start', 'opponent': opponent, 'mode': 'pvp'}
+                if queued:
+                    msg['opponent_rating'] = round(self.history.rating(opponent))
+                if match.series is not None:
+                    msg.update(tournament=match.tournament.id, best_of=match.series.best_of,
+                               stage=match.series.stage)
                 try:
-                    opponent_sock.send((json.dumps({'type': 'opponent_left'}) + '\n').encode('utf-8'))
+                    sock.send_message(msg)
                 except:
                     pass
-            
-        self.broadcast_player_list()
+            self.start_round_timer(match)
+
+    def start_round_timer(self, match):
+        """(Re)start the clock for the current round; call with match.lock held"""
+        if not self.round_timeout:
+            return
+        if match.timer is not None:
+            match.timer.cancel()
+        match.timer = self.timers.schedule(self.round_timeout, self.on_round_timeout, match, match.round)
+
+    def on_round_timeout(self, match, round_number):
+        with match.lock:
+            if not match.active or match.round != round_number:
+                return  # The round was played or the match ended while this timer was firing
+            late = match.late()
+            if len(late) == 1:
+                play_log.debug("Round timed out for %s (%s)", match.names[late[0]], self.round_policy)
+                if self.round_policy == 'pick':
+                    match.choices[late[0]] = random.choice(self.game_choices)
+                    decided = self.finish_round(match, timeout=True)
+                else:
+                    decided = self.finish_round(match, timeout=True, forfeit=late[0])
+            else:
+                decided = None
+        if decided is not None:
+            if decided:
+                self.end_match(match)  # Tournament series over
+            return
+        # Nobody played for a whole round: the match is abandoned
+        play_log.info("Match %s vs %s abandoned", *match.names.values())
+        self.end_match(match)
+
+    def player_match(self, sock):
+        info = self.clients.get(sock)
+        return info.get('match') if info is not None else None
+
+    def handle_quit_match(self, client_sock, request):
+        match = self.player_match(client_sock)
+        if match is not None:
+            self.end_match(match, leaver=client_sock)
+
+    def handle_get_players(self, client_sock, request):
+        """Full roster snapshot, e.g. for the refresh button or a delta gap"""
+        try:
+            client_sock.send_message(self.presence.snapshot(), droppable=True)
+        except:
+            pass
+
+    def handle_get_leaderboard(self, client_sock, request):
+        """A page of the PvP leaderboard: {'offset': 0, 'limit': 10}, plus the caller's own standing"""
+        try:
+            offset = max(0, int(request.get('offset', 0)))
+            limit = min(LEADERBOARD_PAGE, max(0, int(request.get('limit', 10))))
+        except (TypeError, ValueError):
+            client_sock.send_message({'type': 'error', 'message': "offset and limit must be numbers"})
+            return
+        total, entries = self.history.top(offset, limit)
+        response = {'type': 'leaderboard', 'offset': offset, 'total': total, 'entries': entries}
+        info = self.clients.get(client_sock)
+        if info is not None:
+            response['me'] = self.history.standing(info['name'])
+        try:
+            client_sock.send_message(response)
+        except:
+            pass
+
+    def handle_get_history(self, client_sock, request):
+        """Recent rounds of a player (default: the caller), newest first; 'opponent' for head-to-head"""
+        info = self.clients.get(client_sock)
+        name = request.get('player') or (info['name'] if info is not None else None)
+        opponent = request.get('opponent')
+        try:
+            limit = min(HISTORY_KEEP, max(0, int(request.get('limit', HISTORY_KEEP))))
+        except (TypeError, ValueError):
+            client_sock.send_message({'type': 'error', 'message': "limit must be a number"})
+            return
+        rounds = self.history.history(name, limit, opponent) if name else []
+        try:
+            client_sock.send_message({'type': 'history', 'player': name, 'opponent': opponent, 'rounds': rounds})
+        except:
+            pass
+
+    def handle_get_stats(self, client_sock, request):
+        """Win rate and choice mix of a player (default: the caller), optionally against one opponent"""
+        info = self.clients.get(client_sock)
+        name = request.get('player') or (info['name'] if info is not None else None)
+        if not name:
+            return
+        response = self.history.stats(name, request.get('opponent'))
+        response['type'] = 'stats'
+        try:
+            client_sock.send_message(response)
+        except:
+            pass
+
+    def handle_join_queue(self, client_sock, request):
+        """Wait for a PvP opponent of similar rating: queue_joined now, game_start once paired"""
+        with self.lock:
+            info = self.clients.get(client_sock)
+            if info is None or info['status'] != 'idle':
+                match = False
+            else:
+                rating = self.history.rating(info['name'])
+                ticket, opponent = self.matchmaker.join(client_sock, info['name'], rating)
+                if opponent is None:
+                    match = None
+                    self.set_player_state(client_sock, 'waiting')
+                    if self.queue_timer is None:
+                        self.queue_timer = self.timers.schedule(SWEEP_INTERVAL, self.sweep_queue)
+                else:
+                    match = self.start_match(client_sock, opponent.sock)
+        if match is False:
+            client_sock.send_message({'type': 'error', 'message': "Only players in the lobby can join the queue"})
+            return
+        try:
+            client_sock.send_message({'type': 'queue_joined', 'rating': round(rating)})
+        except:
+            pass
+        if match is not None:
+            self.observe_queue_wait(ticket, opponent)
+            self.begin_match(match, queued=True)
+
+    def handle_leave_queue(self, client_sock, request):
+        with self.lock:
+            left = self.matchmaker.leave(client_sock) is not None
+            if left:
+                self.set_player_state(client_sock, 'idle')
+        if left:
+            try:
+                client_sock.send_message({'type': 'queue_left'})
+            except:
+                pass
+
+    def sweep_queue(self):
+        """Pair queued players whose search windows have grown to reach each other"""
+        with self.lock:
+            pairs = [(self.start_match(ticket.sock, opponent.sock), ticket, opponent)
+                     for ticket, opponent in self.matchmaker.sweep()]
+            self.queue_timer = (self.timers.schedule(SWEEP_INTERVAL, self.sweep_queue)
+                                if len(self.matchmaker) else None)
+        for match, ticket, opponent in pairs:
+            if match is not None:
+                self.observe_queue_wait(ticket, opponent)
+                self.begin_match(match, queued=True)
+
+    def observe_queue_wait(self, *tickets):
+        if self.metrics is not None:
+            now = time.monotonic()
+            for ticket in tickets:
+                self.queue_wait.observe(now - ticket.joined)
+
+    def handle_spectate(self, client_sock, request):
+        """Watch the match a player is in: {'player': name}.
+
+        The spectator gets a spectate_state snapshot, then spectate_update
+        events (see spectators.py) until the match ends or it sends
+        unspectate. Only players not in a match themselves may watch.
+        """
+        name = request.get('player')
+        target = self.find_player(name, 'playing') if isinstance(name, str) else None
+        match = self.player_match(target) if target is not None else None
+        if match is None:
+            client_sock.send_message({'type': 'error', 'message': f"{name} is not playing a match"})
+            return
+        with match.lock:
+            if match.active and match.audience is None:
+                match.audience = Audience(self, match.summary(), FANOUT_BATCH if self.mode == 'asyncio' else None)
+            audience = match.audience
+        with self.lock:
+            info = self.clients.get(client_sock)
+            if info is None or info['status'] == 'playing':
+                return
+            if info.get('watching') is not match:
+                self.stop_watching(info, client_sock)
+            if audience is None or not audience.subscribe(client_sock):
+                client_sock.send_message({'type': 'error', 'message': f"{name} is not playing a match"})
+                return
+            info['watching'] = match
+        if match.chat is not None:
+            self.send_chat_history(client_sock, 'match', match.chat)
+
+    def handle_unspectate(self, client_sock, request):
+        with self.lock:
+            info = self.clients.get(client_sock)
+            if info is None or not self.stop_watching(info, client_sock):
+                return
+        client_sock.send_message({'type': 'spectate_stopped'})
+
+    def stop_watching(self, info, sock):
+        """Take a player out of the audience it is in, if any; call with self.lock held"""
+        match = info.get('watching')
+        if match is None:
+            return False
+        info['watching'] = None
+        match.audience.unsubscribe(sock)
+        return True
+
+    def chat_members(self):
+        with self.lock:
+            return list(self.clients)
+
+    def chat_channel(self, client_sock, request, create=True):
+        """(sender's name, Channel) a chat or chat_history request is about.
+
+        'match' is the match the sender plays or watches, 'dm' the pair of
+        the sender and 'to'. The Channel is None if it does not exist and
+        create is false; (None, None) after telling the sender what is wrong.
+        """
+        kind = request.get('channel', 'lobby')
+        with self.lock:
+            info = self.clients.get(client_sock)
+            if info is None:
+                return None, None
+            name = info['name']
+            match = info['match'] or info.get('watching')
+        if kind == 'lobby':
+            return name, self.lobby_chat
+        if kind == 'match':
+            if match is None or not match.active:
+                client_sock.send_message({'type': 'error', 'message': "You are not in or watching a match"})
+                return None, None
+            with match.lock:
+                return name, self.match_chat(match) if create else match.chat
+        if kind == 'dm':
+            peer = request.get('to')
+            if not isinstance(peer, str) or peer == name or self.find_player(peer) is None:
+                client_sock.send_message({'type': 'error', 'message': f"{peer} is not online"})
+                return None, None
+            pair = tuple(sorted((name, peer)))
+            with self.lock:
+                channel = self.dm_chats.get(pair)
+                if channel is not None:
+                    self.dm_chats.move_to_end(pair)
+                elif create:
+                    channel = self.dm_chat(pair)
+            return name, channel
+        client_sock.send_message({'type': 'error', 'message': f"Unknown chat channel: {kind}"})
+        return None, None
+
+    def match_chat(self, match):
+        """The channel of a match's players and spectators, created on first use; call with match.lock held"""
+        if match.chat is None:
+            audience = lambda: match.audience.members() if match.audience is not None else []
+            match.chat = Channel(self, lambda: list(match.players) + audience(), self.chat_window, self.chat_batch)
+        return match.chat
+
+    def dm_chat(self, pair):
+        """A new direct-message channel between the two names in pair; call with self.lock held"""
+        channel = self.dm_chats[pair] = Channel(
+            self, lambda: [sock for sock in map(self.find_player, pair) if sock is not None], self.chat_window)
+        if len(self.dm_chats) > MAX_DM_CHANNELS:
+            self.dm_chats.popitem(last=False)
+        return channel
+
+    def handle_chat(self, client_sock, request):
+        """Say something: {'channel': 'lobby' | 'match' | 'dm', 'text', 'to': name for a dm}; see chat.py"""
+        text = request.get('text')
+        if not isinstance(text, str) or not text.strip() or len(text) > MAX_CHAT_TEXT:
+            client_sock.send_message({'type': 'error',
+                                      'message': f"Chat messages are 1 to {MAX_CHAT_TEXT} characters"})
+            return
+        name, channel = self.chat_channel(client_sock, request)
+        if channel is None:
+            return
+        kind = request.get('channel', 'lobby')
+        msg = {'type': 'chat', 'channel': kind, 'from': name, 'text': text, 'ts': round(time.time(), 3)}
+        if kind == 'dm':
+            msg['to'] = request['to']
+        channel.post(msg)
+        if self.metrics is not None:
+            self.chat_messages.labels(kind).inc()
+
+    def handle_chat_history(self, client_sock, request):
+        """A channel's recent messages: {'channel', 'to': name for a dm}"""
+        name, channel = self.chat_channel(client_sock, request, create=False)
+        if name is not None:
+            client_sock.send_message(self.chat_history(request.get('channel', 'lobby'), channel, request.get('to')))
+
+    def chat_history(self, kind, channel, peer=None):
+        msg = {'type': 'chat_history', 'channel': kind, 'messages': channel.recent() if channel is not None else []}
+        if peer is not None:
+            msg['to'] = peer
+        return msg
+
+    def send_chat_history(self, sock, kind, channel):
+        """Catch a late joiner up on a channel, if anything was said there"""
+        msg = self.chat_history(kind, channel)
+        if msg['messages']:
+            sock.send_message(msg)
+
+    def handle_create_tournament(self, client_sock, request):
+        """Open a tournament for players to join: {'format', 'best_of', 'rounds', 'name'}.
+
+        The creator owns it and is the one who starts it; it does not have
+        to play in it. It is dropped if the creator leaves before starting it.
+        """
+        with self.lock:
+            info = self.clients.get(client_sock)
+            if info is None:
+                return
+            open_tournaments = [t for t in self.tournaments.values() if t.status == 'open']
+            if sum(1 for t in open_tournaments if t.owner == info['name']) >= MAX_OPEN_PER_OWNER:
+                client_sock.send_message({'type': 'error', 'message': "Start the tournament you opened first"})
+                return
+            if len(open_tournaments) >= MAX_OPEN_TOURNAMENTS:
+                client_sock.send_message({'type': 'error', 'message': "Too many open tournaments, try again later"})
+                return
+            try:
+                t = tournament.create(self.next_tournament_id, request.get('format'), request.get('best_of', 3),
+                                      request.get('rounds'), request.get('name'), owner=info['name'])
+            except ValueError as e:
+                client_sock.send_message({'type': 'error', 'message': str(e)})
+                return
+            self.tournaments[t.id] = t
+            self.next_tournament_id += 1
+        logger.info("%s created tournament %d (%s, best of %d)", t.owner, t.id, t.format, t.best_of)
+        client_sock.send_message({'type': 'tournament_created', 'tournament': t.summary()})
+
+    def find_tournament(self, client_sock, request):
+        """The tournament request['id'] names, or None after telling the client there is none"""
+        tournament_id = request.get('id')
+        t = self.tournaments.get(tournament_id) if isinstance(tournament_id, int) else None
+        if t is None:
+            client_sock.send_message({'type': 'error', 'message': f"No tournament {tournament_id}"})
+        return t
+
+    def handle_join_tournament(self, client_sock, request):
+        with self.lock:
+            info = self.clients.get(client_sock)
+            t = self.find_tournament(client_sock, request) if info is not None else None
+            if t is None:
+                return
+            try:
+                t.add(info['name'])
+            except ValueError as e:
+                client_sock.send_message({'type': 'error', 'message': str(e)})
+                return
+            summary = t.summary()
+        client_sock.send_message({'type': 'tournament_joined', 'tournament': summary})
+
+    def handle_leave_tournament(self, client_sock, request):
+        """Withdraw before the start; once it runs, quitting a series forfeits it"""
+        with self.lock:
+            info = self.clients.get(client_sock)
+            t = self.find_tournament(client_sock, request) if info is not None else None
+            if t is None or not t.remove(info['name']):
+                return
+        client_sock.send_message({'type': 'tournament_left', 'id': t.id})
+
+    def handle_start_tournament(self, client_sock, request):
+        with self.lock:
+            info = self.clients.get(client_sock)
+            t = self.find_tournament(client_sock, request) if info is not None else None
+            if t is None:
+                return
+            if t.owner != info['name']:
+                client_sock.send_message({'type': 'error', 'message': "Only its creator can start a tournament"})
+                return
+            try:
+                ready = t.start()
+            except ValueError as e:
+                client_sock.send_message({'type': 'error', 'message': str(e)})
+                return
+            entrants = [sock for sock in map(self.clients.find, t.entrants) if sock is not None]
+            summary = t.summary()
+        logger.info("Tournament %d started with %d players", t.id, len(t))
+        self.send_entrants({'type': 'tournament_started', 'tournament': summary}, entrants)
+        self.start_series(t, ready)
+
+    def handle_get_tournament(self, client_sock, request):
+        """One tournament's summary and standings ({'id', 'limit'}), or without an id all of them"""
+        with self.lock:
+            if request.get('id') is None:
+                response = {'type': 'tournaments', 'tournaments': [t.summary() for t in self.tournaments.values()]}
+            else:
+                t = self.find_tournament(client_sock, request)
+                if t is None:
+                    return
+                limit = request.get('limit', TOURNAMENT_STANDINGS)
+                limit = max(1, min(limit, TOURNAMENT_STANDINGS)) if isinstance(limit, int) else TOURNAMENT_STANDINGS
+                response = {'type': 'tournament', 'tournament': t.summary(), 'standings': t.standings(limit)}
+        try:
+            client_sock.send_message(response)
+        except:
+            pass
+
+    def start_series(self, t, ready):
+        """Play each series in ready as a match.
+
+        A player who has left forfeits (which may make more series ready).
+        A player still busy in another match has the series parked until
+        that match ends.
+        """
+        ready = deque(ready)
+        while ready:
+            series = ready.popleft()
+            with self.lock:
+                socks = [self.clients.find(name) for name in series.players]
+                if None in socks:
+                    gone = series.players[socks.index(None)]
+                else:
+                    gone = None
+                    match = self.start_match(*socks)
+                    if match is None:
+                        busy = series.players[0] if self.clients[socks[0]]['status'] == 'playing' else series.players[1]
+                        self.parked_series.setdefault(busy, []).append((t, series))
+                        continue
+                    match.tournament, match.series = t, series
+            if gone is not None:
+                series.forfeit(gone)
+                ready.extend(self.series_finished(t, series))
+            else:
+                self.begin_match(match)
+
+    def unpark_series(self, names):
+        """Retry the series parked for players whose match just ended"""
+        with self.lock:
+            parked = [entry for name in names for entry in self.parked_series.pop(name, ())]
+        for t, series in parked:
+            self.start_series(t, [series])
+
+    def series_finished(self, t, series):
+        """Report a decided series; returns the series that can start now"""
+        with self.lock:
+            ready = t.report(series)
+            if t.status != 'finished':
+                return ready
+            entrants = [sock for sock in map(self.clients.find, t.entrants) if sock is not None]
+            msg = {'type': 'tournament_finished', 'tournament': t.summary(),
+                   'standings': t.standings(TOURNAMENT_STANDINGS)}
+            finished = [old for old in self.tournaments.values() if old.status == 'finished']
+            for old in finished[:-MAX_FINISHED_TOURNAMENTS]:
+                del self.tournaments[old.id]
+        logger.info("Tournament %d finished, won by %s", t.id, msg['standings'][0]['name'])
+        self.send_entrants(msg, entrants)
+        return ready
+
+    def send_entrants(self, msg, entrants):
+        """Tournament news, one numbered message per entrant so a resume replays it"""
+        for sock in entrants:
+            try:
+                sock.send_message(msg)
+            except:
+                pass
 
     def handle_connect(self, client_sock, request):
         name = request.get('player_name')
         if not name: return
 
         with self.lock:
-            # Check if name exists
-            if any(info['name'] == name for info in self.clients.values()):
-                 name = f"{name}_{int(time.time())}" # Append timestamp to make unique
-
-            self.clients[client_sock] = {
-                'name': name,
-                'status': 'idle', # idle, playing, waiting
-                'opponent': None,
-                'choice': None
-            }
+            if client_sock in self.clients:
+                return  # Already connected
+            name = self.allocate_name(name)
+            session = client_sock.session = Session(client_sock)
+            self.sessions[session.token] = session
+            info = self.clients.add(session, name)
+            info['roster_deltas'] = 'roster_deltas' in (request.get('features') or ())
             
-            # Send ack
-            response = {'type': 'connect_ack', 'status': 'success', 'name': name}
-            client_sock.send((json.dumps(response) + '\n').encode('utf-8'))
-        
-        self.broadcast_player_list()
+            # Send ack, then the current roster; later changes arrive as deltas
+            response = {'type': 'connect_ack', 'status': 'success', 'name': name, 'session': session.token}
+            codec = negotiate(request.get('protocols'))
+            if request.get('protocols') is not None:
+                response['protocol'] = codec.name
+            client_sock.send_message(response)
+            # Everything after the ack uses the negotiated format
+            client_sock.set_protocol(codec)
+            session.send_message(self.presence.snapshot())
+        self.send_chat_history(session, 'lobby', self.lobby_chat)
+
+    def handle_resume(self, client_sock, request):
+        """Rebind a dropped session to this connection: {'session': token, 'last_seq': n}.
+
+        resume_ack is followed by the messages numbered after last_seq. If
+        some of those are gone from the replay buffer the ack says
+        'complete': false and the client rebuilds its screen from the ack's
+        'status' and 'match' instead. Either way a fresh roster follows.
+        """
+        with self.lock:
+            session = self.sessions.get(request.get('session'))
+            info = self.clients.get(session) if session is not None else None
+            if info is None or client_sock.session is not None or client_sock in self.clients:
+                session = None
+            else:
+                if session.expiry is not None:
+                    session.expiry.cancel()
+                    session.expiry = None
+                old = session.conn
+                info['roster_deltas'] = 'roster_deltas' in (request.get('features') or ())
+                match = info['match']
+                with session.lock:
+                    seq, backlog, complete = session.missed(request.get('last_seq'))
+                    response = {'type': 'resume_ack', 'name': info['name'], 'session': session.token, 'seq': seq,
+                                'complete': complete, 'status': info['status']}
+                    if match is not None and match.active:
+                        response['match'] = {'opponent': match.names[match.other(session)], 'mode': 'pvp'}
+                    codec = negotiate(request.get('protocols'))
+                    if request.get('protocols') is not None:
+                        response['protocol'] = codec.name
+                    client_sock.send_message(response)
+                    client_sock.set_protocol(codec)
+                    client_sock.session = session
+                    session.conn = client_sock
+                    for msg in backlog:
+                        client_sock.send_message(msg)
+                    session.send_message(self.presence.snapshot())
+        if session is None:
+            if self.metrics is not None:
+                self.resumes.labels('failed').inc()
+            client_sock.send_message({'type': 'resume_failed'})
+            return
+        if self.metrics is not None:
+            self.resumes.labels('complete' if complete else 'resynced').inc()
+        self.send_chat_history(session, 'lobby', self.lobby_chat)
+        logger.debug("Session of %s resumed, %d messages replayed", info['name'], len(backlog))
+        self.notify_opponent(session, {'type': 'opponent_back'})
+        if old is not None:
+            # The old connection has not noticed it is dead yet
+            old.abort()
+
+    def connection_closed(self, conn):
+        """A client connection went away. Its player, if any, is kept for
+        session_grace seconds so it can resume; without a grace period it
+        is removed at once."""
+        session = conn.session
+        with self.lock:
+            if session is None or not session.detach(conn):
+                hold = False  # Never connected, or already resumed on another connection
+            else:
+                hold = self.session_grace > 0 and session in self.clients
+                if hold:
+                    session.expiry = self.timers.schedule(self.session_grace, self.expire_session, session)
+        if session is not None and not hold and session.conn is None:
+            self.disconnect_client(session)
+        elif hold:
+            self.notify_opponent(session, {'type': 'opponent_away', 'grace': self.session_grace})
+        try:
+            conn.close()
+        except:
+            pass
+
+    def notify_opponent(self, sock, msg):
+        match = self.player_match(sock)
+        if match is not None and match.active:
+            try:
+                match.other(sock).send_message(msg)
+            except:
+                pass
+
+    def expire_session(self, session):
+        with self.lock:
+            if session.conn is not None or session.expiry is None:
+                return  # Resumed meanwhile
+            session.expiry = None
+        logger.debug("Session %s expired", session.token[:6])
+        self.disconnect_client(session)
 
     def handle_challenge(self, challenger_sock, request):
         target_name = request.get('target_name')
         challenger_name = self.clients[challenger_sock]['name']
         
-        target_sock = None
         with self.lock:
-            for sock, info in self.clients.items():
-                if info['name'] == target_name and info['status'] == 'idle':
-                    target_sock = sock
-                    break
+            target_sock = self.find_player(target_name, status='idle')
         
         if target_sock:
             msg = {
                 'type': 'challenge_request',
                 'challenger': challenger_name
             }
-            target_sock.send((json.dumps(msg) + '\n').encode('utf-8'))
+            target_sock.send_message(msg)
         else:
-            challenger_sock.send((json.dumps({'type': 'error', 'message': 'Player not available'}) + '\n').encode('utf-8'))
+            challenger_sock.send_message({'type': 'error', 'message': 'Player not available'})
 
     def handle_accept_challenge(self, target_sock, request):
         challenger_name = request.get('challenger')
         accepted = request.get('accept')
         
-        challenger_sock = None
-        with self.lock:
-            for sock, info in self.clients.items():
-                if info['name'] == challenger_name:
-                    challenger_sock = sock
-                    break
-            
-            if accepted and challenger_sock and self.clients[challenger_sock]['status'] == 'idle':
-                # Start game
-                self.clients[target_sock]['status'] = 'playing'
-                self.clients[target_sock]['opponent'] = challenger_sock
-                self.clients[target_sock]['choice'] = None
-                
-                self.clients[challenger_sock]['status'] = 'playing'
-                self.clients[challenger_sock]['opponent'] = target_sock
-                self.clients[challenger_sock]['choice'] = None
-                
-                # Notify both
-                msg_target = {'type': 'game_start', 'opponent': challenger_name, 'mode': 'pvp'}
-                target_sock.send((json.dumps(msg_target) + '\n').encode('utf-8'))
-                
-                msg_challenger = {'type': 'game_start', 'opponent': self.clients[target_sock]['name'], 'mode': 'pvp'}
-                challenger_sock.send((json.dumps(msg_challenger) + '\n').encode('utf-8'))
-                
-                self.broadcast_player_list()
-            elif challenger_sock:
-                # Rejected
-                challenger_sock.send((json.dumps({'type': 'challenge_rejected', 'opponent': self.clients[target_sock]['name']}) + '\n').encode('utf-8'))
+        challenger_sock = self.find_player(challenger_name)
+        if not challenger_sock:
+            return
+        target_name = self.clients[target_sock]['name']
+        match = self.start_match(target_sock, challenger_sock) if accepted else None
+        if match is None:
+            # Rejected, or the challenger got into another match meanwhile
+            challenger_sock.send_message({'type': 'challenge_rejected', 'opponent': target_name})
+            return
+
+        # Notify both
+        self.begin_match(match)
+
+    def valid_choice(self, client_sock, choice):
+        """Whether choice is a move, after telling the client if not: rounds are recorded and ranked"""
+        if choice in CHOICES:
+            return True
+        client_sock.send_message({'type': 'error', 'message': f"choice must be one of {', '.join(CHOICES)}"})
+        return False
 
     def handle_play(self, client_sock, request):
         choice = request.get('choice')
-        print(f"[PLAY] Request received: choice={choice}", flush=True)
-        player_name = ""
-        opponent_name = ""
+        play_log.debug("Request received: choice=%s", choice)
+        if not self.valid_choice(client_sock, choice):
+            return
         
-        with self.lock:
-            if client_sock not in self.clients: 
-                print(f"ERROR: Client socket not in clients dict", flush=True)
+        # Only this match's lock: plays in other matches never wait on us
+        match = self.player_match(client_sock)
+        if match is None:
+            play_log.warning("Player is not in a match")
+            return
+        
+        with match.lock:
+            if not match.active:
+                play_log.warning("Match already over")
                 return
+            match.choices[client_sock] = choice
+            opponent_sock = match.other(client_sock)
+            opponent_choice = match.choices[opponent_sock]
             
-            player_name = self.clients[client_sock]['name']
-            self.clients[client_sock]['choice'] = choice
-            opponent_sock = self.clients[client_sock]['opponent']
+            play_log.debug("%s chose: %s, %s's current choice: %s", match.names[client_sock], choice,
+                           match.names[opponent_sock], opponent_choice)
             
-            print(f"[PLAY] {player_name} chose: {choice}, Opponent socket: {opponent_sock is not None}", flush=True)
-            
-            if opponent_sock and opponent_sock in self.clients:
-                opponent_name = self.clients[opponent_sock]['name']
-                opponent_choice = self.clients[opponent_sock]['choice']
-                
-                print(f"[PLAY] {opponent_name}'s current choice: {opponent_choice}", flush=True)
-                
-                if opponent_choice:
-                    # Both played - determine winner from current player's perspective
-                    result_client = self.determine_winner(choice, opponent_choice)
-                    # Determine winner from opponent's perspective
-                    result_opponent = self.determine_winner(opponent_choice, choice)
-                    
-                    print(f"[RESULT] {player_name}({choice}) vs {opponent_name}({opponent_choice}) - Sending results", flush=True)
-                    
-                    # Send results to both players
-                    try:
-                        client_sock.send((json.dumps({
-                            'type': 'game_result',
-                            'my_choice': choice,
-                            'opponent_choice': opponent_choice,
-                            'result': result_client
-                        }) + '\n').encode('utf-8'))
-                        print(f"[RESULT] Sent to {player_name}", flush=True)
-                    except Exception as e:
-                        print(f"[ERROR] Failed to send result to {player_name}: {e}", flush=True)
-                    
-                    try:
-                        opponent_sock.send((json.dumps({
-                            'type': 'game_result',
-                            'my_choice': opponent_choice,
-                            'opponent_choice': choice,
-                            'result': result_opponent
-                        }) + '\n').encode('utf-8'))
-                        print(f"[RESULT] Sent to {opponent_name}", flush=True)
-                    except Exception as e:
-                        print(f"[ERROR] Failed to send result to {opponent_name}: {e}", flush=True)
-                    
-                    # Reset choices for next round
-                    self.clients[client_sock]['choice'] = None
-                    self.clients[opponent_sock]['choice'] = None
-                else:
-                    # Opponent hasn't chosen yet - notify opponent that this player has chosen
-                    print(f"[PLAY] Waiting for {opponent_name}, notifying them", flush=True)
-                    try:
-                        opponent_sock.send((json.dumps({'type': 'opponent_choosed'}) + '\n').encode('utf-8'))
-                    except Exception as e:
-                        print(f"[ERROR] Failed to notify opponent: {e}", flush=True)
+            decided = False
+            if opponent_choice:
+                decided = self.finish_round(match)
             else:
-                print(f"[ERROR] Opponent socket invalid or not in clients", flush=True)
+                # Opponent hasn't chosen yet - notify opponent that this player has chosen
+                play_log.debug("Waiting for %s, notifying them", match.names[opponent_sock])
+                try:
+                    opponent_sock.send_message({'type': 'opponent_choosed'})
+                except Exception as e:
+                    play_log.error("Failed to notify opponent: %s", e)
+                if match.audience is not None:
+                    # Not which choice, just that one was made
+                    name = match.names[client_sock]
+                    match.audience.publish({'event': 'chose', 'player': name}, chosen=[name])
+        if decided:
+            self.end_match(match)  # Tournament series over
+
+    def finish_round(self, match, timeout=False, forfeit=None):
+        """Send both players their game_result and start the next round's clock.
+
+        Called with match.lock held. forfeit is the player who ran out of
+        time under the forfeit policy: it loses the round and has no choice
+        to show. Returns True when the round decided the match's tournament
+        series; the caller ends the match once it has let go of the lock.
+        """
+        client_sock, opponent_sock = match.players
+        player_name = match.names[client_sock]
+        opponent_name = match.names[opponent_sock]
+        choice = match.choices[client_sock]
+        opponent_choice = match.choices[opponent_sock]
+        if forfeit is None:
+            # Determine winner from each player's perspective
+            result_client = self.determine_winner(choice, opponent_choice)
+            result_opponent = self.determine_winner(opponent_choice, choice)
+        else:
+            result_client = 'lose' if forfeit is client_sock else 'win'
+            result_opponent = 'win' if forfeit is client_sock else 'lose'
+        winner = client_sock if result_client == 'win' else opponent_sock if result_opponent == 'win' else None
+        series = match.series
+        decided = series is not None and series.record(match.names[winner] if winner is not None else None)
+
+        play_log.debug("Result: %s(%s) vs %s(%s) - sending results",
+                       player_name, choice, opponent_name, opponent_choice)
+
+        # Send results to both players
+        for sock, name, mine, theirs, result in (
+                (client_sock, player_name, choice, opponent_choice, result_client),
+                (opponent_sock, opponent_name, opponent_choice, choice, result_opponent)):
+            msg = {'type': 'game_result', 'my_choice': mine, 'opponent_choice': theirs, 'result': result}
+            if timeout:
+                msg['timeout'] = True
+            if series is not None:
+                msg['series'] = [series.wins[name], series.wins[series.other(name)]]
+            try:
+                sock.send_message(msg)
+                play_log.debug("Result sent to %s", name)
+            except Exception as e:
+                play_log.error("Failed to send result to %s: %s", name, e)
+
+        # Persisted off the send path: this only queues the record
+        self.history.record_round(player_name, opponent_name, choice, opponent_choice, result_client)
+
+        # Reset choices for next round
+        match.scored(winner)
+        match.next_round()
+        if match.audience is not None:
+            summary = match.summary()
+            match.audience.publish({'event': 'result', 'choices': [choice, opponent_choice],
+                                    'winner': player_name if result_client == 'win' else
+                                    opponent_name if result_opponent == 'win' else None,
+                                    'timeout': timeout, 'score': summary['score'], 'draws': summary['draws']},
+                                   **summary)
+        if decided:
+            return True
+        self.start_round_timer(match)
+        return False
 
     def handle_play_bot(self, client_sock, request):
         choice = request.get('choice')
-        print(f"[PLAY BOT] Request received: choice={choice}", flush=True)
-        import random
-        server_choice = random.choice(self.game_choices)
+        strategy = request.get('strategy', 'random')
+        bot_log.debug("Request received: choice=%s, strategy=%s", choice, strategy)
+        if not self.valid_choice(client_sock, choice):
+            return
+        info = self.clients.get(client_sock)
+        if info is None:
+            session = BotSession()  # Not connected: nothing to remember
+        else:
+            session = info.get('bot_session')
+            if session is None:
+                session = info['bot_session'] = BotSession()
+        try:
+            server_choice = self.bot.play_round(session, strategy, choice)
+        except ValueError as e:
+            client_sock.send_message({'type': 'error', 'message': str(e)})
+            return
         result = self.determine_winner(choice, server_choice)
         
         response = {
@@ -281,10 +1357,29 @@ class RPSServer:
             'mode': 'bot'
         }
         try:
-            client_sock.send((json.dumps(response) + '\n').encode('utf-8'))
-            print(f"[PLAY BOT] Sent result: {result} ({choice} vs {server_choice})", flush=True)
+            client_sock.send_message(response)
+            bot_log.debug("Sent result: %s (%s vs %s)", result, choice, server_choice)
+        except Exception as e:
+            bot_log.error("Failed to send bot result: %s", e)
+        if info is not None:
+            self.history.record_round(info['name'], None, choice, server_choice, result)
+
+    def handle_play_bot_batch(self, client_sock, request):
+        """Many rounds against the bot in one request, e.g. {'choices': 'rpsrr...'}"""
+        choices = request.get('choices')
+        try:
+            if not choices or len(choices) > MAX_BATCH:
+                raise ValueError(f"a batch needs 1 to {MAX_BATCH} choices")
+            response = self.bot.play_batch(choices)
+        except (TypeError, ValueError) as e:
+            client_sock.send_message({'type': 'error', 'message': f"Invalid batch: {e}"})
+            return
+        bot_log.debug("Batch of %d rounds: %d wins, %d losses, %d draws",
+                      len(choices), response['wins'], response['losses'], response['draws'])
+        try:
+            client_sock.send_message(response)
         except Exception as e:
-            print(f"[ERROR] Failed to send bot result: {e}", flush=True)
+            bot_log.error("Failed to send bot batch result: %s", e)
 
     def determine_winner(self, p1, p2):
         if p1 == p2: return 'draw'
@@ -293,32 +1388,310 @@ class RPSServer:
         return 'lose'
 
     def disconnect_client(self, sock):
+        dropped = []
         with self.lock:
-            if sock in self.clients:
-                info = self.clients[sock]
-                opponent_sock = info['opponent']
-                
-                if opponent_sock and opponent_sock in self.clients:
-                    # Notify opponent
-                    try:
-                        opponent_sock.send((json.dumps({'type': 'opponent_left'}) + '\n').encode('utf-8'))
-                        self.clients[opponent_sock]['status'] = 'idle'
-                        self.clients[opponent_sock]['opponent'] = None
-                    except:
-                        pass
-                
-                del self.clients[sock]
+            self.matchmaker.leave(sock)
+            info = self.clients.remove(sock)
+            if info is not None:
+                self.stop_watching(info, sock)
+                for t in list(self.tournaments.values()):
+                    if t.status == 'open' and t.owner == info['name']:
+                        # Nobody left to start it
+                        del self.tournaments[t.id]
+                        dropped += [(t.id, entrant) for entrant in map(self.clients.find, t.entrants)
+                                    if entrant is not None]
+                    else:
+                        t.remove(info['name'])  # Only while open; later on its series are forfeited
+            if isinstance(sock, Session):
+                self.sessions.pop(sock.token, None)
+                if sock.expiry is not None:
+                    sock.expiry.cancel()
+                    sock.expiry = None
+        for tournament_id, entrant in dropped:
+            try:
+                entrant.send_message({'type': 'tournament_left', 'id': tournament_id})
+            except:
+                pass
+        if info is not None and info.get('match') is not None:
+            # Removed first, so nobody can pair with it while the match ends
+            self.end_match(info['match'], leaver=sock)
         
-        self.broadcast_player_list()
         try:
             sock.close()
         except:
             pass
 
+    def hand_over(self, successor):
+        """Freeze and give everything to a successor process (see handoff.py), then exit.
+
+        Runs on the handoff thread; returns only if the successor did not
+        take over, with the server carrying on as before.
+        """
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.hand_over_async(successor), self.loop).result()
+            return
+        started = time.perf_counter()
+        gate = self.handoff.gate
+        try:
+            # Every reader thread and the accept loop, parked between reads
+            if not gate.freeze(lambda: len(self.connections) + 1):
+                logger.warning("Handoff abandoned: not every connection thread stopped in time")
+                return
+            with self.timers.gate:
+                conns = [conn for conn in list(self.connections) if not conn.closed]
+                deadline = time.monotonic() + DRAIN_TIMEOUT
+                while any(conn.queue_depth for conn in conns) and time.monotonic() < deadline:
+                    time.sleep(HANDOFF_POLL)
+                self.finish_handoff(successor, conns, started)
+        finally:
+            gate.thaw()
+
+    async def hand_over_async(self, successor):
+        started = time.perf_counter()
+        # Stop accepting; a duplicate keeps the listening socket and its backlog alive
+        listener = self.server_socket.dup()
+        self.aio_server.close()
+        self.server_socket = listener
+        conns = [conn for conn in list(self.connections) if not conn.closing]
+        for conn in conns:
+            conn.transport.pause_reading()
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while any(conn.queue_depth for conn in conns) and time.monotonic() < deadline:
+            await asyncio.sleep(HANDOFF_POLL)
+        # From here to the exit the loop runs nothing else: no timer fires, nothing is sent
+        self.finish_handoff(successor, conns, started)
+        for conn in conns:
+            if not conn.closing and not conn.transport.is_closing():
+                conn.transport.resume_reading()
+        self.aio_server = await self.loop.create_server(lambda: AsyncConnection(self), sock=self.server_socket)
+
+    def finish_handoff(self, successor, conns, started):
+        """Send the frozen server to the successor and exit; returns if it does not take over.
+
+        A connection that closed or still has bytes of ours queued is not
+        handed over: its player goes over detached and resumes.
+        """
+        conns = [conn for conn in conns if conn in self.connections and not conn.queue_depth and
+                 not (conn.closing if self.loop is not None else conn.closed)]
+        self.history.close()  # A successor on the same history dir reads it back
+        state = self.export_state(conns)
+        frozen = time.perf_counter()
+        try:
+            size = successor.send([self.server_socket.fileno()] + [conn.fileno() for conn in conns], state)
+            ready = successor.ready()
+        except OSError as e:
+            logger.warning("Handoff failed: %s", e)
+            ready = False
+        if ready:
+            logger.info("Handed over %d connections, %d sessions (%d bytes of state) after %.1f ms frozen; "
+                        "successor ready after %.1f ms", len(conns), len(state['sessions']), size,
+                        (frozen - started) * 1000, (time.perf_counter() - started) * 1000)
+            if self.capture is not None:
+                self.capture.shutdown()
+            log.stop_logging()
+            os._exit(0)  # Not a socket closed or shut down on the way out: they are the successor's now
+        logger.warning("The successor did not take over, carrying on")
+        if self.history_dir is not None:
+            self.history = HistoryStore(self.history_dir)
+
+    def export_state(self, conns):
+        """What a successor process needs to carry on (handoff.py); call with the server frozen.
+
+        conns are the connections handed over, in the order of their
+        sockets. Sessions, matches and tournament series refer to each
+        other by token and index; tournaments, bot sessions and chat
+        messages go over as they are.
+        """
+        with self.lock:
+            matches = {}  # {Match: index}
+            for info in self.clients.values():
+                match = info['match']
+                if match is not None and match.active:
+                    matches.setdefault(match, len(matches))
+            sessions = [{'token': session.token, 'seq': session.seq, 'buffer': list(session.buffer),
+                         'name': info['name'], 'status': info['status'],
+                         'roster_deltas': info.get('roster_deltas', False), 'bot_session': info.get('bot_session'),
+                         'watching': matches.get(info.get('watching')), 'online': session.conn is not None}
+                        for session, info in self.clients.items()]
+            match_state = []
+            for match in matches:
+                a, b = match.players
+                match_state.append({
+                    'players': [a.token, b.token], 'choices': [match.choices[a], match.choices[b]],
+                    'round': match.round, 'wins': [match.wins[a], match.wins[b]], 'draws': match.draws,
+                    'tournament': match.tournament, 'series': match.series,
+                    'audience_seq': match.audience.seq if match.audience is not None else None,
+                    'chat': match.chat.export() if match.chat is not None else None})
+            connections = [{'codec': conn.codec.name, 'buffered': conn.decoder.remaining(),
+                            'session': conn.session.token if conn.session is not None and conn.session.conn is conn
+                            else None} for conn in conns]
+            with self.presence.lock:
+                presence = (self.presence.version, dict(self.presence.published))
+            return {'connections': connections, 'sessions': sessions, 'matches': match_state,
+                    'queue': [(ticket.sock.token, ticket.rating, ticket.joined)
+                              for ticket in self.matchmaker.tickets.values()],
+                    'tournaments': self.tournaments, 'next_tournament_id': self.next_tournament_id,
+                    'parked_series': self.parked_series, 'presence': presence,
+                    'lobby_chat': self.lobby_chat.export(),
+                    'dm_chats': [(pair, channel.export()) for pair, channel in self.dm_chats.items()],
+                    'history': self.history.export()}
+
+    async def adopt_async(self, taken):
+        """Wrap the sockets a predecessor handed over in transports and take over its state"""
+        conns = [AsyncConnection(self, handed_over=True) for _ in taken.sockets]
+        await asyncio.gather(*[self.loop.connect_accepted_socket(lambda conn=conn: conn, sock)
+                               for conn, sock in zip(conns, taken.sockets)])
+        self.adopt_state(taken.state, conns)
+        for conn in conns:
+            if not conn.closing and not conn.transport.is_closing():
+                conn.transport.resume_reading()
+
+    def adopt_state(self, state, conns):
+        """Carry on from a predecessor's export_state; conns wrap the sockets it handed over, in order.
+
+        Round clocks start over, and so does the grace period of a player
+        who was not handed over on a live connection.
+        """
+        # The predecessor wrote out its last rounds and closed its files before handing over
+        self.history = HistoryStore(self.history_dir)
+        if self.history_dir is None and state['history'] is not None:
+            self.history.adopt(state['history'])
+        with self.presence.lock:
+            # Roster changes it had not sent yet go out as the players are added back
+            self.presence.version, self.presence.published = state['presence']
+        matches, paired, away = [], [], []
+        with self.lock:
+            sessions = {}
+            for entry in state['sessions']:
+                session = sessions[entry['token']] = self.sessions[entry['token']] = Session(None, entry['token'])
+                session.seq = entry['seq']
+                session.buffer.extend(entry['buffer'])
+                info = self.clients.add(session, entry['name'], entry['status'])
+                info['roster_deltas'] = entry['roster_deltas']
+                if entry['bot_session'] is not None:
+                    info['bot_session'] = entry['bot_session']
+            for conn, entry in zip(conns, state['connections']):
+                conn.set_protocol(CODECS[entry['codec']])
+                conn.decoder.feed(entry['buffered'])
+                session = sessions.get(entry['session'])
+                if session is not None:
+                    conn.session, session.conn = session, conn
+            for entry in state['matches']:
+                a, b = (sessions[token] for token in entry['players'])
+                match = Match(a, self.clients[a]['name'], b, self.clients[b]['name'])
+                match.choices = dict(zip(match.players, entry['choices']))
+                match.wins = dict(zip(match.players, entry['wins']))
+                match.round, match.draws = entry['round'], entry['draws']
+                match.tournament, match.series = entry['tournament'], entry['series']
+                if entry['audience_seq'] is not None:
+                    match.audience = Audience(self, match.summary(), FANOUT_BATCH if self.mode == 'asyncio' else None)
+                    match.audience.seq = entry['audience_seq']
+                if entry['chat'] is not None:
+                    self.match_chat(match).adopt(*entry['chat'])
+                for sock in match.players:
+                    self.clients[sock]['match'] = match
+                matches.append(match)
+            for entry in state['sessions']:
+                session = sessions[entry['token']]
+                if entry['watching'] is not None:
+                    match = matches[entry['watching']]
+                    match.audience.subscribe(session)  # Resynced with a fresh spectate_state
+                    self.clients[session]['watching'] = match
+                if session.conn is None:
+                    session.expiry = self.timers.schedule(self.session_grace, self.expire_session, session)
+                    if entry['online']:
+                        away.append(session)
+            for token, rating, joined in state['queue']:
+                session = sessions[token]
+                ticket, opponent = self.matchmaker.join(session, self.clients[session]['name'], rating, joined)
+                if opponent is not None:
+                    paired.append(self.start_match(session, opponent.sock))
+            if len(self.matchmaker):
+                self.queue_timer = self.timers.schedule(SWEEP_INTERVAL, self.sweep_queue)
+            self.tournaments = state['tournaments']
+            self.next_tournament_id = state['next_tournament_id']
+            self.parked_series = state['parked_series']
+            for pair, messages in state['dm_chats']:
+                self.dm_chat(pair).adopt(*messages)
+        self.lobby_chat.adopt(*state['lobby_chat'])
+        for match in matches:
+            with match.lock:
+                self.start_round_timer(match)
+        for match in paired:
+            if match is not None:
+                self.begin_match(match, queued=True)
+        for session in away:
+            self.notify_opponent(session, {'type': 'opponent_away', 'grace': self.session_grace})
+
     def shutdown(self):
         if self.server_socket:
             self.server_socket.close()
+        self.history.close()
+        if self.capture is not None:
+            self.capture.shutdown()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rock-Paper-Scissors game server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--mode', choices=SERVER_MODES, default='threaded',
+                        help="threaded: one thread per client, asyncio: single event loop")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="run N worker processes sharing the port (see cluster.py)")
+    parser.add_argument('--presence-window', type=float, default=0.1,
+                        help="seconds to coalesce roster changes before broadcasting them")
+    parser.add_argument('--chat-window', type=float, default=CHAT_WINDOW,
+                        help="seconds a chat channel collects messages before sending them out together")
+    parser.add_argument('--outbound-high-water', type=int, default=HIGH_WATER,
+                        help="queued bytes per client above which roster updates are skipped")
+    parser.add_argument('--outbound-limit', type=int, default=HARD_LIMIT,
+                        help="queued bytes per client above which it is disconnected")
+    parser.add_argument('--admin-port', type=int, default=None,
+                        help="serve /metrics and /profile on 127.0.0.1:PORT (workers use PORT + shard)")
+    parser.add_argument('--history-dir', default=None,
+                        help="keep round history and the leaderboard in DIR across restarts "
+                             "(workers use DIR/shardN); default: in memory only")
+    parser.add_argument('--session-grace', type=float, default=SESSION_GRACE,
+                        help="seconds a dropped player's session and match are kept for a resume (0: none)")
+    parser.add_argument('--round-timeout', type=float, default=ROUND_TIMEOUT,
+                        help="seconds a PvP round may last before the server resolves it (0: never)")
+    parser.add_argument('--accept-rate', type=float, default=ACCEPT_RATE,
+                        help="new connections per second allowed from one IP address (0: no limit)")
+    parser.add_argument('--no-rate-limits', dest='rate_limits', action='store_false',
+                        help="no per-connection request limits or accept cap, e.g. for load tests")
+    parser.add_argument('--capture', metavar='FILE', default=None,
+                        help="record every inbound frame to FILE for replay.py (workers use FILE.shardN)")
+    parser.add_argument('--handoff', metavar='PATH', default=None,
+                        help="hot restart: take over from a server running with the same PATH, if any, "
+                             "then wait on the Unix socket PATH to hand over to the next")
+    parser.add_argument('--round-timeout-policy', choices=ROUND_TIMEOUT_POLICIES, default='pick',
+                        help="pick: play a random move for a late player, forfeit: the late player loses")
+    log.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.handoff and args.workers > 1:
+        parser.error("--handoff works with a single server process, not --workers")
+    return args
+
 
 if __name__ == "__main__":
-    server = RPSServer()
-    server.start()
+    args = parse_args()
+    log.setup_logging(args.log_level, args.log_sample)
+    if args.workers > 1:
+        import cluster
+        cluster.run_cluster(args.host, args.port, mode=args.mode, workers=args.workers,
+                            log_level=args.log_level, log_sample=args.log_sample,
+                            presence_window=args.presence_window, high_water=args.outbound_high_water,
+                            hard_limit=args.outbound_limit, round_timeout=args.round_timeout,
+                            round_policy=args.round_timeout_policy, admin_port=args.admin_port,
+                            history_dir=args.history_dir, session_grace=args.session_grace,
+                            rate_limits=args.rate_limits, accept_rate=args.accept_rate,
+                            chat_window=args.chat_window, capture=args.capture)
+    else:
+        server = RPSServer(args.host, args.port, mode=args.mode, presence_window=args.presence_window,
+                           high_water=args.outbound_high_water, hard_limit=args.outbound_limit,
+                           round_timeout=args.round_timeout, round_policy=args.round_timeout_policy,
+                           admin_port=args.admin_port, history_dir=args.history_dir,
+                           session_grace=args.session_grace, rate_limits=args.rate_limits,
+                           accept_rate=args.accept_rate, chat_window=args.chat_window, capture=args.capture,
+                           handoff=args.handoff)
+        server.start()
@@ -0,0 +1,94 @@
+"""Player sessions that outlive a dropped connection.
+
+A Session is what the server registers for a connected player (it is
+the key in the registry, the match and the matchmaking queue) and it
+behaves like a socket towards the handle_* methods. Underneath it is
+bound to the player's current connection, if any. When the connection
+drops the session is kept for a grace period; a `resume` request
+carrying its token on a new connection rebinds it, and the match, queue
+ticket and roster entry never notice.
+
+Messages sent on a session are numbered (protocol.UNSEQUENCED types
+aside) and the last REPLAY_BUFFER of them are kept, so a resuming client
+that reports the last number it got receives what it missed. If more
+than that went by, it gets its current state instead (see
+RPSServer.handle_resume).
+"""
+import secrets
+import threading
+from collections import deque
+
+from protocol import NDJSON, UNSEQUENCED
+
+# Messages kept per session for replay on resume
+REPLAY_BUFFER = 64
+# Seconds a session whose connection dropped is kept for a resume
+SESSION_GRACE = 30.0
+
+
+class Session:
+    """Socket-like stand-in for a player, bound to at most one live connection.
+
+    lock keeps numbering and sending in the same order, and is held while
+    a resumed connection gets its backlog so nothing new overtakes it.
+    """
+
+    def __init__(self, conn, token=None):
+        self.token = token or secrets.token_urlsafe(16)  # Given when taken over from another process
+        self.conn = conn
+        self.seq = 0  # number of the last sequenced message sent
+        self.buffer = deque(maxlen=REPLAY_BUFFER)  # (seq, msg)
+        self.lock = threading.RLock()
+        self.expiry = None  # Timer ending the grace period while detached
+
+    @property
+    def codec(self):
+        conn = self.conn
+        return conn.codec if conn is not None else NDJSON
+
+    def send_message(self, msg, droppable=False):
+        with self.lock:
+            if msg.get('type') not in UNSEQUENCED:
+                self.seq += 1
+                self.buffer.append((self.seq, msg))
+            conn = self.conn
+            if conn is None:
+                return 0  # Kept for replay if the player comes back
+            try:
+                return conn.send_message(msg, droppable)
+            except ConnectionError:
+                return 0
+
+    def send(self, data, droppable=False):
+        """Pre-encoded broadcast (roster, spectator and chat traffic): not numbered, dropped while detached"""
+        conn = self.conn
+        if conn is None:
+            return 0
+        try:
+            return conn.send(data, droppable)
+        except ConnectionError:
+            return 0
+
+    def detach(self, conn):
+        """Unbind conn; False if it was not the live connection (already replaced by a resume)"""
+        with self.lock:
+            if self.conn is not conn:
+                return False
+            self.conn = None
+            return True
+
+    def missed(self, last_seq):
+        """(seq before the backlog, backlog, complete) for a client that last got last_seq.
+
+        Incomplete when messages after last_seq have already left the
+        buffer: the backlog is then empty and the client must resync.
+        """
+        oldest = self.buffer[0][0] if self.buffer else self.seq + 1
+        if not isinstance(last_seq, int) or last_seq > self.seq or last_seq + 1 < oldest:
+            return self.seq, [], False
+        return last_seq, [msg for seq, msg in self.buffer if seq > last_seq], True
+
+    def close(self):
+        conn = self.conn
+        if conn is not None:
+            conn.close()
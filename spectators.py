@@ -0,0 +1,158 @@
+"""Spectators: one-to-many fanout of a match's events.
+
+Lobby players who send `spectate` join the watched match's Audience.
+Publishing an event (with the match lock held) only numbers it and
+appends it to a pending list; the fanout runs later on the server's own
+thread through call_later, so the players' requests never wait on it.
+Each pass joins everything pending into one bytes object per wire
+format and hands that same object to every spectator as a droppable
+send, so a popular match costs one encode and one queue append per
+spectator, not one serialization per spectator per event.
+
+A spectator whose send was skipped (its outbound queue is past high
+water, or its session is detached) is marked stale. Stale spectators,
+new ones included, get a spectate_state snapshot instead of the events
+on the next pass, retried every RESYNC_INTERVAL while any remain, so
+they never have to notice a gap.
+
+On the event loop one pass reaches at most `batch` spectators before
+yielding; the threaded server runs passes on its timer thread and does
+them in one go.
+"""
+import threading
+
+# Spectators one fanout callback reaches before yielding to the event loop
+FANOUT_BATCH = 25
+# Seconds between snapshot retries for spectators whose sends are being skipped
+RESYNC_INTERVAL = 0.5
+
+
+class Pass:
+    """One fanout pass: the events taken from the pending list and the state after them"""
+
+    __slots__ = ('events', 'state', 'targets', 'position', 'event_data', 'state_data')
+
+    def __init__(self, events, state, targets):
+        self.events = events
+        self.state = state
+        self.targets = targets  # [(sock, stale)]
+        self.position = 0
+        self.event_data = {}  # {codec: bytes}
+        self.state_data = {}
+
+    def encoded(self, codec, stale):
+        """The bytes for a spectator speaking codec, encoded on first use"""
+        cache = self.state_data if stale else self.event_data
+        data = cache.get(codec)
+        if data is None:
+            msgs = [self.state] if stale else self.events
+            data = cache[codec] = b''.join(codec.encode(msg) for msg in msgs)
+        return data
+
+
+class Audience:
+    """The spectators of one match and the events on their way to them"""
+
+    def __init__(self, server, state, batch=None):
+        self.server = server
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # one pass at a time, in order
+        self.state = state  # spectate_state fields as of self.seq
+        self.seq = 0
+        self.spectators = {}  # {sock: False if up to date, True if stale, None if new}
+        self.pending = []
+        self.current = None  # Pass in progress
+        self.flush_scheduled = False
+        self.closed = False
+
+    def __len__(self):
+        return len(self.spectators)
+
+    def subscribe(self, sock):
+        """Add a spectator, who gets a snapshot first; False once the match is over"""
+        with self.lock:
+            if self.closed:
+                return False
+            self.spectators[sock] = None
+            self.schedule_locked(0)
+        return True
+
+    def members(self):
+        with self.lock:
+            return list(self.spectators)
+
+    def unsubscribe(self, sock):
+        with self.lock:
+            return self.spectators.pop(sock, None) is not None
+
+    def publish(self, event, **state):
+        """Queue {'event': ..., **fields} for the spectators and update the
+        snapshot fields; call with the match lock held"""
+        with self.lock:
+            self.seq += 1
+            self.state.update(state)
+            if self.spectators:
+                self.pending.append({'type': 'spectate_update', 'seq': self.seq, **event})
+                self.schedule_locked(0)
+
+    def close(self, **state):
+        """Match over: the last events still go out, then everyone is let go"""
+        with self.lock:
+            self.closed = True
+            self.state.update(state)
+
+    def schedule_locked(self, delay):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.server.call_later(delay, self.flush)
+
+    def flush(self):
+        with self.send_lock:
+            with self.lock:
+                self.flush_scheduled = False
+                if self.current is None:
+                    if not self.pending and all(stale is False for stale in self.spectators.values()):
+                        return
+                    state = {'type': 'spectate_state', 'seq': self.seq, 'spectators': len(self.spectators),
+                             'over': self.closed, **self.state}
+                    self.current = Pass(self.pending, state, list(self.spectators.items()))
+                    self.pending = []
+                current = self.current
+            stale, fresh = self.deliver(current)
+            with self.lock:
+                for sock in stale:
+                    if sock in self.spectators:
+                        self.spectators[sock] = True
+                for sock in fresh:
+                    if sock in self.spectators:
+                        self.spectators[sock] = False
+                if current.position < len(current.targets):
+                    self.schedule_locked(0)
+                    return
+                self.current = None
+                if self.pending or None in self.spectators.values():
+                    self.schedule_locked(0)
+                elif self.closed:
+                    self.spectators.clear()  # The end went out, or was tried once
+                elif True in self.spectators.values():
+                    self.schedule_locked(RESYNC_INTERVAL)
+
+    def deliver(self, current):
+        """Send the pass to its next batch of spectators; returns (skipped, resynced)"""
+        end = len(current.targets) if self.batch is None else min(len(current.targets), current.position + self.batch)
+        stale, fresh = [], []
+        for sock, stale_before in current.targets[current.position:end]:
+            was_stale = stale_before is not False
+            if not was_stale and not current.events:
+                continue  # Resync-only pass
+            try:
+                sent = sock.send(current.encoded(sock.codec, was_stale), droppable=True)
+            except:
+                continue  # Gone: disconnect_client unsubscribes it
+            if not sent:
+                stale.append(sock)
+            elif was_stale:
+                fresh.append(sock)
+        current.position = end
+        return stale, fresh
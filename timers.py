@@ -0,0 +1,120 @@
+"""Hashed timing wheel for the server's deadlines.
+
+All timers share one wheel of SLOTS buckets, each covering `tick`
+seconds. A timer lands in the bucket of its deadline tick, together with
+the number of full revolutions still to wait, so scheduling and
+cancelling are O(1) set operations no matter how many timers are
+pending. The wheel is advanced by a single driver: a thread in threaded
+mode, or a repeating call_later on the event loop in asyncio mode, which
+also runs the callbacks there.
+
+Deadlines are rounded up to the next tick, so a timer never fires early
+but may fire up to one tick late.
+"""
+import math
+import threading
+import time
+
+import log
+
+TICK = 0.05
+SLOTS = 1024
+
+logger = log.get_logger('timers')
+
+
+class Timer:
+    __slots__ = ('wheel', 'slot', 'rounds', 'callback', 'args', 'fired')
+
+    def __init__(self, wheel, callback, args):
+        self.wheel = wheel
+        self.slot = None
+        self.rounds = 0
+        self.callback = callback
+        self.args = args
+        self.fired = False
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+
+class TimerWheel:
+    def __init__(self, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        self.size = slots
+        self.slots = [set() for _ in range(slots)]
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        self.current = 0  # last tick processed
+        self.pending = 0
+        self.gate = threading.Lock()  # held by the driver thread while it fires a tick's timers
+
+    def __len__(self):
+        return self.pending
+
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) after delay seconds; returns a cancellable Timer"""
+        timer = Timer(self, callback, args)
+        deadline = math.ceil((time.monotonic() - self.origin + delay) / self.tick)
+        with self.lock:
+            # Counted from the last processed tick, so a lagging driver never fires early
+            ticks = max(1, deadline - self.current)
+            timer.slot = (self.current + ticks) % self.size
+            timer.rounds = (ticks - 1) // self.size
+            self.slots[timer.slot].add(timer)
+            self.pending += 1
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            if timer.slot is not None:
+                self.slots[timer.slot].discard(timer)
+                timer.slot = None
+                self.pending -= 1
+
+    def advance(self, now=None):
+        """Move the wheel up to now and return the timers that came due"""
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self.origin) // self.tick)
+        due = []
+        with self.lock:
+            while self.current < target:
+                self.current += 1
+                bucket = self.slots[self.current % self.size]
+                if not bucket:
+                    continue
+                for timer in list(bucket):
+                    if timer.rounds:
+                        timer.rounds -= 1
+                    else:
+                        bucket.discard(timer)
+                        timer.slot = None
+                        timer.fired = True
+                        due.append(timer)
+            self.pending -= len(due)
+        return due
+
+    def fire_due(self):
+        for timer in self.advance():
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error("Timer callback %r failed: %s", timer.callback, e)
+
+    def start(self, loop=None):
+        """Drive the wheel from the event loop if given, else from a thread"""
+        if loop is not None:
+            def on_tick():
+                self.fire_due()
+                loop.call_later(self.tick, on_tick)
+            loop.call_soon_threadsafe(on_tick)
+        else:
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.tick)
+            # Whoever needs the timers to stand still (a handoff) holds the gate meanwhile
+            with self.gate:
+                self.fire_due()
@@ -0,0 +1,367 @@
+"""Tournaments: single elimination, Swiss and round robin, best-of-N series.
+
+The engine only knows player names and series results; the server
+(RPSServer.start_series) plays each series as an ordinary Match and
+reports who won. A series is best_of rounds: the first player to win
+best_of // 2 + 1 rounds takes it, and drawn rounds do not count.
+
+Series are handed out as soon as they can be played, not a whole stage
+at a time, so many run at once:
+
+single_elimination
+    Seeded bracket padded with byes to a power of two (seed 1 meets the
+    lowest seed, and seeds 1 and 2 can only meet in the final). A
+    bracket slot is played as soon as both series feeding it are done.
+swiss
+    `rounds` rounds (default ceil(log2(n))). Each round pairs players
+    with equal points where possible, avoiding rematches; an odd player
+    out gets a bye worth a win. A round starts when the previous one is
+    complete. Ties are broken by Buchholz (the opponents' points).
+round_robin
+    Everyone meets everyone once, in circle-method order. A player's
+    next series starts once both players are done with their previous
+    ones.
+
+Not thread-safe: the server calls a Tournament with its lock held.
+"""
+import math
+from collections import deque
+
+FORMATS = ('single_elimination', 'swiss', 'round_robin')
+BEST_OF = (1, 3, 5, 7)
+MAX_ENTRANTS = 8192
+# Entrants for round robin, which plays n * (n - 1) / 2 series
+MAX_ROUND_ROBIN = 64
+# Longest tournament name, which goes out with every summary
+MAX_NAME = 64
+
+
+class Series:
+    """One best-of-N pairing of two players"""
+
+    __slots__ = ('id', 'players', 'best_of', 'stage', 'wins', 'winner', 'slot')
+
+    def __init__(self, series_id, a, b, best_of, stage, slot=None):
+        self.id = series_id
+        self.players = (a, b)
+        self.best_of = best_of
+        self.stage = stage  # bracket round or Swiss round, from 0
+        self.wins = {a: 0, b: 0}
+        self.winner = None
+        self.slot = slot  # bracket position, single elimination only
+
+    @property
+    def loser(self):
+        if self.winner is None:
+            return None
+        a, b = self.players
+        return b if self.winner == a else a
+
+    def other(self, name):
+        a, b = self.players
+        return b if name == a else a
+
+    def record(self, winner):
+        """Count one round won by winner (None: a draw); True once the series is decided"""
+        if winner is not None and self.winner is None:
+            self.wins[winner] += 1
+            if self.wins[winner] > self.best_of // 2:
+                self.winner = winner
+        return self.winner is not None
+
+    def forfeit(self, loser):
+        """Decide the series against loser (disconnected, or abandoned by both)"""
+        if self.winner is None:
+            self.winner = self.other(loser)
+
+
+class Tournament:
+    """Entrants register while it is 'open'; start() seeds it and returns the first series"""
+
+    def __init__(self, tournament_id, fmt, best_of=3, rounds=None, name=None, owner=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        if best_of not in BEST_OF:
+            raise ValueError(f"best_of must be one of {', '.join(map(str, BEST_OF))}")
+        if rounds is not None and (fmt != 'swiss' or not isinstance(rounds, int) or rounds < 1):
+            raise ValueError("rounds is a positive number, for swiss only")
+        if name is not None:
+            if not isinstance(name, str) or not name.strip() or len(name.strip()) > MAX_NAME:
+                raise ValueError(f"name is 1 to {MAX_NAME} characters")
+            name = name.strip()
+        self.id = tournament_id
+        self.format = fmt
+        self.best_of = best_of
+        self.rounds = rounds
+        self.name = name or f"{fmt.replace('_', ' ').title()} #{tournament_id}"
+        self.owner = owner
+        self.status = 'open'
+        self.entrants = []  # seed order
+        self.stage = 0
+        self.next_id = 0
+        self.live = {}  # {series id: Series} handed out and not reported yet
+        self.played = 0
+        self.points = {}  # {name: series won}
+        self.rounds_won = {}  # {name: rounds won across all series}
+        self.opponents = {}  # {name: [names met]}
+        self.seed = {}  # {name: 0 for the first entrant, ...}, from the start
+
+    def __len__(self):
+        return len(self.entrants)
+
+    def add(self, name):
+        if self.status != 'open':
+            raise ValueError("the tournament has already started")
+        limit = MAX_ROUND_ROBIN if self.format == 'round_robin' else MAX_ENTRANTS
+        if len(self.entrants) >= limit:
+            raise ValueError(f"the tournament is full ({limit} players)")
+        if name not in self.points:
+            self.entrants.append(name)
+            self.points[name] = 0
+            self.rounds_won[name] = 0
+            self.opponents[name] = []
+
+    def remove(self, name):
+        """Withdraw before the start; False if name was not registered"""
+        if self.status != 'open' or name not in self.points:
+            return False
+        self.entrants.remove(name)
+        del self.points[name]
+        del self.rounds_won[name]
+        del self.opponents[name]
+        return True
+
+    def start(self):
+        if self.status != 'open':
+            raise ValueError("the tournament has already started")
+        if len(self.entrants) < 2:
+            raise ValueError("a tournament needs at least 2 players")
+        self.status = 'running'
+        self.seed = {name: i for i, name in enumerate(self.entrants)}
+        ready = self.begin()
+        self.finish_if_done()
+        return ready
+
+    def new_series(self, a, b, stage=None, slot=None):
+        series = Series(self.next_id, a, b, self.best_of, self.stage if stage is None else stage, slot)
+        self.next_id += 1
+        self.live[series.id] = series
+        return series
+
+    def report(self, series):
+        """A handed-out series is decided; returns the series that can start now"""
+        if self.live.pop(series.id, None) is None:
+            return []
+        self.played += 1
+        self.points[series.winner] += 1
+        for name in series.players:
+            self.rounds_won[name] += series.wins[name]
+            self.opponents[name].append(series.other(name))
+        ready = self.advance(series)
+        self.finish_if_done()
+        return ready
+
+    def finish_if_done(self):
+        if self.status == 'running' and not self.live and self.done():
+            self.status = 'finished'
+
+    def summary(self):
+        return {'id': self.id, 'name': self.name, 'format': self.format, 'best_of': self.best_of,
+                'status': self.status, 'players': len(self.entrants), 'stage': self.stage,
+                'series_played': self.played, 'series_live': len(self.live)}
+
+    def standings(self, limit=None):
+        """[{'name', 'points', ...}] best first"""
+        order = sorted(self.entrants, key=self.rank_key)
+        return [self.standing(name) for name in order[:limit]]
+
+    def standing(self, name):
+        return {'name': name, 'points': self.points[name]}
+
+    def rank_key(self, name):
+        return (-self.points[name], self.seed.get(name, 0))
+
+    # Format hooks
+    def begin(self):
+        raise NotImplementedError
+
+    def advance(self, series):
+        raise NotImplementedError
+
+    def done(self):
+        raise NotImplementedError
+
+
+def bracket_order(size):
+    """Seed numbers (from 1) in bracket position order, e.g. 8 -> 1 8 4 5 2 7 3 6"""
+    order = [1]
+    while len(order) < size:
+        total = 2 * len(order) + 1
+        order = [seed for top in order for seed in (top, total - top)]
+    return order
+
+
+class SingleElimination(Tournament):
+
+    def begin(self):
+        size = 1 << max(1, (len(self.entrants) - 1).bit_length())
+        self.depth = size.bit_length() - 1  # rounds to the final
+        self.slots = {}  # {(stage, position): name waiting there for an opponent}
+        self.out = {}  # {name: stage it lost in}
+        self.champion = None
+        ready = []
+        players = [self.entrants[seed - 1] if seed <= len(self.entrants) else None for seed in bracket_order(size)]
+        for position in range(size // 2):
+            a, b = players[2 * position], players[2 * position + 1]
+            if b is None:
+                ready.extend(self.place(a, 1, position // 2))  # Bye
+            else:
+                ready.append(self.new_series(a, b, 0, position))
+        return ready
+
+    def place(self, name, stage, position):
+        """Move name into the bracket slot; a series starts once the slot has two players"""
+        if stage == self.depth:
+            self.champion = name
+            return []
+        waiting = self.slots.pop((stage, position), None)
+        if waiting is None:
+            self.slots[(stage, position)] = name
+            return []
+        self.stage = max(self.stage, stage)
+        return [self.new_series(waiting, name, stage, position)]
+
+    def advance(self, series):
+        self.out[series.loser] = series.stage
+        return self.place(series.winner, series.stage + 1, series.slot // 2)
+
+    def done(self):
+        return self.champion is not None
+
+    def standing(self, name):
+        entry = super().standing(name)
+        entry['eliminated_in'] = self.out.get(name)
+        return entry
+
+    def rank_key(self, name):
+        # Champion first, then by how far each got
+        return (-self.out.get(name, self.depth + (name == self.champion)), self.seed[name])
+
+
+class Swiss(Tournament):
+
+    def begin(self):
+        self.total_rounds = self.rounds or max(1, math.ceil(math.log2(len(self.entrants))))
+        self.byes = set()
+        return self.pair_round()
+
+    def pair_round(self):
+        """Pair players of equal points, skipping rematches where possible"""
+        order = sorted(self.entrants, key=lambda name: (-self.points[name], self.seed[name]))
+        if len(order) % 2:
+            # Lowest-ranked player without a bye yet sits this round out
+            bye = next((name for name in reversed(order) if name not in self.byes), order[-1])
+            order.remove(bye)
+            self.byes.add(bye)
+            self.points[bye] += 1
+        unpaired = deque(order)
+        ready = []
+        while unpaired:
+            a = unpaired.popleft()
+            met = set(self.opponents[a])
+            for i, b in enumerate(unpaired):
+                if b not in met:
+                    break
+            else:
+                i = 0  # Met everyone left: a rematch it is
+            b = unpaired[i]
+            del unpaired[i]
+            ready.append(self.new_series(a, b))
+        return ready
+
+    def advance(self, series):
+        if self.live:
+            return []  # The rest of this round is still being played
+        if self.stage + 1 >= self.total_rounds:
+            return []
+        self.stage += 1
+        return self.pair_round()
+
+    def done(self):
+        return self.stage + 1 >= self.total_rounds
+
+    def buchholz(self, name):
+        return sum(self.points[opponent] for opponent in self.opponents[name])
+
+    def standing(self, name):
+        entry = super().standing(name)
+        entry['buchholz'] = self.buchholz(name)
+        return entry
+
+    def rank_key(self, name):
+        return (-self.points[name], -self.buchholz(name), self.seed[name])
+
+
+class RoundRobin(Tournament):
+
+    def begin(self):
+        players = list(self.entrants)
+        if len(players) % 2:
+            players.append(None)  # Whoever meets None has a bye that round
+        n = len(players)
+        self.queues = {name: deque() for name in self.entrants}  # {name: their series, in round order}
+        self.pending = 0
+        for stage in range(n - 1):
+            for i in range(n // 2):
+                a, b = players[i], players[n - 1 - i]
+                if a is not None and b is not None:
+                    series = Series(None, a, b, self.best_of, stage)
+                    self.queues[a].append(series)
+                    self.queues[b].append(series)
+                    self.pending += 1
+            # Circle method: keep the first player fixed, rotate the rest
+            players.insert(1, players.pop())
+        ready = []
+        for name in self.entrants:
+            ready.extend(self.release(name))
+        return ready
+
+    def release(self, name):
+        """Hand out name's next series if it is also its opponent's next"""
+        queue = self.queues[name]
+        if not queue:
+            return []
+        series = queue[0]
+        if series.id is not None or self.queues[series.other(name)][0] is not series:
+            return []  # Already handed out, or the opponent is still busy
+        series.id = self.next_id
+        self.next_id += 1
+        self.live[series.id] = series
+        self.stage = max(self.stage, series.stage)
+        return [series]
+
+    def advance(self, series):
+        self.pending -= 1
+        ready = []
+        for name in series.players:
+            self.queues[name].popleft()
+        for name in series.players:
+            ready.extend(self.release(name))
+        return ready
+
+    def done(self):
+        return self.pending == 0
+
+    def rank_key(self, name):
+        # Then by rounds won across all series
+        return (-self.points[name], -self.rounds_won[name], self.seed[name])
+
+
+TOURNAMENT_TYPES = {'single_elimination': SingleElimination, 'swiss': Swiss, 'round_robin': RoundRobin}
+
+
+def create(tournament_id, fmt, best_of=3, rounds=None, name=None, owner=None):
+    cls = TOURNAMENT_TYPES.get(fmt)
+    if cls is None:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return cls(tournament_id, fmt, best_of, rounds, name, owner)